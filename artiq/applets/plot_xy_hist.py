@@ -97,14 +97,17 @@ class XYHistPlot(QtWidgets.QSplitter):
             if mod["action"] != "setitem":
                 return False
             if mod["path"] == [self.args.xs, 1]:
-                if mod["key"] == self.selected_index:
+                if (isinstance(mod["key"], (slice, tuple))
+                        or mod["key"] == self.selected_index):
                     return False
             elif mod["path"][:2] == [self.args.histograms_counts, 1]:
                 if len(mod["path"]) > 2:
                     index = mod["path"][2]
                 else:
                     index = mod["key"]
-                if index == self.selected_index:
+                # slices may cover the selected point
+                if (isinstance(index, (slice, tuple))
+                        or index == self.selected_index):
                     return False
             else:
                 return False
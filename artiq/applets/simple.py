@@ -19,7 +19,7 @@ class AppletIPCClient(AsyncioChildComm):
         self.close_cb = close_cb
 
     def write_pyon(self, obj):
-        self.write(pyon.encode(obj).encode() + b"\n")
+        self.write(pyon.encode_to_bytes(obj, end=b"\n"))
 
     async def read_pyon(self):
         line = await self.readline()
@@ -5,7 +5,7 @@ the references to the host objects and translates the functions
 annotated as ``@kernel`` when they are referenced.
 """
 
-import sys, os, re, linecache, inspect, textwrap, types as pytypes
+import sys, os, re, linecache, inspect, textwrap, hashlib, types as pytypes
 from collections import OrderedDict, defaultdict
 
 from pythonparser import ast, algorithm, source, diagnostic, parse_buffer
@@ -84,6 +84,13 @@ class EmbeddingMap:
     def retrieve_object(self, obj_key):
         return self.object_forward_map[obj_key]
 
+    def restore_object(self, obj_key, obj_ref):
+        # Used when the key was allocated by a previous compilation
+        # of the same kernel (see kernel_cache.py).
+        self.object_forward_map[obj_key] = obj_ref
+        self.object_reverse_map[id(obj_ref)] = obj_key
+        self.object_current_key = max(self.object_current_key, obj_key)
+
     def iter_objects(self):
         for obj_id in self.object_forward_map.keys():
             obj_ref = self.object_forward_map[obj_id]
@@ -568,6 +575,130 @@ class TypedtreeHasher(algorithm.Visitor):
             fields = fields + node._types
         return hash(tuple(freeze(getattr(node, field_name)) for field_name in fields))
 
+class TypedtreeDigester(algorithm.Visitor):
+    """
+    Computes a digest of a finalized typed tree together with all host values
+    it quotes, suitable as a key for caching compilation results across
+    interpreter sessions.
+
+    Unlike :class:`TypedtreeHasher`, which only tracks types in order to detect
+    the fixed point of inference, the digest covers every field and location
+    of every node, and the host values reachable from :class:`asttyped.QuoteT`
+    nodes are traversed in the same way as the LLVM IR generator embeds them.
+
+    :ivar objects: (list) host objects with an ``__objectid__`` attribute,
+        in the order they were first reached
+    """
+
+    def __init__(self, embedding_map):
+        self.embedding_map = embedding_map
+        self.type_printer = types.TypePrinter()
+        self.objects = []
+        self.object_indices = {}
+        self._hash = hashlib.sha256()
+
+    def update(self, *items):
+        for item in items:
+            self._hash.update(str(item).encode("utf-8"))
+            self._hash.update(b"\0")
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def object_index(self, obj_ref):
+        """Returns the position of `obj_ref` in :attr:`objects`, or ``None``."""
+        return self.object_indices.get(id(obj_ref))
+
+    def _loc(self, loc):
+        if loc is None:
+            return None
+        return "{}:{}:{}".format(loc.source_buffer.name, loc.line(), loc.column())
+
+    def _type(self, typ):
+        return self.type_printer.name(typ)
+
+    def _freeze(self, obj):
+        if isinstance(obj, ast.AST):
+            self.visit(obj)
+        elif isinstance(obj, list):
+            self.update("[", len(obj))
+            for elt in obj:
+                self._freeze(elt)
+        elif isinstance(obj, types.Type):
+            self.update(self._type(obj))
+        else:
+            self.update(repr(obj))
+
+    def generic_visit(self, node):
+        self.update(type(node).__name__, self._loc(getattr(node, "loc", None)))
+
+        fields = node._fields
+        if hasattr(node, '_types'):
+            fields = fields + node._types
+        for field_name in fields:
+            self._freeze(getattr(node, field_name))
+
+        if hasattr(node, "typing_env"):
+            for name in sorted(node.typing_env):
+                self.update(name, self._type(node.typing_env[name]))
+        if hasattr(node, "flags"):
+            self.update(sorted(node.flags))
+
+    def visit_QuoteT(self, node):
+        self.update("QuoteT", self._loc(node.loc), self._type(node.type))
+        self._quote(node.value, node.type)
+
+    def _quote(self, value, typ):
+        # Mirrors LLVMIRGenerator._quote.
+        if id(value) in self.object_indices:
+            self.update("object", self.object_indices[id(value)])
+            return
+
+        typ = typ.find()
+        if types.is_constructor(typ) or types.is_instance(typ):
+            if types.is_instance(typ):
+                self._quote(type(value), typ.constructor)
+
+            self.update("attributes", self._type(typ))
+            if types.is_instance(typ):
+                # Attributes declared in kernel_invariants are loaded once
+                # and hoisted, which changes the generated code.
+                self.update("constant_attributes", sorted(typ.constant_attributes))
+            for attr in typ.attributes:
+                if attr == "__objectid__":
+                    self.object_indices[id(value)] = len(self.objects)
+                    self.objects.append(value)
+                    self.update(attr)
+                else:
+                    attrvalue = getattr(value, attr)
+                    is_class_function = (types.is_constructor(typ) and
+                                         types.is_function(typ.attributes[attr]) and
+                                         not types.is_c_function(typ.attributes[attr]))
+                    if is_class_function:
+                        attrvalue = self.embedding_map.specialize_function(typ.instance,
+                                                                           attrvalue)
+                    self.update(attr)
+                    self._quote(attrvalue, typ.attributes[attr])
+        elif builtins.is_none(typ) or builtins.is_bool(typ) or \
+                builtins.is_float(typ) or builtins.is_str(typ):
+            self.update(repr(value))
+        elif builtins.is_int(typ):
+            self.update(int(value))
+        elif builtins.is_list(typ):
+            elt_type = builtins.get_iterable_elt(typ)
+            self.update("list", len(value))
+            for elt in value:
+                self._quote(elt, elt_type)
+        elif types.is_rpc(typ) or types.is_c_function(typ):
+            pass
+        elif types.is_function(typ):
+            self.update(self.embedding_map.retrieve_function(value))
+        elif types.is_method(typ):
+            self._quote(value.__func__, types.get_method_function(typ))
+            self._quote(value.__self__, types.get_method_self(typ))
+        else:
+            raise ValueError("cannot digest quoted value of type {}".format(self._type(typ)))
+
 class Stitcher:
     def __init__(self, core, dmgr, engine=None):
         self.core = core
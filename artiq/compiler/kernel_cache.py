@@ -0,0 +1,179 @@
+"""
+The :class:`KernelCache` class stores the results of kernel compilation
+on disk, so that a kernel whose stitched typed tree and embedded host values
+did not change since a previous compilation (possibly in another process)
+is not optimized and linked again.
+"""
+
+import os, shutil, tempfile, logging
+
+from .. import __version__ as artiq_version
+from ..protocols import pyon
+from .embedding import TypedtreeDigester
+
+
+logger = logging.getLogger(__name__)
+
+
+class KernelCacheKey:
+    """
+    Identifies the compilation result of a finalized :class:`Stitcher`.
+
+    :ivar digest: (string) hex digest used as the cache entry name
+    :ivar digester: (:class:`TypedtreeDigester`) the digester, which
+        tracks the host objects embedded in the kernel
+    :ivar stitched_objects: (int) number of objects that were present in
+        the embedding map before code generation
+    """
+
+    def __init__(self, stitcher, target, ref_period):
+        self.digester = TypedtreeDigester(stitcher.embedding_map)
+        self.digester.update("artiq", artiq_version,
+                             target.triple, target.data_layout,
+                             ",".join(target.features), repr(ref_period))
+        self.digester.visit(stitcher.typedtree)
+        self.digest = self.digester.hexdigest()
+        self.stitched_objects = stitcher.embedding_map.object_current_key
+
+
+class KernelCache:
+    """
+    A persistent, content-addressed cache of compiled kernel libraries.
+
+    Each entry is a directory named after the :class:`KernelCacheKey` digest,
+    containing the unstripped library (used for symbolization), the stripped
+    library (sent to the core device) and the objects that code generation
+    added to the embedding map, recorded by their position in the traversal
+    of the quoted host values.
+
+    Entries are evicted in least recently used order once the total size
+    of the cache exceeds ``max_size``.
+
+    :param path: directory holding the cache; created if it does not exist
+    :param max_size: maximum total size of the cache entries, in bytes
+    """
+
+    def __init__(self, path, max_size=64*1024*1024):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_stats(self):
+        """Returns a dictionary of the hit, miss and eviction counts
+        of this cache instance."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key.digest)
+
+    def get(self, key, embedding_map):
+        """
+        Looks up the entry for `key`. On a hit, restores the objects added
+        to the embedding map by code generation into `embedding_map`
+        and returns a ``(library, stripped_library)`` tuple.
+        On a miss, returns ``None``.
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with open(os.path.join(entry_path, "library.elf"), "rb") as f:
+                library = f.read()
+            with open(os.path.join(entry_path, "stripped.elf"), "rb") as f:
+                stripped_library = f.read()
+            embedding = pyon.load_file(os.path.join(entry_path, "embedding.pyon"))
+        except (OSError, ValueError):
+            self.misses += 1
+            logger.debug("kernel cache miss for %s", key.digest)
+            return None
+
+        if embedding["stitched_objects"] != key.stitched_objects:
+            self.misses += 1
+            logger.warning("kernel cache entry %s does not match the embedding map, ignored",
+                           key.digest)
+            return None
+
+        for obj_key, index in embedding["objects"].items():
+            embedding_map.restore_object(obj_key, key.digester.objects[index])
+
+        try:
+            # Record the access for LRU eviction.
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+        self.hits += 1
+        logger.debug("kernel cache hit for %s", key.digest)
+        return library, stripped_library
+
+    def put(self, key, embedding_map, library, stripped_library):
+        """
+        Stores the compilation result for `key`. `embedding_map` must be
+        the embedding map as it is after code generation.
+        """
+        objects = {}
+        for obj_key, obj_ref in embedding_map.object_forward_map.items():
+            if obj_key <= key.stitched_objects:
+                continue
+            index = key.digester.object_index(obj_ref)
+            if index is None:
+                logger.debug("kernel %s embeds an untracked object %r, not caching",
+                             key.digest, obj_ref)
+                return
+            objects[obj_key] = index
+
+        embedding = {
+            "stitched_objects": key.stitched_objects,
+            "objects": objects
+        }
+
+        temp_path = tempfile.mkdtemp(dir=self.path, prefix=".")
+        try:
+            with open(os.path.join(temp_path, "library.elf"), "wb") as f:
+                f.write(library)
+            with open(os.path.join(temp_path, "stripped.elf"), "wb") as f:
+                f.write(stripped_library)
+            pyon.store_file(os.path.join(temp_path, "embedding.pyon"), embedding)
+            os.rename(temp_path, self._entry_path(key))
+        except OSError:
+            # Most likely another process has stored the same entry
+            # in the meantime.
+            shutil.rmtree(temp_path, ignore_errors=True)
+        else:
+            logger.debug("kernel %s stored in cache", key.digest)
+
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        total_size = 0
+        for de in os.scandir(self.path):
+            if de.name.startswith(".") or not de.is_dir():
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(de.path))
+                entries.append((de.stat().st_mtime, size, de.path))
+            except OSError:
+                continue
+            total_size += size
+
+        entries.sort()
+        for _, size, entry_path in entries:
+            if total_size <= self.max_size:
+                break
+            logger.debug("evicting kernel cache entry %s", entry_path)
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total_size -= size
+            self.evictions += 1
+
+    def clear(self):
+        """Removes all entries from the cache."""
+        for de in os.scandir(self.path):
+            if de.is_dir():
+                shutil.rmtree(de.path, ignore_errors=True)
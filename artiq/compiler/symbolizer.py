@@ -0,0 +1,599 @@
+"""
+The :class:`Symbolizer` class maps return addresses in a kernel library
+to source locations. It reads the ELF sections and the DWARF line and
+debugging information of the unstripped library itself, so it does not
+spawn ``addr2line``, and it parses them only once per library.
+
+Only DWARF versions 2 to 4 are understood; :class:`SymbolizerError`
+is raised for anything else.
+"""
+
+import struct, hashlib, logging
+from bisect import bisect_right
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+class SymbolizerError(Exception):
+    """Raised when a library cannot be symbolized."""
+    pass
+
+
+# DWARF constants
+_DW_TAG_compile_unit      = 0x11
+_DW_TAG_inlined_subroutine = 0x1d
+_DW_TAG_subprogram        = 0x2e
+
+_DW_AT_stmt_list          = 0x10
+_DW_AT_low_pc             = 0x11
+_DW_AT_high_pc            = 0x12
+_DW_AT_name               = 0x03
+_DW_AT_comp_dir           = 0x1b
+_DW_AT_abstract_origin    = 0x31
+_DW_AT_specification      = 0x47
+_DW_AT_ranges             = 0x55
+_DW_AT_call_column        = 0x57
+_DW_AT_call_file          = 0x58
+_DW_AT_call_line          = 0x59
+_DW_AT_linkage_name       = 0x6e
+_DW_AT_MIPS_linkage_name  = 0x2007
+
+_DW_FORM_addr             = 0x01
+
+_SHT_NOBITS = 8
+
+
+class _Reader:
+    def __init__(self, data, endian, offset=0):
+        self.data = data
+        self.endian = endian
+        self.offset = offset
+
+    def _unpack(self, fmt, size):
+        value, = struct.unpack_from(self.endian + fmt, self.data, self.offset)
+        self.offset += size
+        return value
+
+    def u8(self):
+        value = self.data[self.offset]
+        self.offset += 1
+        return value
+
+    def s8(self):
+        return self._unpack("b", 1)
+
+    def u16(self):
+        return self._unpack("H", 2)
+
+    def u32(self):
+        return self._unpack("I", 4)
+
+    def u64(self):
+        return self._unpack("Q", 8)
+
+    def uint(self, size):
+        if size == 1:
+            return self.u8()
+        elif size == 2:
+            return self.u16()
+        elif size == 4:
+            return self.u32()
+        elif size == 8:
+            return self.u64()
+        else:
+            raise SymbolizerError("unsupported integer size {}".format(size))
+
+    def uleb(self):
+        result = shift = 0
+        while True:
+            byte = self.data[self.offset]
+            self.offset += 1
+            result |= (byte & 0x7f) << shift
+            shift += 7
+            if byte & 0x80 == 0:
+                return result
+
+    def sleb(self):
+        result = shift = 0
+        while True:
+            byte = self.data[self.offset]
+            self.offset += 1
+            result |= (byte & 0x7f) << shift
+            shift += 7
+            if byte & 0x80 == 0:
+                if byte & 0x40:
+                    result -= 1 << shift
+                return result
+
+    def cstr(self):
+        end = self.data.index(b"\x00", self.offset)
+        value = bytes(self.data[self.offset:end]).decode("utf-8", errors="replace")
+        self.offset = end + 1
+        return value
+
+    def initial_length(self):
+        """Reads a unit length; returns ``(length, offset_size)``."""
+        length = self.u32()
+        if length == 0xffffffff:
+            return self.u64(), 8
+        elif length >= 0xfffffff0:
+            raise SymbolizerError("reserved unit length {:#x}".format(length))
+        return length, 4
+
+
+def _read_sections(library):
+    if library[:4] != b"\x7fELF":
+        raise SymbolizerError("not an ELF file")
+    if library[4] == 1:
+        header_fmt, section_fmt = "HHIIIIIHHHHHH", "IIIIIIIIII"
+    elif library[4] == 2:
+        header_fmt, section_fmt = "HHIQQQIHHHHHH", "IIQQQQIIQQ"
+    else:
+        raise SymbolizerError("unknown ELF class {}".format(library[4]))
+    endian = "<" if library[5] == 1 else ">"
+
+    (e_type, e_machine, e_version, e_entry, e_phoff, e_shoff, e_flags,
+     e_ehsize, e_phentsize, e_phnum, e_shentsize, e_shnum, e_shstrndx) = \
+        struct.unpack_from(endian + header_fmt, library, 16)
+
+    headers = []
+    for index in range(e_shnum):
+        (sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size,
+         sh_link, sh_info, sh_addralign, sh_entsize) = \
+            struct.unpack_from(endian + section_fmt, library, e_shoff + index * e_shentsize)
+        headers.append((sh_name, sh_type, sh_offset, sh_size))
+
+    _, _, strtab_offset, strtab_size = headers[e_shstrndx]
+    strtab = library[strtab_offset:strtab_offset + strtab_size]
+
+    sections = {}
+    for sh_name, sh_type, sh_offset, sh_size in headers:
+        if sh_type == _SHT_NOBITS:
+            continue
+        name = bytes(strtab[sh_name:strtab.index(b"\x00", sh_name)]).decode("ascii")
+        sections[name] = library[sh_offset:sh_offset + sh_size]
+    return endian, sections
+
+
+def _parse_line_program(data, endian, offset, comp_dir):
+    """Parses the line number program at `offset`, and returns a list
+    of file names and a list of sequences of
+    ``(address, file, line, column)`` rows. The last row of every
+    sequence marks its end."""
+    reader = _Reader(data, endian, offset)
+    unit_length, offset_size = reader.initial_length()
+    end = reader.offset + unit_length
+    version = reader.u16()
+    if not 2 <= version <= 4:
+        raise SymbolizerError("unsupported line table version {}".format(version))
+    header_length = reader.uint(offset_size)
+    program_start = reader.offset + header_length
+    min_inst_length = reader.u8()
+    if version >= 4:
+        reader.u8() # maximum_operations_per_instruction; VLIW only
+    default_is_stmt = reader.u8()
+    line_base = reader.s8()
+    line_range = reader.u8()
+    opcode_base = reader.u8()
+    standard_opcode_lengths = [reader.u8() for _ in range(opcode_base - 1)]
+
+    directories = [comp_dir]
+    while True:
+        directory = reader.cstr()
+        if directory == "":
+            break
+        if comp_dir is not None and not directory.startswith("/"):
+            directory = comp_dir + "/" + directory
+        directories.append(directory)
+
+    def make_filename(name, directory_index):
+        if name.startswith("/") or directory_index >= len(directories) or \
+                directories[directory_index] is None:
+            return name
+        return directories[directory_index] + "/" + name
+
+    files = [None] # file indices start at 1
+    while True:
+        name = reader.cstr()
+        if name == "":
+            break
+        directory_index = reader.uleb()
+        reader.uleb() # modification time
+        reader.uleb() # length
+        files.append(make_filename(name, directory_index))
+
+    sequences = []
+    rows = []
+    reader.offset = program_start
+    address, file, line, column = 0, 1, 1, 0
+    while reader.offset < end:
+        opcode = reader.u8()
+        if opcode >= opcode_base:
+            adjusted = opcode - opcode_base
+            address += (adjusted // line_range) * min_inst_length
+            line += line_base + adjusted % line_range
+            rows.append((address, file, line, column))
+        elif opcode == 0: # extended opcode
+            length = reader.uleb()
+            next_offset = reader.offset + length
+            extended_opcode = reader.u8()
+            if extended_opcode == 1: # DW_LNE_end_sequence
+                rows.append((address, file, line, column))
+                sequences.append(rows)
+                rows = []
+                address, file, line, column = 0, 1, 1, 0
+            elif extended_opcode == 2: # DW_LNE_set_address
+                address = reader.uint(length - 1)
+            elif extended_opcode == 3: # DW_LNE_define_file
+                name = reader.cstr()
+                directory_index = reader.uleb()
+                files.append(make_filename(name, directory_index))
+            reader.offset = next_offset
+        elif opcode == 1: # DW_LNS_copy
+            rows.append((address, file, line, column))
+        elif opcode == 2: # DW_LNS_advance_pc
+            address += reader.uleb() * min_inst_length
+        elif opcode == 3: # DW_LNS_advance_line
+            line += reader.sleb()
+        elif opcode == 4: # DW_LNS_set_file
+            file = reader.uleb()
+        elif opcode == 5: # DW_LNS_set_column
+            column = reader.uleb()
+        elif opcode == 8: # DW_LNS_const_add_pc
+            address += ((255 - opcode_base) // line_range) * min_inst_length
+        elif opcode == 9: # DW_LNS_fixed_advance_pc
+            address += reader.u16()
+        else:
+            # DW_LNS_negate_stmt, DW_LNS_set_basic_block, DW_LNS_prologue_end,
+            # DW_LNS_epilogue_begin, DW_LNS_set_isa and unknown opcodes
+            # do not affect the columns we use.
+            for _ in range(standard_opcode_lengths[opcode - 1]):
+                reader.uleb()
+
+    return files, sequences
+
+
+class _CompileUnit:
+    def __init__(self, offset, version, address_size, offset_size):
+        self.offset = offset
+        self.version = version
+        self.address_size = address_size
+        self.offset_size = offset_size
+        self.base_address = 0
+        self.files = [None]
+
+
+class Symbolizer:
+    """
+    Symbolizes return addresses in an unstripped kernel library.
+
+    The debugging information is parsed the first time :meth:`symbolize`
+    is called; afterwards, the library itself is no longer referenced.
+
+    :param library: the unstripped library, as bytes
+    """
+
+    def __init__(self, library):
+        self.library = library
+        self._parsed = False
+        self._error = None
+        self._cache = {}
+
+    def _read_form(self, reader, form, unit):
+        if form == 0x01: # DW_FORM_addr
+            return reader.uint(unit.address_size)
+        elif form == 0x03: # DW_FORM_block2
+            length = reader.u16()
+            reader.offset += length
+        elif form == 0x04: # DW_FORM_block4
+            length = reader.u32()
+            reader.offset += length
+        elif form == 0x05: # DW_FORM_data2
+            return reader.u16()
+        elif form == 0x06: # DW_FORM_data4
+            return reader.u32()
+        elif form == 0x07: # DW_FORM_data8
+            return reader.u64()
+        elif form == 0x08: # DW_FORM_string
+            return reader.cstr()
+        elif form == 0x09 or form == 0x18: # DW_FORM_block, DW_FORM_exprloc
+            length = reader.uleb()
+            reader.offset += length
+        elif form == 0x0a: # DW_FORM_block1
+            length = reader.u8()
+            reader.offset += length
+        elif form == 0x0b: # DW_FORM_data1
+            return reader.u8()
+        elif form == 0x0c: # DW_FORM_flag
+            return reader.u8()
+        elif form == 0x0d: # DW_FORM_sdata
+            return reader.sleb()
+        elif form == 0x0e: # DW_FORM_strp
+            offset = reader.uint(unit.offset_size)
+            return _Reader(self._debug_str, self._endian, offset).cstr()
+        elif form == 0x0f: # DW_FORM_udata
+            return reader.uleb()
+        elif form == 0x10: # DW_FORM_ref_addr
+            if unit.version == 2:
+                return reader.uint(unit.address_size)
+            return reader.uint(unit.offset_size)
+        elif form == 0x11: # DW_FORM_ref1
+            return unit.offset + reader.u8()
+        elif form == 0x12: # DW_FORM_ref2
+            return unit.offset + reader.u16()
+        elif form == 0x13: # DW_FORM_ref4
+            return unit.offset + reader.u32()
+        elif form == 0x14: # DW_FORM_ref8
+            return unit.offset + reader.u64()
+        elif form == 0x15: # DW_FORM_ref_udata
+            return unit.offset + reader.uleb()
+        elif form == 0x16: # DW_FORM_indirect
+            return self._read_form(reader, reader.uleb(), unit)
+        elif form == 0x17: # DW_FORM_sec_offset
+            return reader.uint(unit.offset_size)
+        elif form == 0x19: # DW_FORM_flag_present
+            return True
+        elif form == 0x20: # DW_FORM_ref_sig8
+            return reader.u64()
+        else:
+            raise SymbolizerError("unsupported attribute form {:#x}".format(form))
+
+    def _parse_abbrevs(self, offset):
+        reader = _Reader(self._debug_abbrev, self._endian, offset)
+        abbrevs = {}
+        while True:
+            code = reader.uleb()
+            if code == 0:
+                return abbrevs
+            tag = reader.uleb()
+            has_children = reader.u8()
+            attributes = []
+            while True:
+                name, form = reader.uleb(), reader.uleb()
+                if name == 0 and form == 0:
+                    break
+                attributes.append((name, form))
+            abbrevs[code] = tag, has_children, attributes
+
+    def _read_ranges(self, offset, unit):
+        reader = _Reader(self._debug_ranges, self._endian, offset)
+        max_address = (1 << (8 * unit.address_size)) - 1
+        base_address = unit.base_address
+        ranges = []
+        while True:
+            begin = reader.uint(unit.address_size)
+            end = reader.uint(unit.address_size)
+            if begin == 0 and end == 0:
+                return ranges
+            elif begin == max_address:
+                base_address = end
+            elif begin != end:
+                ranges.append((base_address + begin, base_address + end))
+
+    def _die_ranges(self, attributes, forms, unit):
+        if _DW_AT_ranges in attributes:
+            return self._read_ranges(attributes[_DW_AT_ranges], unit)
+        elif _DW_AT_low_pc in attributes and _DW_AT_high_pc in attributes:
+            low_pc = attributes[_DW_AT_low_pc]
+            high_pc = attributes[_DW_AT_high_pc]
+            if forms[_DW_AT_high_pc] != _DW_FORM_addr:
+                high_pc += low_pc
+            if high_pc > low_pc:
+                return [(low_pc, high_pc)]
+        return []
+
+    def _parse_units(self):
+        info = self._debug_info
+        reader = _Reader(info, self._endian)
+        while reader.offset < len(info):
+            unit_offset = reader.offset
+            unit_length, offset_size = reader.initial_length()
+            end = reader.offset + unit_length
+            version = reader.u16()
+            if not 2 <= version <= 4:
+                raise SymbolizerError("unsupported DWARF version {}".format(version))
+            abbrev_offset = reader.uint(offset_size)
+            address_size = reader.u8()
+            unit = _CompileUnit(unit_offset, version, address_size, offset_size)
+            abbrevs = self._parse_abbrevs(abbrev_offset)
+
+            # Stack of (depth, scope) for the enclosing function scopes.
+            depth = 0
+            scopes = []
+            while reader.offset < end:
+                die_offset = reader.offset
+                code = reader.uleb()
+                if code == 0:
+                    depth -= 1
+                    while scopes and scopes[-1][0] > depth:
+                        scopes.pop()
+                    continue
+
+                tag, has_children, attribute_specs = abbrevs[code]
+                attributes = {}
+                forms = {}
+                for name, form in attribute_specs:
+                    attributes[name] = self._read_form(reader, form, unit)
+                    forms[name] = form
+
+                if any(name in attributes for name in
+                        (_DW_AT_name, _DW_AT_linkage_name, _DW_AT_MIPS_linkage_name,
+                         _DW_AT_abstract_origin, _DW_AT_specification)):
+                    self._names[die_offset] = (
+                        attributes.get(_DW_AT_linkage_name,
+                                       attributes.get(_DW_AT_MIPS_linkage_name)),
+                        attributes.get(_DW_AT_name),
+                        attributes.get(_DW_AT_abstract_origin,
+                                       attributes.get(_DW_AT_specification)))
+
+                if tag == _DW_TAG_compile_unit:
+                    unit.base_address = attributes.get(_DW_AT_low_pc, 0)
+                    if _DW_AT_stmt_list in attributes:
+                        files, sequences = _parse_line_program(
+                            self._debug_line, self._endian, attributes[_DW_AT_stmt_list],
+                            attributes.get(_DW_AT_comp_dir))
+                        unit.files = files
+                        self._add_sequences(files, sequences)
+                elif tag in (_DW_TAG_subprogram, _DW_TAG_inlined_subroutine):
+                    parent = scopes[-1][1] if scopes else None
+                    call_file = attributes.get(_DW_AT_call_file)
+                    if call_file is not None and call_file < len(unit.files):
+                        call_file = unit.files[call_file]
+                    else:
+                        call_file = None
+                    scope = (die_offset, parent, call_file,
+                             attributes.get(_DW_AT_call_line, 0),
+                             attributes.get(_DW_AT_call_column, 0))
+                    # A scope without any address ranges is still a part
+                    # of the inlining chain of its children.
+                    ranges = self._die_ranges(attributes, forms, unit)
+                    if ranges:
+                        self._scopes.append((ranges, len(scopes), scope))
+                    if has_children:
+                        scopes.append((depth + 1, scope))
+
+                if has_children:
+                    depth += 1
+
+            reader.offset = end
+
+    def _add_sequences(self, files, sequences):
+        for rows in sequences:
+            for (address, file, line, column), (next_address, *_) in zip(rows, rows[1:]):
+                if next_address <= address:
+                    continue
+                filename = files[file] if 0 < file < len(files) else None
+                self._lines.append((address, next_address, filename, line, column))
+
+    def _parse(self):
+        self._endian, sections = _read_sections(self.library)
+        self._debug_info = sections.get(".debug_info", b"")
+        self._debug_abbrev = sections.get(".debug_abbrev", b"")
+        self._debug_line = sections.get(".debug_line", b"")
+        self._debug_ranges = sections.get(".debug_ranges", b"")
+        self._debug_str = sections.get(".debug_str", b"")
+
+        # (low, high, filename, line, column), sorted by low
+        self._lines = []
+        # ([(low, high), ...], depth, scope)
+        self._scopes = []
+        # die offset -> (linkage name, name, origin die offset)
+        self._names = {}
+
+        self._parse_units()
+        self._lines.sort()
+        self._line_starts = [low for low, *_ in self._lines]
+        # deepest first, so that the innermost scope is found first
+        self._scopes.sort(key=lambda scope: -scope[1])
+
+        del self._debug_info, self._debug_abbrev, self._debug_line, \
+            self._debug_ranges, self._debug_str
+
+    def _ensure_parsed(self):
+        if self._error is not None:
+            raise self._error
+        if self._parsed:
+            return
+        try:
+            self._parse()
+        except (SymbolizerError, struct.error, IndexError, KeyError, ValueError) as error:
+            if isinstance(error, SymbolizerError):
+                self._error = error
+            else:
+                self._error = SymbolizerError("malformed debug information: {}".format(error))
+            raise self._error from error
+        self._parsed = True
+        self.library = None
+
+    def _function_name(self, die_offset):
+        seen = set()
+        while die_offset is not None and die_offset not in seen:
+            seen.add(die_offset)
+            linkage_name, name, origin = self._names.get(die_offset, (None, None, None))
+            if linkage_name is not None:
+                return linkage_name
+            if name is not None:
+                return name
+            die_offset = origin
+        return "??"
+
+    def _lookup_line(self, address):
+        index = bisect_right(self._line_starts, address) - 1
+        if index >= 0:
+            low, high, filename, line, column = self._lines[index]
+            if address < high:
+                return filename, line, column
+        return None, 0, 0
+
+    def _innermost_scope(self, address):
+        for ranges, depth, scope in self._scopes:
+            for low, high in ranges:
+                if low <= address < high:
+                    return scope
+        return None
+
+    def _symbolize_one(self, address):
+        # We got a return address, i.e. the address of the instruction
+        # just after the call. Offset it back to get an address somewhere
+        # inside the call instruction (or its delay slot), since that's what
+        # the backtrace entry should point at.
+        filename, line, column = self._lookup_line(address - 1)
+        scope = self._innermost_scope(address - 1)
+
+        backtrace = []
+        while True:
+            if scope is None:
+                function = "??"
+            else:
+                die_offset, parent, call_file, call_line, call_column = scope
+                function = self._function_name(die_offset)
+            if filename is not None and filename != "<synthesized>":
+                backtrace.append((filename, line, column if column else -1,
+                                  function, address))
+            if scope is None or parent is None:
+                break
+            # The scope was inlined into the parent; continue from the call site.
+            filename, line, column = call_file, call_line, call_column
+            scope = parent
+        return backtrace
+
+    def symbolize(self, addresses):
+        """
+        Maps a list of return addresses to a list of
+        ``(filename, line, column, function, address)`` tuples, innermost
+        first. An address inside inlined code produces one tuple for
+        the inlined function and one for every call site it was inlined
+        through. Functions are reported by their linkage name;
+        ``column`` is -1 when it is not known.
+
+        :raises SymbolizerError: if the debugging information of the
+            library cannot be parsed.
+        """
+        self._ensure_parsed()
+        backtrace = []
+        for address in addresses:
+            if address not in self._cache:
+                self._cache[address] = self._symbolize_one(address)
+            backtrace += self._cache[address]
+        return backtrace
+
+
+_symbolizers = OrderedDict()
+_max_symbolizers = 16
+
+
+def get_symbolizer(library):
+    """Returns a :class:`Symbolizer` for `library`, sharing it with previous
+    calls for a library with the same contents. The most recently used
+    symbolizers are kept."""
+    digest = hashlib.sha256(library).digest()
+    try:
+        symbolizer = _symbolizers.pop(digest)
+    except KeyError:
+        symbolizer = Symbolizer(library)
+    _symbolizers[digest] = symbolizer
+    while len(_symbolizers) > _max_symbolizers:
+        _symbolizers.popitem(last=False)
+    return symbolizer
@@ -1,15 +1,22 @@
-import os, sys, tempfile, subprocess
+import os, sys, tempfile, subprocess, time, logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from artiq.compiler import types
+from artiq.compiler.symbolizer import SymbolizerError, get_symbolizer
 from llvmlite_artiq import ir as ll, binding as llvm
 
 llvm.initialize()
 llvm.initialize_all_targets()
 llvm.initialize_all_asmprinters()
 
+logger = logging.getLogger(__name__)
+
 class RunTool:
-    def __init__(self, pattern, **tempdata):
+    def __init__(self, pattern, stdin=None, **tempdata):
         self.files = []
         self.pattern = pattern
+        self.stdin = stdin
         self.tempdata = tempdata
 
     def maketemp(self, data):
@@ -30,8 +37,13 @@ class RunTool:
         for argument in self.pattern:
             cmdline.append(argument.format(**tempnames))
 
-        process = subprocess.Popen(cmdline, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = process.communicate()
+        if self.stdin is None:
+            stdin = subprocess.DEVNULL
+        else:
+            stdin = subprocess.PIPE
+        process = subprocess.Popen(cmdline, stdin=stdin,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate(self.stdin)
         if process.returncode != 0:
             raise Exception("{} invocation failed: {}".
                             format(cmdline[0], stderr.decode('utf-8')))
@@ -80,6 +92,17 @@ class Target:
 
     def __init__(self):
         self.llcontext = ll.Context()
+        self.timings = OrderedDict()
+
+    @contextmanager
+    def _timed(self, stage):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            self.timings[stage] = self.timings.get(stage, 0.0) + elapsed
+            logger.debug("%s: %.1fms", stage, elapsed*1000)
 
     def target_machine(self):
         lltarget = llvm.Target.from_triple(self.triple)
@@ -125,6 +148,10 @@ class Target:
 
     def compile(self, module):
         """Compile the module to a relocatable object for this target."""
+        return self.optimize_llvm_ir(self.generate_llvm_ir(module))
+
+    def generate_llvm_ir(self, module):
+        """Generate the LLVM IR text of the module."""
 
         if os.getenv("ARTIQ_DUMP_SIG"):
             print("====== MODULE_SIGNATURE DUMP ======", file=sys.stderr)
@@ -134,19 +161,27 @@ class Target:
         _dump(os.getenv("ARTIQ_DUMP_IR"), "ARTIQ IR", ".txt",
               lambda: "\n".join(fn.as_entity(type_printer) for fn in module.artiq_ir))
 
-        llmod = module.build_llvm_ir(self)
+        with self._timed("LLVM IR generation"):
+            return str(module.build_llvm_ir(self))
 
-        try:
-            llparsedmod = llvm.parse_assembly(str(llmod))
-            llparsedmod.verify()
-        except RuntimeError:
-            _dump("", "LLVM IR (broken)", ".ll", lambda: str(llmod))
-            raise
+    def optimize_llvm_ir(self, llmod):
+        """Parse, verify and optimize the LLVM IR text `llmod`.
+        This does not depend on the ARTIQ module, and so can be done
+        in another process."""
+
+        with self._timed("LLVM IR parsing"):
+            try:
+                llparsedmod = llvm.parse_assembly(llmod)
+                llparsedmod.verify()
+            except RuntimeError:
+                _dump("", "LLVM IR (broken)", ".ll", lambda: llmod)
+                raise
 
         _dump(os.getenv("ARTIQ_DUMP_UNOPT_LLVM"), "LLVM IR (generated)", "_unopt.ll",
               lambda: str(llparsedmod))
 
-        self.optimize(llparsedmod)
+        with self._timed("LLVM optimization"):
+            self.optimize(llparsedmod)
 
         _dump(os.getenv("ARTIQ_DUMP_LLVM"), "LLVM IR (optimized)", ".ll",
               lambda: str(llparsedmod))
@@ -159,45 +194,117 @@ class Target:
         _dump(os.getenv("ARTIQ_DUMP_ASM"), "Assembly", ".s",
               lambda: llmachine.emit_assembly(llmodule))
 
-        return llmachine.emit_object(llmodule)
+        with self._timed("assembly"):
+            return llmachine.emit_object(llmodule)
 
-    def link(self, objects, init_fn):
-        """Link the relocatable objects into a shared library for this target."""
+    def _link(self, objects, init_fn, strip_debug):
         with RunTool([self.triple + "-ld", "-shared", "--eh-frame-hdr", "-init", init_fn] +
+                     (["--strip-debug"] if strip_debug else []) +
                      ["{{obj{}}}".format(index) for index in range(len(objects))] +
                      ["-o", "{output}"],
                      output=b"",
                      **{"obj{}".format(index): obj for index, obj in enumerate(objects)}) \
                 as results:
-            library = results["output"].read()
-
-            _dump(os.getenv("ARTIQ_DUMP_ELF"), "Shared library", ".so",
-                  lambda: library)
-
-            return library
+            return results["output"].read()
 
-    def compile_and_link(self, modules):
-        return self.link([self.assemble(self.compile(module)) for module in modules],
+    def link(self, objects, init_fn):
+        """Link the relocatable objects into a shared library for this target."""
+        with self._timed("linking"):
+            library = self._link(objects, init_fn, strip_debug=False)
+
+        _dump(os.getenv("ARTIQ_DUMP_ELF"), "Shared library", ".so",
+              lambda: library)
+
+        return library
+
+    def link_and_strip(self, objects, init_fn):
+        """Link the relocatable objects into a shared library for this target,
+        and return a ``(library, stripped_library)`` tuple. The stripped library
+        is linked concurrently with the unstripped one instead of being produced
+        by :meth:`strip` afterwards; debug information is a non-allocated section,
+        so both have the same layout."""
+        with self._timed("linking and stripping"), ThreadPoolExecutor(2) as executor:
+            library = executor.submit(self._link, objects, init_fn, False)
+            stripped_library = executor.submit(self._link, objects, init_fn, True)
+            library, stripped_library = library.result(), stripped_library.result()
+
+        _dump(os.getenv("ARTIQ_DUMP_ELF"), "Shared library", ".so",
+              lambda: library)
+
+        return library, stripped_library
+
+    def compile_modules(self, modules, jobs=1):
+        """Compile the modules to relocatable objects for this target.
+
+        If `jobs` is greater than one, LLVM IR is generated in this process,
+        but then optimized and assembled in a pool of `jobs` processes.
+        This requires the target to be constructible without arguments.
+        Kernels compiled by :class:`artiq.coredevice.core.Core` are made of
+        a single module, and thus always compiled in this process."""
+        if jobs <= 1 or len(modules) <= 1:
+            return [self.assemble(self.compile(module)) for module in modules]
+
+        llmods = [self.generate_llvm_ir(module) for module in modules]
+        objects = []
+        with self._timed("parallel compilation"), \
+                ProcessPoolExecutor(min(jobs, len(modules))) as executor:
+            for obj, timings in executor.map(_optimize_and_assemble,
+                                             [type(self)] * len(llmods), llmods):
+                objects.append(obj)
+                for stage, elapsed in timings.items():
+                    stage = "{} (in worker)".format(stage)
+                    self.timings[stage] = self.timings.get(stage, 0.0) + elapsed
+        return objects
+
+    def compile_and_link(self, modules, jobs=1):
+        return self.link(self.compile_modules(modules, jobs),
                          init_fn=modules[0].entry_point())
 
+    def compile_link_and_strip(self, modules, jobs=1):
+        return self.link_and_strip(self.compile_modules(modules, jobs),
+                                   init_fn=modules[0].entry_point())
+
     def strip(self, library):
-        with RunTool([self.triple + "-strip", "--strip-debug", "{library}", "-o", "{output}"],
-                     library=library, output=b"") \
+        with self._timed("stripping"), \
+                RunTool([self.triple + "-strip", "--strip-debug", "{library}", "-o", "{output}"],
+                        library=library, output=b"") \
                 as results:
             return results["output"].read()
 
+    def symbolizer(self, library):
+        """Return a function that maps a list of return addresses in
+        the unstripped `library` to a backtrace. The debug information
+        is only parsed when the function is first called, and is shared
+        between all libraries with the same contents."""
+        symbolizer = get_symbolizer(library)
+        def symbolize(addresses):
+            if addresses == []:
+                return []
+
+            try:
+                backtrace = symbolizer.symbolize(addresses)
+            except SymbolizerError as error:
+                logger.debug("cannot symbolize kernel library (%s), using addr2line", error)
+                return self._symbolize_addr2line(symbolizer.library, addresses)
+
+            functions = self.demangle([function for _, _, _, function, _ in backtrace])
+            return [(filename, line, column, function, address)
+                    for (filename, line, column, _, address), function
+                    in zip(backtrace, functions)]
+        return symbolize
+
     def symbolize(self, library, addresses):
-        if addresses == []:
-            return []
+        return self.symbolizer(library)(addresses)
 
+    def _symbolize_addr2line(self, library, addresses):
         # We got a list of return addresses, i.e. addresses of instructions
         # just after the call. Offset them back to get an address somewhere
         # inside the call instruction (or its delay slot), since that's what
         # the backtrace entry should point at.
-        offset_addresses = [hex(addr - 1) for addr in addresses]
+        offset_addresses = "".join("{:#x}\n".format(addr - 1) for addr in addresses)
         with RunTool([self.triple + "-addr2line", "--addresses",  "--functions", "--inlines",
-                      "--demangle", "--exe={library}"] + offset_addresses,
-                     library=library) \
+                      "--demangle", "--exe={library}"],
+                     stdin=offset_addresses.encode("utf-8"), library=library) \
                 as results:
             lines = iter(results["__stdout__"].rstrip().split("\n"))
             backtrace = []
@@ -222,8 +329,25 @@ class Target:
             return backtrace
 
     def demangle(self, names):
-        with RunTool([self.triple + "-c++filt"] + names) as results:
-            return results["__stdout__"].rstrip().split("\n")
+        mangled = sorted(set(name for name in names
+                             if name.startswith("_Z") and name not in _demangled_names))
+        if mangled:
+            with RunTool([self.triple + "-c++filt"],
+                         stdin="".join(name + "\n" for name in mangled).encode("utf-8")) \
+                    as results:
+                demangled = results["__stdout__"].rstrip().split("\n")
+            _demangled_names.update(zip(mangled, demangled))
+        return [_demangled_names.get(name, name) for name in names]
+
+# Only names that start with "_Z" are mangled, so that other names
+# are passed through without invoking c++filt.
+_demangled_names = {}
+
+def _optimize_and_assemble(target_class, llmod):
+    # Runs in a worker process of Target.compile_modules.
+    target = target_class()
+    obj = target.assemble(target.optimize_llvm_ir(llmod))
+    return obj, target.timings
 
 class NativeTarget(Target):
     def __init__(self):
@@ -33,5 +33,13 @@ def main():
     benchmark(lambda: OR1KTarget().compile_and_link([module]),
               "LLVM optimization and linking")
 
+    benchmark(lambda: OR1KTarget().compile_link_and_strip([module]),
+              "LLVM optimization, linking and stripping")
+
+    target = OR1KTarget()
+    target.compile_link_and_strip([module])
+    for stage, elapsed in target.timings.items():
+        print("{}: {:.2f}ms".format(stage, elapsed * 1000))
+
 if __name__ == "__main__":
     main()
@@ -1,5 +1,6 @@
 import struct
 import logging
+import hashlib
 import traceback
 from enum import Enum
 from fractions import Fraction
@@ -72,6 +73,17 @@ class CommGeneric:
         self._read_length = 0
         self._write_buffer = []
 
+        # Whether the runtime re-links a kernel library from its own copy
+        # when RUN_KERNEL is received again without LOAD_LIBRARY.
+        # Only enabled after check_ident() has found a matching runtime.
+        self.library_reuse = False
+        # Digest of the kernel library loaded in the current session, if it
+        # can be run again; it is None while a kernel is running.
+        self._loaded_library = None
+        self._running_library = None
+        self.library_uploads = 0
+        self.library_reuses = 0
+
     def open(self):
         """Opens the communication channel.
         Must do nothing if already opened."""
@@ -96,6 +108,12 @@ class CommGeneric:
     def pause(self):
         self.close()
 
+    def _session_closed(self):
+        # Must be called by subclasses when the connection is closed, as
+        # the core device then discards the loaded kernel library.
+        self._loaded_library = None
+        self._running_library = None
+
     #
     # Reader interface
     #
@@ -226,6 +244,7 @@ class CommGeneric:
 
     def reset_session(self):
         self.write(struct.pack(">ll", 0x5a5a5a5a, 0))
+        self._session_closed()
 
     def check_ident(self):
         self._write_empty(_H2DMsgType.IDENT_REQUEST)
@@ -242,6 +261,9 @@ class CommGeneric:
             logger.warning("Mismatch between gateware (%s) "
                            "and software (%s) versions",
                            gateware_version, software_version)
+            self.library_reuse = False
+        else:
+            self.library_reuse = True
 
     def switch_clock(self, external):
         self._write_header(_H2DMsgType.SWITCH_CLOCK)
@@ -296,15 +318,27 @@ class CommGeneric:
         self._read_empty(_D2HMsgType.FLASH_OK_REPLY)
 
     def load(self, kernel_library):
+        digest = hashlib.sha256(kernel_library).digest()
+        if self.library_reuse and digest == self._loaded_library:
+            logger.debug("kernel library already loaded, not uploading")
+            self.library_reuses += 1
+            return
+
+        self._loaded_library = None
         self._write_header(_H2DMsgType.LOAD_LIBRARY)
         self._write_chunk(kernel_library)
         self._write_flush()
 
         self._read_empty(_D2HMsgType.LOAD_COMPLETED)
+        self._loaded_library = digest
+        self.library_uploads += 1
 
     def run(self):
         self._write_empty(_H2DMsgType.RUN_KERNEL)
         logger.debug("running kernel")
+        # The library becomes reusable again only if the kernel terminates
+        # in a way that leaves the core device in the loaded state.
+        self._running_library, self._loaded_library = self._loaded_library, None
 
     _rpc_sentinel = object()
 
@@ -515,6 +549,7 @@ class CommGeneric:
         function  = self._read_string()
 
         backtrace = [self._read_int32() for _ in range(self._read_int32())]
+        self._loaded_library = self._running_library
 
         traceback = list(reversed(symbolizer(backtrace))) + \
                     [(filename, line, column, *demangler([function]), None)]
@@ -542,4 +577,5 @@ class CommGeneric:
                 raise exceptions.ClockFailure
             else:
                 self._read_expect(_D2HMsgType.KERNEL_FINISHED)
+                self._loaded_library = self._running_library
                 return
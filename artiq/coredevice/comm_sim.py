@@ -0,0 +1,124 @@
+"""Host-side simulation of the core device communication protocol.
+
+The simulated session follows the state machine of the runtime
+(``runtime/session.c``) closely enough to exercise the host side of the
+protocol without hardware. Kernels are not executed: running a kernel
+records the library it was loaded from and immediately reports that it has
+finished.
+"""
+
+import struct
+import logging
+
+from artiq.coredevice.comm_generic import (CommGeneric, _H2DMsgType,
+                                           _D2HMsgType)
+from artiq import __version__ as software_version
+
+
+logger = logging.getLogger(__name__)
+
+
+class SimulatedSession:
+    """Device side of a simulated session.
+
+    :ivar loads: number of kernel libraries received.
+    :ivar runs: list of the kernel libraries that were run, in order.
+    """
+    def __init__(self, ident=software_version):
+        self.ident = ident
+        self.loads = 0
+        self.runs = []
+        self.log = ""
+        self._in_buffer = b""
+        self._out_buffer = b""
+        self.reset()
+
+    def reset(self):
+        self._in_buffer = b""
+        self._loaded_library = None
+        self._stale = False
+
+    def write(self, data):
+        self._in_buffer += data
+        while len(self._in_buffer) >= 8:
+            sync, length = struct.unpack(">ll", self._in_buffer[:8])
+            if sync != 0x5a5a5a5a:
+                raise IOError("Invalid synchronization sequence")
+            if length == 0:
+                # in-band session reset
+                self._in_buffer = self._in_buffer[8:]
+                self.reset()
+                continue
+            if len(self._in_buffer) < length:
+                break
+            ty = _H2DMsgType(self._in_buffer[8])
+            payload = self._in_buffer[9:length]
+            self._in_buffer = self._in_buffer[length:]
+            self._process(ty, payload)
+
+    def read(self, length):
+        if len(self._out_buffer) < length:
+            raise IOError("Simulated core device has no reply pending")
+        data, self._out_buffer = (self._out_buffer[:length],
+                                  self._out_buffer[length:])
+        return data
+
+    def _reply(self, ty, payload=b""):
+        self._out_buffer += struct.pack(">llB", 0x5a5a5a5a,
+                                        9 + len(payload), ty.value)
+        self._out_buffer += payload
+
+    def _process(self, ty, payload):
+        logger.debug("simulated core device received %r", ty)
+        if ty == _H2DMsgType.IDENT_REQUEST:
+            self._reply(_D2HMsgType.IDENT_REPLY,
+                        b"AROR" + self.ident.encode("utf-8"))
+        elif ty == _H2DMsgType.SWITCH_CLOCK:
+            self._reply(_D2HMsgType.CLOCK_SWITCH_COMPLETED)
+        elif ty == _H2DMsgType.LOG_REQUEST:
+            self._reply(_D2HMsgType.LOG_REPLY, self.log.encode("utf-8"))
+        elif ty == _H2DMsgType.LOG_CLEAR:
+            self.log = ""
+            self._reply(_D2HMsgType.LOG_REPLY)
+        elif ty == _H2DMsgType.LOAD_LIBRARY:
+            self.loads += 1
+            self._loaded_library = payload
+            self._stale = False
+            self._reply(_D2HMsgType.LOAD_COMPLETED)
+        elif ty == _H2DMsgType.RUN_KERNEL:
+            if self._loaded_library is None:
+                self.log += "Attempted to run kernel while not in the LOADED state\n"
+                self._reply(_D2HMsgType.KERNEL_STARTUP_FAILED)
+                return
+            # A stale library is re-linked from the retained copy, which
+            # in this simulation is simply the library itself.
+            self._stale = True
+            self.runs.append(self._loaded_library)
+            self._reply(_D2HMsgType.KERNEL_FINISHED)
+        else:
+            raise NotImplementedError("{} is not simulated".format(ty))
+
+
+class Comm(CommGeneric):
+    """Core device communication driver connected to a
+    :class:`SimulatedSession` instead of a real core device."""
+    def __init__(self, dmgr=None, ident=software_version):
+        super().__init__()
+        self.session = SimulatedSession(ident)
+        self._open = False
+
+    def open(self):
+        self._open = True
+
+    def close(self):
+        if not self._open:
+            return
+        self._open = False
+        self.session.reset()
+        self._session_closed()
+
+    def read(self, length):
+        return self.session.read(length)
+
+    def write(self, data):
+        self.session.write(data)
@@ -50,6 +50,7 @@ class Comm(CommGeneric):
             return
         self.socket.close()
         del self.socket
+        self._session_closed()
         logger.debug("disconnected")
 
     def read(self, length):
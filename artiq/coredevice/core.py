@@ -11,6 +11,7 @@ from artiq.language.units import *
 from artiq.compiler.module import Module
 from artiq.compiler.embedding import Stitcher
 from artiq.compiler.targets import OR1KTarget
+from artiq.compiler.kernel_cache import KernelCache, KernelCacheKey
 
 # Import for side effects (creating the exception classes).
 from artiq.coredevice import exceptions
@@ -57,6 +58,10 @@ class Core:
         and the RTIO coarse timestamp frequency (e.g. SERDES multiplication
         factor).
     :param comm_device: name of the device used for communications.
+    :param kernel_cache: absolute path of a directory used to cache compiled
+        kernels across runs. Kernels whose code and embedded host values are
+        unchanged are then not recompiled. Caching is disabled if ``None``.
+    :param kernel_cache_size: maximum size of the kernel cache, in bytes.
     """
 
     kernel_invariants = {
@@ -65,12 +70,17 @@ class Core:
     }
 
     def __init__(self, dmgr, ref_period, external_clock=False,
-                 ref_multiplier=8, comm_device="comm"):
+                 ref_multiplier=8, comm_device="comm",
+                 kernel_cache=None, kernel_cache_size=64*1024*1024):
         self.ref_period = ref_period
         self.external_clock = external_clock
         self.ref_multiplier = ref_multiplier
         self.coarse_ref_period = ref_period*ref_multiplier
         self.comm = dmgr.get(comm_device)
+        if kernel_cache is None:
+            self.kernel_cache = None
+        else:
+            self.kernel_cache = KernelCache(kernel_cache, kernel_cache_size)
 
         self.first_run = True
         self.dmgr = dmgr
@@ -85,15 +95,26 @@ class Core:
             stitcher.stitch_call(function, args, kwargs, set_result)
             stitcher.finalize()
 
-            module = Module(stitcher, ref_period=self.ref_period)
             target = OR1KTarget()
 
-            library = target.compile_and_link([module])
-            stripped_library = target.strip(library)
+            cached = None
+            if self.kernel_cache is not None:
+                cache_key = KernelCacheKey(stitcher, target, self.ref_period)
+                cached = self.kernel_cache.get(cache_key, stitcher.embedding_map)
+
+            if cached is None:
+                module = Module(stitcher, ref_period=self.ref_period)
+
+                library, stripped_library = target.compile_link_and_strip([module])
+
+                if self.kernel_cache is not None:
+                    self.kernel_cache.put(cache_key, stitcher.embedding_map,
+                                          library, stripped_library)
+            else:
+                library, stripped_library = cached
 
             return stitcher.embedding_map, stripped_library, \
-                   lambda addresses: target.symbolize(library, addresses), \
-                   lambda symbols: target.demangle(symbols)
+                   target.symbolizer(library), target.demangle
         except diagnostic.Error as error:
             raise CompileError(error.diagnostic) from error
 
@@ -70,7 +70,7 @@ def get_argparser():
                                                "from the schedule")
     parser_delete.add_argument("-g", action="store_true",
                                help="request graceful termination")
-    parser_delete.add_argument("rid", metavar="RID", type=int,
+    parser_delete.add_argument("rid", metavar="RID", type=int, nargs="+",
                                help="run identifier (RID)")
 
     parser_set_dataset = subparsers.add_parser(
@@ -104,6 +104,11 @@ def get_argparser():
                                    help="use a specific repository revision "
                                         "(defaults to head)")
 
+    parser_find_results = subparsers.add_parser(
+        "find-results", help="look up the results file of a run")
+    parser_find_results.add_argument("rid", metavar="RID", type=int,
+                                     help="run identifier (RID)")
+
     parser_ls = subparsers.add_parser(
         "ls", help="list a directory on the master")
     parser_ls.add_argument("directory", default="", nargs="?")
@@ -145,9 +150,10 @@ def _action_submit(remote, args):
 
 def _action_delete(remote, args):
     if args.g:
-        remote.request_termination(args.rid)
+        for rid in args.rid:
+            remote.request_termination(rid)
     else:
-        remote.delete(args.rid)
+        remote.delete_many(args.rid)
 
 
 def _action_set_dataset(remote, args):
@@ -175,6 +181,20 @@ def _action_ls(remote, args):
         print(name)
 
 
+def _action_find_results(remote, args):
+    entry = remote.get(args.rid)
+    if entry is None:
+        print("RID {} not found in the results index".format(args.rid))
+        sys.exit(1)
+    print("Path: {}".format(entry["path"]))
+    print("Class name: {}".format(entry["class_name"]))
+    print("Start time: {}".format(
+        time.strftime("%Y-%m-%d %H:%M:%S",
+                      time.localtime(entry["start_time"]))))
+    if entry["repo_rev"] is not None:
+        print("Revision: {}".format(entry["repo_rev"]))
+
+
 def _show_schedule(schedule):
     clear_screen()
     if schedule:
@@ -307,7 +327,8 @@ def main():
             "del_dataset": "master_dataset_db",
             "scan_devices": "master_device_db",
             "scan_repository": "master_experiment_db",
-            "ls": "master_experiment_db"
+            "ls": "master_experiment_db",
+            "find_results": "master_results_index"
         }[action]
         remote = Client(args.server, port, target_name)
         try:
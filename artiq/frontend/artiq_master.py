@@ -11,17 +11,33 @@ from artiq.tools import (simple_network_args, atexit_register_coroutine,
 from artiq.protocols.pc_rpc import Server as RPCServer
 from artiq.protocols.sync_struct import Publisher
 from artiq.protocols.logging import Server as LoggingServer
-from artiq.protocols.broadcast import Broadcaster
+from artiq.protocols.broadcast import Broadcaster, BroadcasterStats
 from artiq.master.log import log_args, init_log
 from artiq.master.databases import DeviceDB, DatasetDB
 from artiq.master.scheduler import Scheduler
-from artiq.master.worker_db import RIDCounter
+from artiq.master.worker import WorkerPool
+from artiq.master.worker_db import (RIDCounter, ResultsIndex,
+                                    ResultsIndexReader,
+                                    results_index_filename)
 from artiq.master.experiments import (FilesystemBackend, GitBackend,
                                       ExperimentDB)
 
 logger = logging.getLogger(__name__)
 
 
+def parse_pipeline_concurrency(option):
+    pipeline_name, sep, concurrency = option.rpartition("=")
+    try:
+        concurrency = int(concurrency)
+    except ValueError:
+        concurrency = 0
+    if not sep or not pipeline_name or concurrency < 1:
+        raise argparse.ArgumentTypeError(
+            "expected PIPELINE=N with N a positive integer, got '{}'"
+            .format(option))
+    return pipeline_name, concurrency
+
+
 def get_argparser():
     parser = argparse.ArgumentParser(description="ARTIQ master")
 
@@ -32,19 +48,77 @@ def get_argparser():
         ("broadcast", "broadcasts", 1067)
     ])
 
+    group = parser.add_argument_group("notifications")
+    group.add_argument(
+        "--notify-max-rate", default=None, type=float,
+        help="maximum number of notification writes per second to each "
+             "client (default: unlimited)")
+    group.add_argument(
+        "--notify-max-queue", default=10000, type=int,
+        help="number of pending notifications after which a slow client "
+             "is resynchronized instead, 0 for unlimited "
+             "(default: %(default)d)")
+
+    group = parser.add_argument_group("broadcasts")
+    group.add_argument(
+        "--broadcast-queue-limit", default=1024, type=int,
+        help="number of messages waiting to be sent to a receiver after "
+             "which new messages are dropped (default: %(default)d)")
+    group.add_argument(
+        "--broadcast-lossless", default=False, action="store_true",
+        help="never drop messages; disconnect the receivers that cannot "
+             "keep up instead")
+    group.add_argument(
+        "--broadcast-max-buffer", default=64*1024*1024, type=int,
+        help="in lossless mode, number of bytes waiting to be sent to a "
+             "receiver after which it is disconnected "
+             "(default: %(default)d)")
+
+    group = parser.add_argument_group("workers")
+    group.add_argument(
+        "--worker-pool-size", default=2, type=int,
+        help="number of worker processes started in advance, "
+             "0 to start them on demand (default: %(default)d)")
+    group.add_argument(
+        "--worker-max-runs", default=1, type=int,
+        help="number of experiments executed by a worker process from the "
+             "pool before it is recycled; connections to controllers are "
+             "only reused between the experiments executed by the same "
+             "process (default: %(default)d)")
+
+    group = parser.add_argument_group("scheduler")
+    group.add_argument(
+        "--pipeline-concurrency", default=[], action="append",
+        type=parse_pipeline_concurrency, metavar="PIPELINE=N",
+        help="let N runs of the given pipeline execute at the same time. "
+             "Only for experiments that do not use the core device. "
+             "Can be specified multiple times.")
+
     group = parser.add_argument_group("databases")
     group.add_argument("--device-db", default="device_db.pyon",
                        help="device database file (default: '%(default)s')")
     group.add_argument("--dataset-db", default="dataset_db.pyon",
                        help="dataset file (default: '%(default)s')")
+    group.add_argument("--dataset-mmap-threshold", default=None, type=int,
+                       help="store persistent arrays of at least this many "
+                            "bytes in memory-mapped files, not supported on "
+                            "Windows (default: disabled)")
 
     group = parser.add_argument_group("repository")
     group.add_argument(
         "-g", "--git", default=False, action="store_true",
         help="use the Git repository backend")
+    group.add_argument(
+        "--git-max-checkouts", default=8, type=int,
+        help="number of checkouts kept by the Git repository backend, "
+             "unless more are in use (default: %(default)d)")
     group.add_argument(
         "-r", "--repository", default="repository",
         help="path to the repository (default: '%(default)s')")
+    group.add_argument(
+        "--scan-workers", default=4, type=int,
+        help="number of experiment files examined concurrently when "
+             "scanning the repository (default: %(default)d)")
 
     log_args(parser)
 
@@ -52,7 +126,10 @@ def get_argparser():
 
 
 def main():
-    args = get_argparser().parse_args()
+    parser = get_argparser()
+    args = parser.parse_args()
+    if args.dataset_mmap_threshold is not None and os.name == "nt":
+        parser.error("--dataset-mmap-threshold is not supported on Windows")
     log_forwarder = init_log(args)
     if os.name == "nt":
         loop = asyncio.ProactorEventLoop()
@@ -62,7 +139,9 @@ def main():
     atexit.register(loop.close)
     bind = bind_address_from_args(args)
 
-    server_broadcast = Broadcaster()
+    server_broadcast = Broadcaster(args.broadcast_queue_limit,
+                                   args.broadcast_lossless,
+                                   args.broadcast_max_buffer)
     loop.run_until_complete(server_broadcast.start(
         bind, args.port_broadcast))
     atexit_register_coroutine(server_broadcast.stop)
@@ -71,25 +150,38 @@ def main():
         server_broadcast.broadcast("log", msg))
 
     device_db = DeviceDB(args.device_db)
-    dataset_db = DatasetDB(args.dataset_db)
+    dataset_db = DatasetDB(args.dataset_db,
+                           mmap_threshold=args.dataset_mmap_threshold)
     dataset_db.start()
     atexit_register_coroutine(dataset_db.stop)
     worker_handlers = dict()
+    if args.worker_pool_size:
+        worker_pool = WorkerPool(args.worker_pool_size, args.worker_max_runs)
+        worker_pool.start()
+        atexit_register_coroutine(worker_pool.close)
+    else:
+        worker_pool = None
 
     if args.git:
-        repo_backend = GitBackend(args.repository)
+        repo_backend = GitBackend(args.repository, args.git_max_checkouts)
     else:
         repo_backend = FilesystemBackend(args.repository)
-    experiment_db = ExperimentDB(repo_backend, worker_handlers)
+    experiment_db = ExperimentDB(repo_backend, worker_handlers, worker_pool,
+                                 args.scan_workers)
     atexit.register(experiment_db.close)
 
-    scheduler = Scheduler(RIDCounter(), worker_handlers, experiment_db)
+    pipeline_concurrency = dict(args.pipeline_concurrency)
+    os.makedirs("results", exist_ok=True)
+    results_index = ResultsIndex(results_index_filename())
+    atexit.register(results_index.close)
+
+    scheduler = Scheduler(RIDCounter(), worker_handlers, experiment_db,
+                          worker_pool, pipeline_concurrency)
     scheduler.start()
     atexit_register_coroutine(scheduler.stop)
 
     worker_handlers.update({
-        "get_device_db": device_db.get_device_db,
-        "get_device": device_db.get,
+        "get_device_db_snapshot": device_db.get_device_db_snapshot,
         "get_dataset": dataset_db.get,
         "update_dataset": dataset_db.update,
         "scheduler_submit": scheduler.submit,
@@ -103,7 +195,9 @@ def main():
         "master_device_db": device_db,
         "master_dataset_db": dataset_db,
         "master_schedule": scheduler,
-        "master_experiment_db": experiment_db
+        "master_experiment_db": experiment_db,
+        "master_results_index": ResultsIndexReader(results_index),
+        "master_broadcast": BroadcasterStats(server_broadcast)
     }, allow_parallel=True)
     loop.run_until_complete(server_control.start(
         bind, args.port_control))
@@ -115,7 +209,8 @@ def main():
         "datasets": dataset_db.data,
         "explist": experiment_db.explist,
         "explist_status": experiment_db.status
-    })
+    }, max_rate=args.notify_max_rate or None,
+       max_queue=args.notify_max_queue or None)
     loop.run_until_complete(server_notify.start(
         bind, args.port_notify))
     atexit_register_coroutine(server_notify.stop)
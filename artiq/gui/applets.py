@@ -23,7 +23,7 @@ class AppletIPCServer(AsyncioParentComm):
         self.datasets = set()
 
     def write_pyon(self, obj):
-        self.write(pyon.encode(obj).encode() + b"\n")
+        self.write(pyon.encode_to_bytes(obj, end=b"\n"))
 
     async def read_pyon(self):
         line = await self.readline()
@@ -1,3 +1,4 @@
+import numpy
 from PyQt5 import QtCore
 
 from artiq.protocols.sync_struct import Subscriber, process_mod
@@ -45,9 +46,12 @@ class LocalModelManager(ModelManager):
 
 
 class _SyncSubstruct:
-    def __init__(self, update_cb, ref):
+    def __init__(self, update_cb, ref, replace_cb):
         self.update_cb = update_cb
         self.ref = ref
+        # replaces ref in its container, for Numpy arrays that are
+        # reallocated by append_array
+        self.replace_cb = replace_cb
 
     def append(self, x):
         self.ref.append(x)
@@ -69,8 +73,23 @@ class _SyncSubstruct:
         self.ref.__delitem__(key)
         self.update_cb()
 
+    def append_array(self, x):
+        if isinstance(self.ref, list):
+            self.ref.extend(x)
+            self.update_cb()
+        else:
+            self.replace_cb(numpy.concatenate((self.ref, x)))
+
     def __getitem__(self, key):
-        return _SyncSubstruct(self.update_cb, self.ref[key])
+        def replace(value):
+            if isinstance(self.ref, tuple):
+                ref = list(self.ref)
+                ref[key] = value
+                self.replace_cb(tuple(ref))
+            else:
+                self.ref[key] = value
+                self.update_cb()
+        return _SyncSubstruct(self.update_cb, self.ref[key], replace)
 
 
 class DictSyncModel(QtCore.QAbstractTableModel):
@@ -146,7 +165,9 @@ class DictSyncModel(QtCore.QAbstractTableModel):
     def __getitem__(self, k):
         def update():
             self[k] = self.backing_store[k]
-        return _SyncSubstruct(update, self.backing_store[k])
+        def replace(value):
+            self[k] = value
+        return _SyncSubstruct(update, self.backing_store[k], replace)
 
     def sort_key(self, k, v):
         raise NotImplementedError
@@ -193,7 +214,9 @@ class ListSyncModel(QtCore.QAbstractTableModel):
     def __getitem__(self, k):
         def update():
             self[k] = self.backing_store[k]
-        return _SyncSubstruct(update, self.backing_store[k])
+        def replace(value):
+            self[k] = value
+        return _SyncSubstruct(update, self.backing_store[k], replace)
 
     def append(self, v):
         row = len(self.backing_store)
@@ -378,7 +401,9 @@ class DictSyncTreeSepModel(QtCore.QAbstractItemModel):
     def __getitem__(self, k):
         def update():
             self[k] = self.backing_store[k]
-        return _SyncSubstruct(update, self.backing_store[k])
+        def replace(value):
+            self[k] = value
+        return _SyncSubstruct(update, self.backing_store[k], replace)
 
     def index_to_key(self, index):
         item = index.internalPointer()
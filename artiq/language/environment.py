@@ -285,10 +285,51 @@ class HasEnvironment:
         """Mutate an existing dataset at the given index (e.g. set a value at
         a given position in a NumPy array)
 
+        The index may also be a slice (or a tuple of slices), in which case
+        ``value`` is an array that is assigned to the selected elements.
+
         If the dataset was created in broadcast mode, the modification is
-        immediately transmitted."""
+        immediately transmitted. Assigning a whole range of elements at once
+        transmits a single modification instead of one per element."""
         self.__dataset_mgr.mutate(key, index, value)
 
+    def extend_dataset(self, key, values):
+        """Append the elements of ``values`` to an existing dataset that is
+        a list or a one-dimensional NumPy array.
+
+        If the dataset was created in broadcast mode, the modification is
+        immediately transmitted, as a single modification."""
+        self.__dataset_mgr.extend(key, values)
+
+    def stream_datasets(self, flush_interval=1.0):
+        """Requests that the local datasets of this run be written to the
+        results file as the experiment executes, instead of being kept in
+        memory until the end of the run. Call it from ``build``.
+
+        Arrays are stored in resizable HDF5 datasets that are updated by
+        ``set_dataset``, ``mutate_dataset`` and ``extend_dataset``, and the
+        file is flushed at most every ``flush_interval`` seconds. If the run
+        fails or is deleted, the partial results are kept.
+
+        The file is switched to SWMR mode when the run stage begins, so that
+        other processes can open it with ``swmr=True`` to read the results
+        while they are written. Array datasets first created after that are
+        kept in memory and written at the end of the run, so scans should
+        create theirs in ``build`` or ``prepare``.
+
+        ``get_dataset`` returns a copy of streamed arrays.
+        """
+        self.__dataset_mgr.enable_streaming(flush_interval)
+
+    def compress_datasets(self, compression="gzip"):
+        """Requests that the large numerical arrays of this run be
+        compressed in the results file, with the HDF5 filter
+        ``compression`` (``"gzip"`` or ``"lzf"``). Call it from ``build``.
+
+        Datasets are stored uncompressed by default, as compression slows
+        down writing the results."""
+        self.__dataset_mgr.enable_compression(compression)
+
     def get_dataset(self, key, default=NoDefault):
         """Returns the contents of a dataset.
 
@@ -1,65 +1,363 @@
 import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import urllib.parse
+
+import numpy
 
 from artiq.protocols.sync_struct import Notifier, process_mod
 from artiq.protocols import pyon
 from artiq.tools import TaskObject
 
 
+logger = logging.getLogger(__name__)
+
+
+def _store_atomically(filename, contents):
+    directory = os.path.abspath(os.path.dirname(filename))
+    with tempfile.NamedTemporaryFile("wb", dir=directory,
+                                     delete=False) as f:
+        f.write(contents)
+        tmpname = f.name
+    os.replace(tmpname, filename)
+
+
 class DeviceDB:
     def __init__(self, backing_file):
         self.backing_file = backing_file
         self.data = Notifier(pyon.load_file(self.backing_file))
+        # incremented each time a scan changes the contents
+        self.generation = 0
 
     def scan(self):
         new_data = pyon.load_file(self.backing_file)
 
+        changed = False
         for k in list(self.data.read.keys()):
             if k not in new_data:
                 del self.data[k]
+                changed = True
         for k in new_data.keys():
             if k not in self.data.read or self.data.read[k] != new_data[k]:
                 self.data[k] = new_data[k]
+                changed = True
+        if changed:
+            self.generation += 1
 
     def get_device_db(self):
         return self.data.read
 
+    def get_device_db_snapshot(self, generation):
+        """Returns ``None`` if *generation* is the current generation of the
+        device database, and a tuple ``(generation, contents)`` otherwise."""
+        if generation == self.generation:
+            return None
+        return self.generation, self.data.read
+
     def get(self, key):
         return self.data.read[key]
 
 
+def _mod_keys(mod):
+    # Top-level keys of the dataset Notifier affected by a mod.
+    if mod["path"]:
+        return [mod["path"][0]]
+    if mod["action"] == "update":
+        return list(mod["items"].keys())
+    return [mod["key"]]
+
+
+def _journal_mods(mod, journaled, to_map):
+    # Translates a mod on the dataset Notifier, whose values are
+    # (persist, value) tuples, into mods on the datasets stored in the
+    # snapshot and journal. journaled(key) tells if a dataset is stored
+    # there before the mod, and to_map(key, persist, value) if a new value
+    # goes into a memory-mapped file instead.
+    # Must be called before the mod is applied.
+    path = mod["path"]
+    if path:
+        key = path[0]
+        if len(path) < 2 or not journaled(key):
+            return []
+        return [dict(mod, path=[key] + path[2:])]
+
+    action = mod["action"]
+    if action == "setitem":
+        items = {mod["key"]: mod["value"]}
+    elif action == "update":
+        items = mod["items"]
+    elif action == "delitem":
+        key = mod["key"]
+        if journaled(key):
+            return [{"action": "delitem", "path": [], "key": key}]
+        return []
+    else:
+        raise ValueError
+
+    r = []
+    for key, (persist, value) in items.items():
+        if persist and not to_map(key, persist, value):
+            r.append({"action": "setitem", "path": [], "key": key,
+                      "value": value})
+        elif journaled(key):
+            r.append({"action": "delitem", "path": [], "key": key})
+    return r
+
+
 class DatasetDB(TaskObject):
-    def __init__(self, persist_file, autosave_period=30):
+    """Database of the datasets of the master.
+
+    Persistent datasets are stored in *persist_file* (the snapshot), and
+    each change made to them since the snapshot was written is appended to
+    a journal (*persist_file* followed by ``.journal``) as a PYON-encoded
+    mod. On startup, the journal is replayed onto the snapshot.
+
+    The journal starts with the hash of the snapshot it applies to, so that
+    it is ignored if the master was interrupted after writing a new
+    snapshot but before starting a new journal.
+
+    Every *autosave_period* seconds, the journal is flushed to disk, and
+    once its entries have grown larger than the snapshot, both are
+    rewritten (compaction). The cost of persistence is therefore
+    proportional to the rate of change of the persistent datasets, and not
+    to their total size.
+
+    If *mmap_threshold* is set, persistent Numpy arrays of at least that
+    many bytes are instead stored in ``.npy`` files in a directory
+    (*persist_file* followed by ``.arrays``), which are memory-mapped.
+    ``get`` returns the mapped arrays, mods on them are written in place,
+    and persisting them only requires flushing the mappings. Arrays that
+    are replaced (e.g. by ``append_array``) are written to a new file. Files
+    found in the directory are loaded even if *mmap_threshold* is not set.
+
+    Memory-mapped arrays are only supported on POSIX systems: Windows does
+    not allow replacing or deleting the file of an array that is still
+    mapped, e.g. by an experiment or a subscriber.
+    """
+    def __init__(self, persist_file, autosave_period=30, mmap_threshold=None):
         self.persist_file = persist_file
+        self.journal_file = persist_file + ".journal"
+        self.array_dir = persist_file + ".arrays"
         self.autosave_period = autosave_period
+        self.mmap_threshold = mmap_threshold
+        if mmap_threshold is not None and os.name == "nt":
+            raise ValueError("memory-mapped datasets are not supported "
+                             "on Windows")
 
         try:
-            file_data = pyon.load_file(self.persist_file)
+            with open(self.persist_file, "rb") as f:
+                snapshot = f.read()
         except FileNotFoundError:
             file_data = dict()
+            snapshot_hash = None
+            self._snapshot_size = 0
+        else:
+            file_data = pyon.decode(snapshot.decode())
+            snapshot_hash = hashlib.sha1(snapshot).hexdigest()
+            self._snapshot_size = len(snapshot)
+        # Length of the valid part of the journal, or None if the journal
+        # cannot be used and must be restarted with a new snapshot.
+        self._journal_size = None
+        self._journal = None
+        if snapshot_hash is not None:
+            self._replay_journal(file_data, snapshot_hash)
+        self._mapped = self._load_arrays()
+        # memory-mapped arrays are newer than any journaled value
+        file_data.update(self._mapped)
         self.data = Notifier({k: (True, v) for k, v in file_data.items()})
 
+    def _replay_journal(self, file_data, snapshot_hash):
+        try:
+            f = open(self.journal_file, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            header = f.readline()
+            try:
+                header = pyon.decode(header.decode())
+            except:
+                logger.warning("ignoring journal with invalid header")
+                return
+            if (not isinstance(header, dict)
+                    or header.get("snapshot") != snapshot_hash):
+                # stale journal, already included in the snapshot
+                return
+            self._header_size = size = f.tell()
+            for line in f:
+                if not line.endswith(b"\n"):
+                    logger.warning("ignoring truncated journal entry")
+                    break
+                try:
+                    process_mod(file_data, pyon.decode(line.decode()))
+                except:
+                    logger.warning("ignoring invalid journal entry",
+                                   exc_info=True)
+                    break
+                size += len(line)
+        self._journal_size = size
+
+    def _load_arrays(self):
+        try:
+            filenames = os.listdir(self.array_dir)
+        except FileNotFoundError:
+            return dict()
+        if os.name == "nt" and any(filename.endswith(".npy")
+                                   for filename in filenames):
+            raise ValueError("memory-mapped datasets found in {} are not "
+                             "supported on Windows".format(self.array_dir))
+        r = dict()
+        for filename in filenames:
+            if filename.endswith(".npy"):
+                key = urllib.parse.unquote(filename[:-4])
+                r[key] = numpy.load(os.path.join(self.array_dir, filename),
+                                    mmap_mode="r+")
+        return r
+
+    def _array_filename(self, key):
+        return os.path.join(self.array_dir,
+                            urllib.parse.quote(key, safe="") + ".npy")
+
+    def _to_map(self, key, persist, value):
+        return (self.mmap_threshold is not None
+                and persist
+                and isinstance(key, str)
+                and isinstance(value, numpy.ndarray)
+                and not value.dtype.hasobject
+                and value.size > 0
+                and value.nbytes >= self.mmap_threshold)
+
+    def _map(self, key, value):
+        os.makedirs(self.array_dir, exist_ok=True)
+        filename = self._array_filename(key)
+        with tempfile.NamedTemporaryFile("wb", dir=self.array_dir,
+                                         suffix=".tmp", delete=False) as f:
+            numpy.save(f, value)
+            tmpname = f.name
+        # release the previous mapping, if any, before replacing its file
+        self._mapped.pop(key, None)
+        os.replace(tmpname, filename)
+        mapped = numpy.load(filename, mmap_mode="r+")
+        self._mapped[key] = mapped
+        # Same contents, so subscribers need not be notified.
+        self.data.read[key] = (True, mapped)
+
+    def _unmap(self, key):
+        del self._mapped[key]
+        os.remove(self._array_filename(key))
+
+    def _journaled(self, key):
+        return (key in self.data.read and self.data.read[key][0]
+                and key not in self._mapped)
+
+    def _open_journal(self):
+        """Opens the journal for appending. Returns False if a new snapshot
+        had to be written instead, which then contains all the datasets."""
+        if self._journal_size is None:
+            self.save()
+            return False
+        else:
+            self._journal = open(self.journal_file, "r+b")
+            # discard any truncated entry at the end
+            self._journal.truncate(self._journal_size)
+            self._journal.seek(self._journal_size)
+            return True
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
     def save(self):
-        data = {k: v[1] for k, v in self.data.read.items() if v[0]}
-        pyon.store_file(self.persist_file, data)
+        """Writes all persistent datasets into a new snapshot, and starts a
+        new journal."""
+        self._close_journal()
+        for mapped in self._mapped.values():
+            mapped.flush()
+        data = {k: v[1] for k, v in self.data.read.items()
+                if v[0] and k not in self._mapped}
+        snapshot = pyon.encode_to_bytes(data, True, b"\n")
+        header = pyon.encode_to_bytes(
+            {"snapshot": hashlib.sha1(snapshot).hexdigest()}, end=b"\n")
+        _store_atomically(self.persist_file, snapshot)
+        _store_atomically(self.journal_file, header)
+        self._snapshot_size = len(snapshot)
+        self._header_size = self._journal_size = len(header)
+        self._journal = open(self.journal_file, "ab")
+
+    def sync(self):
+        """Makes sure the journal is written to disk, and compacts it into
+        a new snapshot once it has grown larger than the snapshot.
+        Memory-mapped arrays are flushed."""
+        for mapped in self._mapped.values():
+            mapped.flush()
+        if self._journal is None:
+            return
+        if self._journal_size - self._header_size > self._snapshot_size:
+            self.save()
+        else:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
 
     async def _do(self):
         try:
             while True:
                 await asyncio.sleep(self.autosave_period)
-                self.save()
+                self.sync()
         finally:
-            self.save()
+            if self._journal is not None:
+                self.save()
+            self._close_journal()
 
     def get(self, key):
         return self.data.read[key][1]
 
     def update(self, mod):
+        journal_mods = _journal_mods(mod, self._journaled, self._to_map)
+        lines = [pyon.encode_to_bytes(journal_mod, end=b"\n")
+                 for journal_mod in journal_mods]
+        keys = _mod_keys(mod)
         process_mod(self.data, mod)
 
+        for key in keys:
+            persist, value = self.data.read.get(key, (False, None))
+            mapped = self._mapped.get(key)
+            if not persist:
+                if mapped is not None:
+                    self._unmap(key)
+            elif mod["path"]:
+                if mapped is not None:
+                    if value is not mapped:
+                        # e.g. append_array, which reallocates arrays
+                        self._map(key, value)
+                elif self._to_map(key, persist, value):
+                    # e.g. an array grown with append_array
+                    self._map(key, value)
+                    lines.append(pyon.encode_to_bytes(
+                        {"action": "delitem", "path": [], "key": key},
+                        end=b"\n"))
+            elif self._to_map(key, persist, value):
+                self._map(key, value)
+            elif mapped is not None:
+                self._unmap(key)
+
+        if lines:
+            if self._journal is None and not self._open_journal():
+                # the new snapshot already contains the mod
+                return
+            for line in lines:
+                self._journal.write(line)
+                self._journal_size += len(line)
+            # Make the entries reach the OS right away so that they survive
+            # a crash of the master. fsync is left to sync().
+            self._journal.flush()
+
     # convenience functions (update() can be used instead)
     def set(self, key, value, persist=False):
-        self.data[key] = (persist, value)
+        self.update({"action": "setitem", "path": [], "key": key,
+                     "value": (persist, value)})
 
     def delete(self, key):
-        del self.data[key]
+        self.update({"action": "delitem", "path": [], "key": key})
     #
@@ -3,6 +3,9 @@ import os
 import tempfile
 import shutil
 import logging
+import hashlib
+import time
+from collections import OrderedDict
 
 from artiq.protocols.sync_struct import Notifier
 from artiq.master.worker import (Worker, WorkerInternalException,
@@ -13,16 +16,18 @@ from artiq.tools import get_windows_drives, exc_to_warning
 logger = logging.getLogger(__name__)
 
 
-async def _get_repository_entries(entry_dict,
-                                  root, filename, worker_handlers):
-    worker = Worker(worker_handlers)
+async def _examine_file(root, filename, worker_handlers, worker_pool):
+    worker = Worker(worker_handlers, worker_pool=worker_pool)
     try:
-        description = await worker.examine("scan", os.path.join(root, filename))
+        return await worker.examine("scan", os.path.join(root, filename))
     except:
         log_worker_exception()
         raise
     finally:
         await worker.close()
+
+
+def _add_repository_entries(entry_dict, filename, description):
     for class_name, class_desc in description.items():
         name = class_desc["name"]
         arginfo = class_desc["arginfo"]
@@ -47,26 +52,71 @@ async def _get_repository_entries(entry_dict,
         entry_dict[name] = entry
 
 
-async def _scan_experiments(root, worker_handlers, subdir=""):
-    entry_dict = dict()
+def _list_experiment_files(root, subdir=""):
+    # returns (subdir, filename) pairs, depth-first
+    r = []
     for de in os.scandir(os.path.join(root, subdir)):
         if de.name.startswith("."):
             continue
         if de.is_file() and de.name.endswith(".py"):
-            filename = os.path.join(subdir, de.name)
-            try:
-                await _get_repository_entries(
-                    entry_dict, root, filename, worker_handlers)
-            except Exception as exc:
-                logger.warning("Skipping file '%s'", filename,
-                    exc_info=not isinstance(exc, WorkerInternalException))
+            r.append((subdir, os.path.join(subdir, de.name)))
         if de.is_dir():
-            subentries = await _scan_experiments(
-                root, worker_handlers,
-                os.path.join(subdir, de.name))
-            entries = {de.name + "/" + k: v for k, v in subentries.items()}
-            entry_dict.update(entries)
-    return entry_dict
+            r += _list_experiment_files(root, os.path.join(subdir, de.name))
+    return r
+
+
+async def _scan_experiments(root, worker_handlers, worker_pool,
+                            cache, max_workers):
+    """Examines the experiment files below ``root``, with at most
+    ``max_workers`` workers at a time.
+
+    ``cache`` maps (file name, SHA-256 of the file contents) to the result
+    of a previous examination of the file, and is updated to contain the
+    results for the files that were found. Files in the cache are not
+    examined again."""
+    files = _list_experiment_files(root)
+    semaphore = asyncio.Semaphore(max_workers)
+    new_cache = dict()
+
+    async def examine(filename):
+        with open(os.path.join(root, filename), "rb") as f:
+            key = filename, hashlib.sha256(f.read()).hexdigest()
+        try:
+            description = cache[key]
+        except KeyError:
+            async with semaphore:
+                description = await _examine_file(
+                    root, filename, worker_handlers, worker_pool)
+        new_cache[key] = description
+        return description
+
+    descriptions = await asyncio.gather(
+        *[examine(filename) for _, filename in files],
+        return_exceptions=True)
+    cache.clear()
+    cache.update(new_cache)
+
+    entry_dicts = OrderedDict()
+    for (subdir, filename), description in zip(files, descriptions):
+        entry_dict = entry_dicts.setdefault(subdir, dict())
+        if isinstance(description, BaseException):
+            # includes CancelledError, which is not an Exception
+            if isinstance(description, WorkerInternalException):
+                exc_info = False
+            else:
+                exc_info = description
+            logger.warning("Skipping file '%s'", filename, exc_info=exc_info)
+        else:
+            _add_repository_entries(entry_dict, filename, description)
+
+    r = dict()
+    for subdir, entry_dict in entry_dicts.items():
+        if subdir:
+            prefix = "/".join(subdir.split(os.path.sep)) + "/"
+        else:
+            prefix = ""
+        r.update((prefix + k, v) for k, v in entry_dict.items())
+    return r
 
 
 def _sync_explist(target, source):
@@ -79,9 +129,14 @@ def _sync_explist(target, source):
 
 
 class ExperimentDB:
-    def __init__(self, repo_backend, worker_handlers):
+    def __init__(self, repo_backend, worker_handlers, worker_pool=None,
+                 scan_workers=4):
         self.repo_backend = repo_backend
         self.worker_handlers = worker_handlers
+        self.worker_pool = worker_pool
+        self.scan_workers = scan_workers
+        # (file name, content hash) -> examination result
+        self._examine_cache = dict()
 
         self.cur_rev = self.repo_backend.get_head_rev()
         self.repo_backend.request_rev(self.cur_rev)
@@ -96,6 +151,7 @@ class ExperimentDB:
     def close(self):
         # The object cannot be used anymore after calling this method.
         self.repo_backend.release_rev(self.cur_rev)
+        self.repo_backend.close()
 
     async def scan_repository(self, new_cur_rev=None):
         if self._scanning:
@@ -109,7 +165,9 @@ class ExperimentDB:
             self.repo_backend.release_rev(self.cur_rev)
             self.cur_rev = new_cur_rev
             self.status["cur_rev"] = new_cur_rev
-            new_explist = await _scan_experiments(wd, self.worker_handlers)
+            new_explist = await _scan_experiments(
+                wd, self.worker_handlers, self.worker_pool,
+                self._examine_cache, self.scan_workers)
 
             _sync_explist(self.explist, new_explist)
         finally:
@@ -126,7 +184,7 @@ class ExperimentDB:
                 revision = self.cur_rev
             wd, _ = self.repo_backend.request_rev(revision)
             filename = os.path.join(wd, filename)
-        worker = Worker(self.worker_handlers)
+        worker = Worker(self.worker_handlers, worker_pool=self.worker_pool)
         try:
             description = await worker.examine("examine", filename)
         finally:
@@ -166,15 +224,83 @@ class FilesystemBackend:
     def release_rev(self, rev):
         pass
 
+    def close(self):
+        pass
+
 
 class _GitCheckout:
     def __init__(self, git, rev):
+        start = time.monotonic()
         self.path = tempfile.mkdtemp()
         commit = git.get(rev)
         git.checkout_tree(commit, directory=self.path)
+        self.tree = commit.tree
+        self.message = commit.message.strip()
+        self.ref_count = 1
+        self.checkout_time = time.monotonic() - start
+        logger.info("checked out revision %s into %s in %.3fs",
+                    rev, self.path, self.checkout_time)
+
+    def distance(self, commit):
+        """Returns the number of files that differ between this checkout and
+        *commit*."""
+        return len(self.tree.diff_to_tree(commit.tree))
+
+    def _remove_file(self, filename):
+        path = os.path.join(self.path, filename)
+        if os.path.lexists(path):
+            os.remove(path)
+        # remove the directories left empty, as a fresh checkout would
+        path = os.path.dirname(path)
+        while path != self.path:
+            try:
+                os.rmdir(path)
+            except OSError:
+                break
+            path = os.path.dirname(path)
+
+    def _write_file(self, git, file):
+        import pygit2
+
+        if file.mode == pygit2.GIT_FILEMODE_COMMIT:
+            # submodules are not checked out
+            return
+        path = os.path.join(self.path, file.path)
+        if os.path.isdir(path) and not os.path.islink(path):
+            # a directory replaced by a file: the deltas removing the
+            # files of the directory come after this one
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.remove(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = git[file.id].data
+        if file.mode == pygit2.GIT_FILEMODE_LINK:
+            os.symlink(data.decode(), path)
+        else:
+            with open(path, "wb") as f:
+                f.write(data)
+            if file.mode == pygit2.GIT_FILEMODE_BLOB_EXECUTABLE:
+                os.chmod(path, 0o755)
+
+    def update(self, git, rev):
+        """Turns this checkout into a checkout of *rev*, rewriting only the
+        files that differ."""
+        start = time.monotonic()
+        commit = git.get(rev)
+        diff = self.tree.diff_to_tree(commit.tree)
+        for delta in diff.deltas:
+            if delta.status_char() == "D":
+                self._remove_file(delta.old_file.path)
+            else:
+                if delta.old_file.path != delta.new_file.path:
+                    self._remove_file(delta.old_file.path)
+                self._write_file(git, delta.new_file)
+        self.tree = commit.tree
         self.message = commit.message.strip()
         self.ref_count = 1
-        logger.info("checked out revision %s into %s", rev, self.path)
+        self.checkout_time = time.monotonic() - start
+        logger.info("updated checkout in %s to revision %s (%d files) "
+                    "in %.3fs", self.path, rev, len(diff), self.checkout_time)
 
     def dispose(self):
         logger.info("disposing of checkout in folder %s", self.path)
@@ -182,22 +308,65 @@ class _GitCheckout:
 
 
 class GitBackend:
-    def __init__(self, root):
+    """Repository backend that checks out the requested revisions of a Git
+    repository into temporary directories.
+
+    Checkouts that are no longer in use are kept, up to a total of
+    ``max_checkouts`` checkouts, and are reused when the same revision is
+    requested again. When the limit is reached, the unused checkout closest
+    to the requested revision is updated to it, rewriting only the files
+    that differ.
+
+    The ``stats`` dictionary counts the checkouts of each kind and the total
+    time spent checking out.
+    """
+    def __init__(self, root, max_checkouts=8):
         # lazy import - make dependency optional
         import pygit2
 
         self.git = pygit2.Repository(root)
+        self.max_checkouts = max_checkouts
         self.checkouts = dict()
+        # unused checkouts, least recently used first
+        self._unused_checkouts = OrderedDict()
+        self.stats = {
+            "full_checkouts": 0,
+            "incremental_checkouts": 0,
+            "reused_checkouts": 0,
+            "checkout_time": 0.0
+        }
 
     def get_head_rev(self):
         return str(self.git.head.target)
 
+    def _checkout(self, rev):
+        if (self._unused_checkouts
+                and len(self.checkouts) + len(self._unused_checkouts)
+                    >= self.max_checkouts):
+            commit = self.git.get(rev)
+            old_rev = min(self._unused_checkouts,
+                          key=lambda r: self._unused_checkouts[r].distance(
+                              commit))
+            co = self._unused_checkouts.pop(old_rev)
+            co.update(self.git, rev)
+            self.stats["incremental_checkouts"] += 1
+        else:
+            co = _GitCheckout(self.git, rev)
+            self.stats["full_checkouts"] += 1
+        self.stats["checkout_time"] += co.checkout_time
+        return co
+
     def request_rev(self, rev):
         if rev in self.checkouts:
             co = self.checkouts[rev]
             co.ref_count += 1
+        elif rev in self._unused_checkouts:
+            co = self._unused_checkouts.pop(rev)
+            co.ref_count = 1
+            self.checkouts[rev] = co
+            self.stats["reused_checkouts"] += 1
         else:
-            co = _GitCheckout(self.git, rev)
+            co = self._checkout(rev)
             self.checkouts[rev] = co
         return co.path, co.message
 
@@ -205,5 +374,16 @@ class GitBackend:
         co = self.checkouts[rev]
         co.ref_count -= 1
         if not co.ref_count:
-            co.dispose()
             del self.checkouts[rev]
+            self._unused_checkouts[rev] = co
+            while (self._unused_checkouts
+                    and len(self.checkouts) + len(self._unused_checkouts)
+                        > self.max_checkouts):
+                _, co = self._unused_checkouts.popitem(last=False)
+                co.dispose()
+
+    def close(self):
+        """Disposes of the unused checkouts."""
+        for co in self._unused_checkouts.values():
+            co.dispose()
+        self._unused_checkouts.clear()
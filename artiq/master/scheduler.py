@@ -1,5 +1,6 @@
 import asyncio
 import logging
+import heapq
 from enum import Enum
 from time import time
 
@@ -56,7 +57,8 @@ class Run:
         self.due_date = due_date
         self.flush = flush
 
-        self.worker = Worker(pool.worker_handlers)
+        self.worker = Worker(pool.worker_handlers,
+                             worker_pool=pool.worker_pool)
         self.termination_requested = False
 
         self._status = RunStatus.pending
@@ -70,9 +72,11 @@ class Run:
             "status": self._status.name
         }
         notification.update(kwargs)
+        # added to the notifier by the pool
+        self.notification = notification
         self._notifier = pool.notifier
-        self._notifier[self.rid] = notification
         self._state_changed = pool.state_changed
+        self._status_changed = pool.status_changed
 
     @property
     def status(self):
@@ -80,6 +84,7 @@ class Run:
 
     @status.setter
     def status(self, value):
+        self._status_changed(self, self._status, value)
         self._status = value
         if not self.worker.closed.is_set():
             self._notifier[self.rid]["status"] = self._status.name
@@ -116,13 +121,119 @@ class Run:
     write_results = _mk_worker_method("write_results")
 
 
+class _RunQueue:
+    """Runs ordered by decreasing ``priority_key()``, evaluated without
+    taking due dates into account."""
+    def __init__(self):
+        self._heap = []
+        self._entries = dict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, run):
+        entry = [tuple(-k for k in run.priority_key()), run]
+        self._entries[run] = entry
+        heapq.heappush(self._heap, entry)
+
+    def remove(self, run):
+        # removed entries are only dropped from the heap when they reach
+        # its top
+        self._entries.pop(run)[1] = None
+
+    def top(self):
+        """Returns the run with the largest priority key, or None."""
+        heap = self._heap
+        while heap and heap[0][1] is None:
+            heapq.heappop(heap)
+        if heap:
+            return heap[0][1]
+        else:
+            return None
+
+
+class _PendingRunQueue(_RunQueue):
+    """Pending runs. Runs with a due date in the future are kept aside,
+    ordered by due date, until they become due."""
+    def __init__(self):
+        _RunQueue.__init__(self)
+        self._timed_heap = []
+        self._timed_entries = dict()
+
+    def __len__(self):
+        return _RunQueue.__len__(self) + len(self._timed_entries)
+
+    def add(self, run, now=None):
+        if now is None:
+            now = time()
+        if run.due_date is None or run.due_date < now:
+            _RunQueue.add(self, run)
+        else:
+            entry = [run.due_date, run.rid, run]
+            self._timed_entries[run] = entry
+            heapq.heappush(self._timed_heap, entry)
+
+    def remove(self, run):
+        try:
+            self._timed_entries.pop(run)[2] = None
+        except KeyError:
+            _RunQueue.remove(self, run)
+
+    def _timed_top(self):
+        heap = self._timed_heap
+        while heap and heap[0][2] is None:
+            heapq.heappop(heap)
+        if heap:
+            return heap[0][2]
+        else:
+            return None
+
+    def update(self, now):
+        """Moves the runs that have become due to the main queue."""
+        while True:
+            run = self._timed_top()
+            if run is None or not run.due_date < now:
+                break
+            heapq.heappop(self._timed_heap)
+            del self._timed_entries[run]
+            _RunQueue.add(self, run)
+
+    def next_due_date(self, above=None):
+        """Returns the earliest due date of the runs that are not due yet,
+        or None.
+
+        If ``above`` is given, only the runs whose ``priority_key()`` is
+        larger than ``above`` are considered."""
+        if above is None:
+            run = self._timed_top()
+            if run is None:
+                return None
+            else:
+                return run.due_date
+        due_dates = [run.due_date for run in self._timed_entries
+                     if run.priority_key() > above]
+        if due_dates:
+            return min(due_dates)
+        else:
+            return None
+
+
 class RunPool:
-    def __init__(self, ridc, worker_handlers, notifier, experiment_db):
+    def __init__(self, ridc, worker_handlers, notifier, experiment_db,
+                 worker_pool):
         self.runs = dict()
         self.state_changed = Condition()
+        # runs with the statuses the stages select from
+        self.queues = {
+            RunStatus.pending: _PendingRunQueue(),
+            RunStatus.prepare_done: _RunQueue(),
+            RunStatus.run_done: _RunQueue()
+        }
+        self.status_counts = {status: 0 for status in RunStatus}
 
         self.ridc = ridc
         self.worker_handlers = worker_handlers
+        self.worker_pool = worker_pool
         self.notifier = notifier
         self.experiment_db = experiment_db
 
@@ -130,6 +241,18 @@ class RunPool:
         # mutates expid to insert head repository revision if None.
         # called through scheduler.
         rid = self.ridc.get()
+        run = self.create_run(rid, expid, priority, due_date, flush,
+                              pipeline_name)
+        self.notifier[rid] = run.notification
+        self.state_changed.notify()
+        return rid
+
+    def create_run(self, rid, expid, priority, due_date, flush,
+                   pipeline_name):
+        # Does not publish the notification of the run nor notify the
+        # stages, so that the scheduler can do it once for many runs.
+        # mutates expid to insert head repository revision if None.
+        # called through scheduler.
         if "repo_rev" in expid:
             if expid["repo_rev"] is None:
                 expid["repo_rev"] = self.experiment_db.cur_rev
@@ -140,8 +263,30 @@ class RunPool:
         run = Run(rid, pipeline_name, wd, expid, priority, due_date, flush,
                   self, repo_msg=repo_msg)
         self.runs[rid] = run
-        self.state_changed.notify()
-        return rid
+        self.queues[RunStatus.pending].add(run)
+        self.status_counts[RunStatus.pending] += 1
+        return run
+
+    def discard_run(self, run):
+        # undoes create_run for a run that was never published.
+        # called through scheduler.
+        del self.runs[run.rid]
+        self.queues[RunStatus.pending].remove(run)
+        self.status_counts[RunStatus.pending] -= 1
+        if "repo_rev" in run.expid:
+            self.experiment_db.repo_backend.release_rev(run.expid["repo_rev"])
+
+    def status_changed(self, run, old, new):
+        # called by Run before its status changes
+        if self.runs.get(run.rid) is not run:
+            # already deleted
+            return
+        if old in self.queues:
+            self.queues[old].remove(run)
+        if new in self.queues:
+            self.queues[new].add(run)
+        self.status_counts[old] -= 1
+        self.status_counts[new] += 1
 
     async def delete(self, rid):
         # called through deleter
@@ -152,44 +297,54 @@ class RunPool:
         if "repo_rev" in run.expid:
             self.experiment_db.repo_backend.release_rev(run.expid["repo_rev"])
         del self.runs[rid]
+        if run.status in self.queues:
+            self.queues[run.status].remove(run)
+        self.status_counts[run.status] -= 1
 
 
 class PrepareStage(TaskObject):
-    def __init__(self, pool, delete_cb):
+    def __init__(self, pool, delete_cb, max_prepared=1):
         self.pool = pool
         self.delete_cb = delete_cb
+        # number of prepared runs below which runs are prepared regardless
+        # of their priority
+        self.max_prepared = max_prepared
 
     def _get_run(self):
         """If a run should get prepared now, return it.
         Otherwise, return a float representing the time before the next timed
         run becomes due, or None if there is no such run."""
         now = time()
-        pending_runs = filter(lambda r: r.status == RunStatus.pending,
-                              self.pool.runs.values())
-        try:
-            candidate = max(pending_runs, key=lambda r: r.priority_key(now))
-        except ValueError:
-            # pending_runs is an empty sequence
-            return None
-
-        prepared_runs = filter(lambda r: r.status == RunStatus.prepare_done,
-                               self.pool.runs.values())
-        try:
-            top_prepared_run = max(prepared_runs,
-                                   key=lambda r: r.priority_key())
-        except ValueError:
-            # there are no existing prepared runs - go ahead with <candidate>
-            pass
+        pending_runs = self.pool.queues[RunStatus.pending]
+        pending_runs.update(now)
+        candidate = pending_runs.top()
+        prepared_runs = self.pool.queues[RunStatus.prepare_done]
+        top_prepared_run = prepared_runs.top()
+        # once there are enough prepared runs, prepare a run (as well)
+        # only if it has higher priority than the highest priority prepared
+        # run
+        if len(prepared_runs) >= self.max_prepared and \
+                top_prepared_run is not None:
+            above = top_prepared_run.priority_key()
         else:
-            # prepare <candidate> (as well) only if it has higher priority than
-            # the highest priority prepared run
-            if top_prepared_run.priority_key() >= candidate.priority_key():
-                return None
+            above = None
 
-        if candidate.due_date is None or candidate.due_date < now:
+        if candidate is not None and (
+                above is None or candidate.priority_key() > above):
             return candidate
-        else:
-            return candidate.due_date - now
+        # wait for the next timed run that will get prepared once it is due
+        next_due_date = pending_runs.next_due_date(above)
+        if next_due_date is None:
+            return None
+        return next_due_date - now
+
+    def _flushed(self, run):
+        # all runs except <run> are pending or being deleted
+        counts = self.pool.status_counts
+        return (len(self.pool.runs) - counts[RunStatus.pending]
+                - counts[RunStatus.deleting]
+                - (run.status not in (RunStatus.pending,
+                                      RunStatus.deleting))) == 0
 
     async def _do(self):
         while True:
@@ -202,10 +357,7 @@ class PrepareStage(TaskObject):
             else:
                 if run.flush:
                     run.status = RunStatus.flushing
-                    while not all(r.status in (RunStatus.pending,
-                                               RunStatus.deleting)
-                                  or r is run
-                                  for r in self.pool.runs.values()):
+                    while not self._flushed(run):
                         ev = [self.pool.state_changed.wait(),
                               run.worker.closed.wait()]
                         await asyncio_wait_or_cancel(
@@ -233,14 +385,7 @@ class RunStage(TaskObject):
         self.delete_cb = delete_cb
 
     def _get_run(self):
-        prepared_runs = filter(lambda r: r.status == RunStatus.prepare_done,
-                               self.pool.runs.values())
-        try:
-            r = max(prepared_runs, key=lambda r: r.priority_key())
-        except ValueError:
-            # prepared_runs is an empty sequence
-            r = None
-        return r
+        return self.pool.queues[RunStatus.prepare_done].top()
 
     async def _do(self):
         stack = []
@@ -287,14 +432,7 @@ class AnalyzeStage(TaskObject):
         self.delete_cb = delete_cb
 
     def _get_run(self):
-        run_runs = filter(lambda r: r.status == RunStatus.run_done,
-                          self.pool.runs.values())
-        try:
-            r = max(run_runs, key=lambda r: r.priority_key())
-        except ValueError:
-            # run_runs is an empty sequence
-            r = None
-        return r
+        return self.pool.queues[RunStatus.run_done].top()
 
     async def _do(self):
         while True:
@@ -316,21 +454,33 @@ class AnalyzeStage(TaskObject):
 
 
 class Pipeline:
-    def __init__(self, ridc, deleter, worker_handlers, notifier, experiment_db):
-        self.pool = RunPool(ridc, worker_handlers, notifier, experiment_db)
-        self._prepare = PrepareStage(self.pool, deleter.delete)
-        self._run = RunStage(self.pool, deleter.delete)
+    """Prepares, runs and analyzes the runs submitted to one pipeline.
+
+    ``concurrency`` is the number of runs that may execute their ``run``
+    stage at the same time. Each of them keeps the priority and pausing
+    behaviour of a single run stage: a paused run is resumed in the same
+    slot, unless a run of higher priority is prepared. As many runs are
+    prepared in advance as there are slots."""
+    def __init__(self, ridc, deleter, worker_handlers, notifier, experiment_db,
+                 worker_pool, concurrency=1):
+        self.pool = RunPool(ridc, worker_handlers, notifier, experiment_db,
+                            worker_pool)
+        self._prepare = PrepareStage(self.pool, deleter.delete, concurrency)
+        self._run = [RunStage(self.pool, deleter.delete)
+                     for i in range(concurrency)]
         self._analyze = AnalyzeStage(self.pool, deleter.delete)
 
     def start(self):
         self._prepare.start()
-        self._run.start()
+        for run_stage in self._run:
+            run_stage.start()
         self._analyze.start()
 
     async def stop(self):
         # NB: restart of a stopped pipeline is not supported
         await self._analyze.stop()
-        await self._run.stop()
+        for run_stage in self._run:
+            await run_stage.stop()
         await self._prepare.stop()
 
 
@@ -377,12 +527,23 @@ class Deleter(TaskObject):
 
 
 class Scheduler:
-    def __init__(self, ridc, worker_handlers, experiment_db):
+    """Schedules the runs submitted to the master.
+
+    :param pipeline_concurrency: Dictionary giving, for the names of some
+        pipelines, the number of runs of that pipeline that may be in their
+        ``run`` stage at the same time. This is intended for experiments that
+        only use the host, e.g. data analysis. Other pipelines execute one
+        run at a time.
+    """
+    def __init__(self, ridc, worker_handlers, experiment_db, worker_pool=None,
+                 pipeline_concurrency=dict()):
         self.notifier = Notifier(dict())
 
         self._pipelines = dict()
         self._worker_handlers = worker_handlers
         self._experiment_db = experiment_db
+        self._worker_pool = worker_pool
+        self._pipeline_concurrency = pipeline_concurrency
         self._terminated = False
 
         self._ridc = ridc
@@ -402,26 +563,70 @@ class Scheduler:
         if self._pipelines:
             logger.warning("some pipelines were not garbage-collected")
 
-    def submit(self, pipeline_name, expid, priority, due_date, flush):
-        """Submits a new run."""
-        # mutates expid to insert head repository revision if None
-        if self._terminated:
-            return
+    def _get_pipeline(self, pipeline_name):
         try:
             pipeline = self._pipelines[pipeline_name]
         except KeyError:
             logger.debug("creating pipeline '%s'", pipeline_name)
             pipeline = Pipeline(self._ridc, self._deleter,
                                 self._worker_handlers, self.notifier,
-                                self._experiment_db)
+                                self._experiment_db, self._worker_pool,
+                                self._pipeline_concurrency.get(
+                                    pipeline_name, 1))
             self._pipelines[pipeline_name] = pipeline
             pipeline.start()
+        return pipeline
+
+    def submit(self, pipeline_name, expid, priority, due_date, flush):
+        """Submits a new run."""
+        # mutates expid to insert head repository revision if None
+        if self._terminated:
+            return
+        pipeline = self._get_pipeline(pipeline_name)
         return pipeline.pool.submit(expid, priority, due_date, flush, pipeline_name)
 
+    def submit_many(self, runs):
+        """Submits several runs at once, and returns the list of their RIDs.
+
+        ``runs`` is a list of ``(pipeline_name, expid, priority, due_date,
+        flush)`` tuples, with the same meaning as the arguments of
+        ``submit``. The runs get consecutive RIDs, and their addition to the
+        schedule is published as a single notification. If one of the runs
+        cannot be submitted, none of them is."""
+        # mutates expids to insert head repository revision if None
+        if self._terminated or not runs:
+            return []
+        first_rid = self._ridc.get_block(len(runs))
+        notifications = dict()
+        created = []
+        try:
+            for rid, (pipeline_name, expid, priority, due_date, flush) \
+                    in enumerate(runs, first_rid):
+                pool = self._get_pipeline(pipeline_name).pool
+                run = pool.create_run(rid, expid, priority, due_date, flush,
+                                      pipeline_name)
+                notifications[rid] = run.notification
+                created.append((pool, run))
+        except:
+            # none of the runs is submitted if one of them cannot be
+            for pool, run in created:
+                pool.discard_run(run)
+            raise
+        pools = {pool for pool, run in created}
+        self.notifier.update(notifications)
+        for pool in pools:
+            pool.state_changed.notify()
+        return list(notifications.keys())
+
     def delete(self, rid):
         """Kills the run with the specified RID."""
         self._deleter.delete(rid)
 
+    def delete_many(self, rids):
+        """Kills the runs with the specified RIDs."""
+        for rid in rids:
+            self._deleter.delete(rid)
+
     def request_termination(self, rid):
         """Requests graceful termination of the run with the specified RID."""
         for pipeline in self._pipelines.values():
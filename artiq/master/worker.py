@@ -5,7 +5,7 @@ import logging
 import subprocess
 import time
 
-from artiq.protocols import pipe_ipc, pyon
+from artiq.protocols import pipe_ipc
 from artiq.protocols.logging import LogParser
 from artiq.protocols.packed_exceptions import current_exc_packed
 from artiq.tools import asyncio_wait_or_cancel
@@ -40,14 +40,137 @@ def log_worker_exception():
         logger.error("worker exception details", exc_info=True)
 
 
+class _WorkerProcess:
+    def __init__(self):
+        self.ipc = pipe_ipc.AsyncioParentComm()
+        # number of experiments built or examined by the process
+        self.runs = 0
+        self.log_source = lambda: "worker(idle)"
+
+    def _get_log_source(self):
+        return self.log_source()
+
+    async def start(self, log_level):
+        env = os.environ.copy()
+        env["PYTHONUNBUFFERED"] = "1"
+        await self.ipc.create_subprocess(
+            sys.executable, "-m", "artiq.master.worker_impl",
+            self.ipc.get_address(), str(log_level),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            env=env, start_new_session=True)
+        asyncio.ensure_future(
+            LogParser(self._get_log_source).stream_task(
+                self.ipc.process.stdout))
+        asyncio.ensure_future(
+            LogParser(self._get_log_source).stream_task(
+                self.ipc.process.stderr))
+
+    async def terminate(self, term_timeout=2.0):
+        if self.ipc.process.returncode is not None:
+            return
+        try:
+            self.ipc.write_frame({"action": "terminate"})
+            await asyncio.wait_for(self.ipc.process.wait(), term_timeout)
+            return
+        except:
+            logger.debug("idle worker failed to exit on request, killing",
+                         exc_info=True)
+        try:
+            self.ipc.process.kill()
+        except ProcessLookupError:
+            pass
+        await self.ipc.process.wait()
+
+
+class WorkerPool:
+    """Pool of idle worker processes, started in advance.
+
+    A run or an examination that obtains its process from the pool does
+    not wait for the Python interpreter to start and for ARTIQ (including
+    the compiler) to be imported.
+
+    A process that completed its experiment normally is returned to the
+    pool, until it has executed ``max_runs`` experiments. Processes that
+    fail or that are terminated are never reused.
+
+    :param size: Number of idle processes to keep ready.
+    :param max_runs: Number of experiments executed by a process before it
+        is terminated. With the default of 1, processes are not reused.
+    """
+    def __init__(self, size=2, max_runs=1):
+        self.size = size
+        self.max_runs = max_runs
+
+        self._idle = []
+        self._starting = 0
+        self._closed = False
+
+    def start(self):
+        self._fill()
+
+    def _fill(self):
+        while not self._closed and len(self._idle) + self._starting < self.size:
+            self._starting += 1
+            asyncio.ensure_future(self._start_process())
+
+    async def _start_process(self):
+        process = _WorkerProcess()
+        try:
+            await process.start(logging.WARNING)
+        except:
+            logger.warning("failed to start worker process", exc_info=True)
+            return
+        finally:
+            self._starting -= 1
+        self.put(process)
+
+    async def get(self):
+        """Returns an idle process, or starts a new one if there is none."""
+        try:
+            while self._idle:
+                process = self._idle.pop()
+                if process.ipc.process.returncode is None:
+                    return process
+            process = _WorkerProcess()
+            await process.start(logging.WARNING)
+            return process
+        finally:
+            self._fill()
+
+    def accepts(self, process):
+        """Returns whether *process* may be returned to the pool."""
+        return not self._closed and process.runs < self.max_runs
+
+    def put(self, process):
+        if self._closed:
+            asyncio.ensure_future(process.terminate())
+            return
+        process.log_source = lambda: "worker(idle)"
+        self._idle.append(process)
+        # get() takes the most recently added processes first
+        while len(self._idle) > self.size:
+            asyncio.ensure_future(self._idle.pop(0).terminate())
+
+    async def close(self):
+        """Terminates the idle processes."""
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for process in idle:
+            await process.terminate()
+
+
 class Worker:
-    def __init__(self, handlers=dict(), send_timeout=2.0):
+    def __init__(self, handlers=dict(), send_timeout=2.0, worker_pool=None):
         self.handlers = handlers
         self.send_timeout = send_timeout
+        self.worker_pool = worker_pool
 
         self.rid = None
         self.filename = None
+        self.process = None
         self.ipc = None
+        # the worker process is waiting for the next action
+        self.process_idle = False
         self.watchdogs = dict()  # wid -> expiration (using time.monotonic)
 
         self.io_lock = asyncio.Lock()
@@ -80,23 +203,39 @@ class Worker:
         try:
             if self.closed.is_set():
                 raise WorkerError("Attempting to create process after close")
-            self.ipc = pipe_ipc.AsyncioParentComm()
-            env = os.environ.copy()
-            env["PYTHONUNBUFFERED"] = "1"
-            await self.ipc.create_subprocess(
-                sys.executable, "-m", "artiq.master.worker_impl",
-                self.ipc.get_address(), str(log_level),
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                env=env, start_new_session=True)
-            asyncio.ensure_future(
-                LogParser(self._get_log_source).stream_task(
-                    self.ipc.process.stdout))
-            asyncio.ensure_future(
-                LogParser(self._get_log_source).stream_task(
-                    self.ipc.process.stderr))
+            if self.worker_pool is None:
+                process = _WorkerProcess()
+                await process.start(log_level)
+            else:
+                process = await self.worker_pool.get()
+            process.log_source = self._get_log_source
+            process.runs += 1
+            self.process = process
+            self.ipc = process.ipc
         finally:
             self.io_lock.release()
 
+    async def _release_process(self, term_timeout):
+        # Returns the process to the pool, after the worker has cleaned
+        # up the experiment. Returns False if the process must be terminated
+        # instead.
+        if (self.worker_pool is None or not self.process_idle
+                or not self.worker_pool.accepts(self.process)):
+            return False
+        try:
+            self.ipc.write_frame({"action": "release"})
+            await asyncio.wait_for(self.ipc.drain(), term_timeout)
+            obj = await asyncio.wait_for(self.ipc.read_frame(), term_timeout)
+            if obj != {"action": "completed"}:
+                raise WorkerError("Worker failed to release experiment")
+        except:
+            logger.debug("worker failed to release experiment (RID %s)",
+                         self.rid, exc_info=True)
+            return False
+        self.worker_pool.put(self.process)
+        logger.debug("worker returned to pool (RID %s)", self.rid)
+        return True
+
     async def close(self, term_timeout=2.0):
         """Interrupts any I/O with the worker process and terminates the
         worker process.
@@ -117,6 +256,8 @@ class Worker:
                                    " (RID %s)", self.ipc.process.returncode,
                                    self.rid)
                 return
+            if await self._release_process(term_timeout):
+                return
             try:
                 await self._send({"action": "terminate"}, cancellable=False)
                 await asyncio.wait_for(self.ipc.process.wait(), term_timeout)
@@ -154,8 +295,7 @@ class Worker:
 
     async def _send(self, obj, cancellable=True):
         assert self.io_lock.locked()
-        line = pyon.encode(obj)
-        self.ipc.write((line + "\n").encode())
+        self.ipc.write_frame(obj)
         ifs = [self.ipc.drain()]
         if cancellable:
             ifs.append(self.closed.wait())
@@ -173,19 +313,18 @@ class Worker:
     async def _recv(self, timeout):
         assert self.io_lock.locked()
         fs = await asyncio_wait_or_cancel(
-            [self.ipc.readline(), self.closed.wait()],
+            [self.ipc.read_frame(), self.closed.wait()],
             timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
         if all(f.cancelled() for f in fs):
             raise WorkerTimeout("Timeout receiving data from worker")
         if self.closed.is_set():
             raise WorkerError("Data transmission to worker cancelled")
-        line = fs[0].result()
-        if not line:
-            raise WorkerError("Worker ended while attempting to receive data")
         try:
-            obj = pyon.decode(line.decode())
+            obj = fs[0].result()
+        except asyncio.IncompleteReadError:
+            raise WorkerError("Worker ended while attempting to receive data")
         except:
-            raise WorkerError("Worker sent invalid PYON data")
+            raise WorkerError("Worker sent invalid data")
         return obj
 
     async def _handle_worker_requests(self):
@@ -205,6 +344,15 @@ class Worker:
                 return False
             elif action == "exception":
                 raise WorkerInternalException
+            elif action == "update_dataset":
+                # sent by the worker without waiting for a reply
+                try:
+                    self.handlers["update_dataset"](obj["mod"])
+                except:
+                    logger.warning("failed to apply dataset modification "
+                                   "from worker (RID %s)", self.rid,
+                                   exc_info=True)
+                continue
             elif action == "create_watchdog":
                 func = self.create_watchdog
             elif action == "delete_watchdog":
@@ -230,6 +378,7 @@ class Worker:
     async def _worker_action(self, obj, timeout=None):
         if timeout is not None:
             self.watchdogs[-1] = time.monotonic() + timeout
+        self.process_idle = False
         try:
             await self.io_lock.acquire()
             try:
@@ -243,6 +392,7 @@ class Worker:
         finally:
             if timeout is not None:
                 del self.watchdogs[-1]
+        self.process_idle = completed
         return completed
 
     async def build(self, rid, pipeline_name, wd, expid, priority,
@@ -4,6 +4,12 @@ import logging
 import os
 import tempfile
 import re
+import sqlite3
+import threading
+import time
+import zlib
+
+import numpy
 
 from artiq.protocols.sync_struct import Notifier
 from artiq.protocols.pc_rpc import AutoTarget, Client, BestEffortClient
@@ -12,6 +18,73 @@ from artiq.protocols.pc_rpc import AutoTarget, Client, BestEffortClient
 logger = logging.getLogger(__name__)
 
 
+class ResultsIndex:
+    """Index of the results files, stored in a SQLite database.
+
+    Each entry records the RID, experiment class name, start time,
+    repository revision (or ``None``) and path (relative to the results
+    directory) of a results file. It is filled in by the workers when
+    they write results, and lets the master recover the last RID and
+    clients look up results by RID without listing the results
+    directory."""
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename, timeout=30)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "rid INTEGER PRIMARY KEY, class_name TEXT, "
+                "start_time INTEGER, repo_rev TEXT, path TEXT)")
+
+    def close(self):
+        self.db.close()
+
+    def add(self, rid, class_name, start_time, repo_rev, path):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (rid, class_name, start_time, repo_rev, path))
+
+    def get(self, rid):
+        """Returns the entry of the given RID as a dictionary, or ``None``
+        if there is none."""
+        row = self.db.execute(
+            "SELECT class_name, start_time, repo_rev, path FROM results "
+            "WHERE rid = ?", (rid, )).fetchone()
+        if row is None:
+            return None
+        class_name, start_time, repo_rev, path = row
+        return {
+            "rid": rid,
+            "class_name": class_name,
+            "start_time": start_time,
+            "repo_rev": repo_rev,
+            "path": path
+        }
+
+    def last_rid(self):
+        """Returns the highest RID in the index, or ``None`` if it is
+        empty."""
+        return self.db.execute("SELECT MAX(rid) FROM results").fetchone()[0]
+
+
+class ResultsIndexReader:
+    """Read-only view of a ``ResultsIndex``, served by the master to the
+    clients."""
+    def __init__(self, index):
+        self._index = index
+
+    def get(self, rid):
+        return self._index.get(rid)
+
+    def last_rid(self):
+        return self._index.last_rid()
+
+
+def results_index_filename(results_dir="results"):
+    return os.path.join(results_dir, "index.db")
+
+
 class RIDCounter:
     def __init__(self, cache_filename="last_rid.pyon", results_dir="results"):
         self.cache_filename = cache_filename
@@ -25,12 +98,24 @@ class RIDCounter:
         self._update_cache(rid)
         return rid
 
+    def get_block(self, n):
+        """Allocates ``n`` consecutive RIDs and returns the first one."""
+        rid = self._next_rid
+        self._next_rid += n
+        self._update_cache(self._next_rid - 1)
+        return rid
+
     def _last_rid(self):
         try:
             rid = self._last_rid_from_cache()
         except FileNotFoundError:
-            logger.debug("Last RID cache not found, scanning results")
-            rid = self._last_rid_from_results()
+            rid = self._last_rid_from_index()
+            if rid is None:
+                logger.debug("Last RID cache and results index not found, "
+                             "scanning results")
+                rid = self._last_rid_from_results()
+            else:
+                logger.debug("Using last RID from results index")
             self._update_cache(rid)
             return rid
         else:
@@ -50,6 +135,20 @@ class RIDCounter:
         with open(self.cache_filename, "r") as f:
             return int(f.read())
 
+    def _last_rid_from_index(self):
+        filename = results_index_filename(self.results_dir)
+        if not os.path.exists(filename):
+            return None
+        try:
+            index = ResultsIndex(filename)
+            try:
+                return index.last_rid()
+            finally:
+                index.close()
+        except sqlite3.Error:
+            logger.warning("Failed to read results index", exc_info=True)
+            return None
+
     def _last_rid_from_results(self):
         r = -1
         try:
@@ -84,6 +183,59 @@ class RIDCounter:
         return r
 
 
+class ClientPool:
+    """Keeps the connections of ``Client`` controller devices open after
+    they are closed, so that later experiments executed by the same process
+    do not connect to the controllers again.
+
+    Connections are kept per host, port and target name, and are checked
+    with ``Client.check_rpc_connection`` before being handed out again.
+
+    The pool only lives as long as the worker process. The master recycles
+    its worker processes after each experiment unless ``--worker-max-runs``
+    is raised above its default of 1, and connections are then not reused
+    across experiments.
+
+    The ``connects``, ``reuses`` and ``reconnects`` attributes count the new
+    connections, the connections handed out again, and the new connections
+    made because a kept one had been closed by the controller."""
+    def __init__(self):
+        self.idle = dict()
+        self.connects = 0
+        self.reuses = 0
+        self.reconnects = 0
+
+    def get(self, host, port, target_name):
+        key = host, port, target_name
+        idle = self.idle.get(key, [])
+        reconnect = False
+        while idle:
+            client = idle.pop()
+            if client.check_rpc_connection():
+                self.reuses += 1
+                return client
+            client.close_rpc()
+            reconnect = True
+        client = Client(host, port, target_name)
+        self.connects += 1
+        if reconnect:
+            self.reconnects += 1
+        return client
+
+    def put(self, key, client):
+        if client.check_rpc_connection():
+            self.idle.setdefault(key, []).append(client)
+        else:
+            client.close_rpc()
+
+    def close(self):
+        """Closes all kept connections."""
+        for clients in self.idle.values():
+            for client in clients:
+                client.close_rpc()
+        self.idle.clear()
+
+
 def _create_device(desc, device_mgr):
     ty = desc["type"]
     if ty == "local":
@@ -100,14 +252,17 @@ def _create_device(desc, device_mgr):
         target_name = desc.get("target_name", None)
         if target_name is None:
             target_name = AutoTarget
-        return cls(desc["host"], desc["port"], target_name)
+        return device_mgr.create_client(cls, desc["host"], desc["port"],
+                                        target_name)
     elif ty == "controller_aux_target":
         controller = device_mgr.get_desc(desc["controller"])
         if desc.get("best_effort", controller.get("best_effort", False)):
             cls = BestEffortClient
         else:
             cls = Client
-        return cls(controller["host"], controller["port"], desc["target_name"])
+        return device_mgr.create_client(cls, controller["host"],
+                                        controller["port"],
+                                        desc["target_name"])
     else:
         raise ValueError("Unsupported type in device DB: " + ty)
 
@@ -118,13 +273,26 @@ class DeviceError(Exception):
 
 class DeviceManager:
     """Handles creation and destruction of local device drivers and controller
-    RPC clients."""
-    def __init__(self, ddb, virtual_devices=None):
+    RPC clients.
+
+    If a ``ClientPool`` is given, ``Client`` controller devices are taken
+    from it and returned to it when closed."""
+    def __init__(self, ddb, virtual_devices=None, client_pool=None):
         if virtual_devices is None:
             virtual_devices = dict()
         self.ddb = ddb
         self.virtual_devices = virtual_devices
+        self.client_pool = client_pool
         self.active_devices = OrderedDict()
+        # id of the clients obtained from client_pool -> pool key
+        self.pooled_clients = dict()
+
+    def create_client(self, cls, host, port, target_name):
+        if cls is not Client or self.client_pool is None:
+            return cls(host, port, target_name)
+        client = self.client_pool.get(host, port, target_name)
+        self.pooled_clients[id(client)] = host, port, target_name
+        return client
 
     def get_device_db(self):
         """Returns the full contents of the device database."""
@@ -185,7 +353,10 @@ class DeviceManager:
         requested."""
         for dev in reversed(list(self.active_devices.values())):
             try:
-                if isinstance(dev, (Client, BestEffortClient)):
+                if id(dev) in self.pooled_clients:
+                    self.client_pool.put(self.pooled_clients.pop(id(dev)),
+                                         dev)
+                elif isinstance(dev, (Client, BestEffortClient)):
                     dev.close_rpc()
                 elif hasattr(dev.__class__, "close"):
                     dev.close()
@@ -195,10 +366,168 @@ class DeviceManager:
         self.active_devices.clear()
 
 
+# Arrays smaller than this are stored contiguous and uncompressed, as the
+# chunking overhead outweighs the gains.
+_hdf5_compression_threshold = 64*1024
+# Arrays larger than this use a faster, lighter gzip level.
+_hdf5_large_dataset = 64*1024*1024
+
+
+def _hdf5_dataset_options(value, compression):
+    if (compression is None
+            or not isinstance(value, numpy.ndarray)
+            or value.nbytes < _hdf5_compression_threshold
+            or value.dtype.kind not in "biufc"):
+        return dict()
+    options = {"chunks": True, "compression": compression}
+    if compression == "gzip":
+        if value.nbytes > _hdf5_large_dataset:
+            options["compression_opts"] = 1
+        else:
+            options["compression_opts"] = 4
+    if value.dtype.itemsize > 1:
+        options["shuffle"] = True
+    return options
+
+
+def _write_hdf5_dataset(f, key, value, compression):
+    dataset = f.create_dataset(
+        key, data=value, **_hdf5_dataset_options(value, compression))
+    return dataset.size*dataset.dtype.itemsize, dataset.id.get_storage_size()
+
+
+def _hdf5_checksum(value):
+    # Returns None for values whose contents cannot change without
+    # replacing the object, and raises TypeError for values that must
+    # always be rewritten.
+    if isinstance(value, numpy.ndarray):
+        if value.dtype.hasobject:
+            raise TypeError
+        return zlib.crc32(numpy.ascontiguousarray(value).view(numpy.uint8))
+    elif isinstance(value, (bool, int, float, complex, str, bytes,
+                            numpy.generic)):
+        return None
+    else:
+        raise TypeError
+
+
+class _HDF5Writer(threading.Thread):
+    """Writes a snapshot of datasets while the experiment continues (e.g.
+    with its analysis stage). The contents of each array are checksummed
+    before writing, so that ``write_hdf5`` can detect and rewrite the
+    arrays modified since then."""
+    def __init__(self, f, datasets, compression):
+        threading.Thread.__init__(self)
+        self.f = f
+        self.datasets = datasets
+        self.compression = compression
+        self.cancelled = False
+
+        self.written = dict()
+        self.nbytes = 0
+        self.storage_size = 0
+        self.elapsed = 0.0
+
+    def run(self):
+        start = time.monotonic()
+        for key, value in self.datasets:
+            if self.cancelled:
+                break
+            try:
+                checksum = _hdf5_checksum(value)
+            except TypeError:
+                continue
+            try:
+                nbytes, storage_size = _write_hdf5_dataset(
+                    self.f, key, value, self.compression)
+            except:
+                logger.debug("failed to write dataset '%s' in background",
+                             key, exc_info=True)
+                if key in self.f:
+                    del self.f[key]
+                continue
+            self.nbytes += nbytes
+            self.storage_size += storage_size
+            self.written[key] = value, checksum
+        self.elapsed = time.monotonic() - start
+
+
+class _HDF5Stream:
+    """Keeps the local array datasets of a run in resizable HDF5 datasets
+    instead of memory, and flushes the file at most every
+    ``flush_interval`` seconds.
+
+    HDF5 cannot create or delete datasets once the file is in SWMR mode.
+    After that, ``set`` returns False for arrays that would need a new
+    dataset, and the caller keeps them in memory instead."""
+    def __init__(self, f, flush_interval, compression):
+        self.f = f
+        self.flush_interval = flush_interval
+        self.compression = compression
+        self.keys = set()
+        self.last_flush = time.monotonic()
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def _flush_if_due(self):
+        now = time.monotonic()
+        if now - self.last_flush >= self.flush_interval:
+            self.flush()
+            self.last_flush = now
+
+    def flush(self):
+        self.f.file.flush()
+
+    def set(self, key, value):
+        if (not isinstance(value, numpy.ndarray) or value.ndim == 0
+                or value.dtype.kind not in "biufc"):
+            self.keys.discard(key)
+            return False
+        dataset = self.f.get(key)
+        if (dataset is not None
+                and dataset.shape == value.shape
+                and dataset.dtype == value.dtype):
+            dataset[...] = value
+        elif self.f.file.swmr_mode:
+            self.keys.discard(key)
+            return False
+        else:
+            if dataset is not None:
+                del self.f[key]
+            options = _hdf5_dataset_options(value, self.compression)
+            options["chunks"] = True
+            self.f.create_dataset(key, data=value,
+                                  maxshape=(None, ) + value.shape[1:],
+                                  **options)
+        self.keys.add(key)
+        self._flush_if_due()
+        return True
+
+    def get(self, key):
+        return self.f[key][()]
+
+    def mutate(self, key, index, value):
+        self.f[key][index] = value
+        self._flush_if_due()
+
+    def extend(self, key, values):
+        dataset = self.f[key]
+        n = len(dataset)
+        dataset.resize(n + len(values), axis=0)
+        dataset[n:] = values
+        self._flush_if_due()
+
+
 class DatasetManager:
     def __init__(self, ddb):
         self.broadcast = Notifier(dict())
         self.local = dict()
+        self._hdf5_writer = None
+
+        self.streaming = None
+        self._stream = None
+        self.compression = None
 
         self.ddb = ddb
         self.broadcast.publish = ddb.update
@@ -209,24 +538,133 @@ class DatasetManager:
         if broadcast:
             self.broadcast[key] = persist, value
         if save:
-            self.local[key] = value
+            if self._stream is not None and self._stream.set(key, value):
+                self.local.pop(key, None)
+            else:
+                self.local[key] = value
 
     def mutate(self, key, index, value):
+        streamed = self._stream is not None and key in self._stream
         target = None
         if key in self.local:
             target = self.local[key]
         if key in self.broadcast.read:
             target = self.broadcast[key][1]
-        if target is None:
+        if target is not None:
+            target[index] = value
+        elif not streamed:
             raise KeyError("Cannot mutate non-existing dataset")
-        target[index] = value
+        if streamed:
+            self._stream.mutate(key, index, value)
+
+    def extend(self, key, values):
+        streamed = self._stream is not None and key in self._stream
+        if key in self.broadcast.read:
+            self.broadcast[key][1].append_array(values)
+            if key in self.local:
+                self.local[key] = self.broadcast.read[key][1]
+        elif key in self.local:
+            target = self.local[key]
+            if isinstance(target, list):
+                target.extend(values)
+            else:
+                self.local[key] = numpy.concatenate((target, values))
+        elif not streamed:
+            raise KeyError("Cannot extend non-existing dataset")
+        if streamed:
+            self._stream.extend(key, values)
 
     def get(self, key):
         if key in self.local:
             return self.local[key]
+        elif self._stream is not None and key in self._stream:
+            return self._stream.get(key)
         else:
             return self.ddb.get(key)
 
+    def enable_streaming(self, flush_interval=1.0):
+        """Requests that the local datasets of the run be streamed into
+        the results file while the experiment executes. The worker opens
+        the file and calls ``start_streaming`` after the experiment is built.
+        """
+        self.streaming = flush_interval
+
+    def enable_compression(self, compression="gzip"):
+        """Requests that the large numerical arrays of the run be stored
+        chunked and compressed with ``compression`` (``"gzip"``, ``"lzf"``
+        or ``None``) in the results file. By default, they are stored
+        uncompressed, which is faster to write."""
+        self.compression = compression
+
+    def start_streaming(self, f):
+        """Moves the local array datasets into the HDF5 group ``f`` and
+        writes subsequent modifications of them there, flushing the file
+        periodically. ``f`` must belong to a file opened with
+        ``libver="latest"`` if it is to be switched to SWMR mode."""
+        self._stream = _HDF5Stream(f, self.streaming, self.compression)
+        for key, value in list(self.local.items()):
+            if self._stream.set(key, value):
+                del self.local[key]
+        self._stream.flush()
+
+    def stop_streaming(self):
+        """Flushes the streamed datasets. They are left in the file, and
+        ``write_hdf5`` only writes the datasets that remained in memory."""
+        if self._stream is not None:
+            self._stream.flush()
+            self._stream = None
+
+    def start_hdf5_write(self, f):
+        """Starts writing the local datasets into the HDF5 group ``f`` in a
+        background thread. Call ``write_hdf5`` with the same group to wait
+        for it and write the datasets that were created or modified in the
+        meantime.
+
+        Large numerical arrays are compressed as set by
+        ``enable_compression``."""
+        self._hdf5_writer = _HDF5Writer(f, list(self.local.items()),
+                                        self.compression)
+        self._hdf5_writer.start()
+
+    def cancel_hdf5_write(self):
+        """Stops a write started by ``start_hdf5_write`` and waits for the
+        background thread to exit."""
+        if self._hdf5_writer is not None:
+            self._hdf5_writer.cancelled = True
+            self._hdf5_writer.join()
+            self._hdf5_writer = None
+
     def write_hdf5(self, f):
+        start = time.monotonic()
+        written = dict()
+        nbytes = storage_size = 0
+        background_elapsed = 0.0
+        writer = self._hdf5_writer
+        if writer is not None:
+            writer.join()
+            self._hdf5_writer = None
+            written = writer.written
+            nbytes = writer.nbytes
+            storage_size = writer.storage_size
+            background_elapsed = writer.elapsed
         for k, v in self.local.items():
-            f[k] = v
+            if k in written:
+                written_value, checksum = written[k]
+                try:
+                    if written_value is v and _hdf5_checksum(v) == checksum:
+                        continue
+                except TypeError:
+                    pass
+            if k in f:
+                del f[k]
+            n, s = _write_hdf5_dataset(f, k, v, self.compression)
+            nbytes += n
+            storage_size += s
+        elapsed = time.monotonic() - start
+        write_time = background_elapsed + elapsed
+        if write_time:
+            logger.info("wrote %d datasets, %.1f MB (%.1f MB stored) in "
+                        "%.2fs (%.1f MB/s), %.2fs in background",
+                        len(self.local), nbytes/1e6, storage_size/1e6,
+                        write_time, nbytes/1e6/write_time,
+                        background_elapsed)
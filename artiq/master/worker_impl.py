@@ -1,8 +1,11 @@
 import sys
+import copy
 import time
 import os
+import threading
 import logging
 import traceback
+import importlib.machinery
 from collections import OrderedDict
 
 import h5py
@@ -11,7 +14,9 @@ import artiq
 from artiq.protocols import pipe_ipc, pyon
 from artiq.protocols.packed_exceptions import raise_packed_exc
 from artiq.tools import multiline_log_config, file_import
-from artiq.master.worker_db import DeviceManager, DatasetManager
+from artiq.master.worker_db import (DeviceManager, DatasetManager,
+                                    ClientPool, ResultsIndex,
+                                    results_index_filename)
 from artiq.language.environment import (is_experiment, TraceArgumentManager,
                                         ProcessArgumentManager)
 from artiq.language.core import set_watchdog_factory, TerminationRequested
@@ -20,16 +25,62 @@ from artiq import __version__ as artiq_version
 
 
 ipc = None
+# serializes writes to the pipe by the main thread and by _ModBatch timers
+ipc_lock = threading.Lock()
+
+
+class _ModBatch:
+    """Dataset mods sent to the master without waiting for replies.
+
+    Mods are encoded when they are made, and are written to the pipe once
+    *flush_size* bytes are pending, *flush_interval* seconds after the
+    first pending mod, or before any other message to the master (so that
+    e.g. ``get_dataset`` sees them)."""
+    def __init__(self, flush_interval=0.05, flush_size=64*1024):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.frames = []
+        self.size = 0
+        self.timer = None
+
+    def add(self, mod):
+        frame = pipe_ipc.encode_frame({"action": "update_dataset",
+                                       "mod": mod})
+        with ipc_lock:
+            self.frames.append(frame)
+            self.size += len(frame)
+            if self.size >= self.flush_size:
+                self.flush_locked()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.flush_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with ipc_lock:
+            self.flush_locked()
+
+    def flush_locked(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.frames:
+            ipc.write(b"".join(self.frames))
+            self.frames = []
+            self.size = 0
+
+
+mod_batch = _ModBatch()
 
 
 def get_object():
-    line = ipc.readline().decode()
-    return pyon.decode(line)
+    return ipc.read_frame()
 
 
 def put_object(obj):
-    ds = pyon.encode(obj)
-    ipc.write((ds + "\n").encode())
+    with ipc_lock:
+        mod_batch.flush_locked()
+        ipc.write_frame(obj)
 
 
 def make_parent_action(action):
@@ -50,13 +101,49 @@ def make_parent_action(action):
 
 
 class ParentDeviceDB:
-    get_device_db = make_parent_action("get_device_db")
-    get = make_parent_action("get_device")
+    """Snapshot of the device database of the master.
+
+    The snapshot is checked against the master on the first lookup after
+    ``invalidate`` (called for each experiment built or examined), and is
+    only transferred again if the device database has changed since.
+    Lookups are then local."""
+    _get_snapshot = staticmethod(make_parent_action("get_device_db_snapshot"))
+    generation = None
+    data = None
+    current = False
+
+    @classmethod
+    def invalidate(cls):
+        cls.current = False
+
+    @classmethod
+    def _snapshot(cls):
+        if not cls.current:
+            snapshot = cls._get_snapshot(cls.generation)
+            if snapshot is not None:
+                cls.generation, cls.data = snapshot
+            cls.current = True
+        return cls.data
+
+    # The snapshot is shared by later lookups, so callers get copies.
+    @classmethod
+    def get_device_db(cls):
+        return copy.deepcopy(cls._snapshot())
+
+    @classmethod
+    def get(cls, key):
+        return copy.deepcopy(cls._snapshot()[key])
 
 
 class ParentDatasetDB:
     get = make_parent_action("get_dataset")
-    update = make_parent_action("update_dataset")
+    # does not wait for the master to process the mod
+    update = mod_batch.add
+
+    # also used as dataset manager when examining experiments
+    @staticmethod
+    def enable_streaming(flush_interval):
+        pass
 
 
 class Watchdog:
@@ -121,7 +208,7 @@ register_experiment = make_parent_action("register_experiment")
 
 
 class ExamineDeviceMgr:
-    get_device_db = make_parent_action("get_device_db")
+    get_device_db = ParentDeviceDB.get_device_db
 
     def get(name):
         return None
@@ -173,11 +260,94 @@ def setup_diagnostics(experiment_file, repository_path):
         render_diagnostic
 
 
+# Connections to controllers, kept for the next experiments executed by
+# this process (worker pool).
+client_pool = ClientPool()
+
+
+def create_managers():
+    device_mgr = DeviceManager(ParentDeviceDB, client_pool=client_pool)
+    device_mgr.virtual_devices["scheduler"] = Scheduler(device_mgr)
+    dataset_mgr = DatasetManager(ParentDatasetDB)
+    return device_mgr, dataset_mgr
+
+
+def unload_modules(path, loaded_before):
+    """Removes the modules imported by the experiment from the given
+    directory (typically the experiment and its helper modules) from
+    ``sys.modules``, so that the next experiment executed by this process
+    imports them again.
+
+    Only the modules that are not in ``loaded_before``, the names in
+    ``sys.modules`` before the experiment was loaded, are removed.
+    Extension modules and packages installed in the directory (e.g. in a
+    virtualenv) are kept, as they may not support being imported again."""
+    path = os.path.join(os.path.realpath(path), "")
+    for name in set(sys.modules.keys()) - loaded_before:
+        module = sys.modules[name]
+        filename = getattr(module, "__file__", None)
+        if filename is None:
+            continue
+        filename = os.path.realpath(filename)
+        if not filename.startswith(path):
+            continue
+        relative = filename[len(path):].split(os.sep)
+        if "site-packages" in relative or "dist-packages" in relative:
+            continue
+        if isinstance(getattr(module, "__loader__", None),
+                      importlib.machinery.ExtensionFileLoader):
+            continue
+        del sys.modules[name]
+
+
+def open_results(rid, exp, start_time, expid, libver=None):
+    filename = "{:09}-{}.h5".format(rid, exp.__name__)
+    f = h5py.File(filename, "w", libver=libver)
+    f.create_group("datasets")
+    f["artiq_version"] = artiq_version
+    f["rid"] = rid
+    f["start_time"] = int(time.mktime(start_time))
+    f["expid"] = pyon.encode(expid)
+    return f
+
+
+def index_results(results_dir, rid, exp, start_time, expid, filename):
+    path = os.path.relpath(os.path.abspath(filename), results_dir)
+    try:
+        index = ResultsIndex(results_index_filename(results_dir))
+        try:
+            index.add(rid, exp.__name__, int(time.mktime(start_time)),
+                      expid.get("repo_rev"), path)
+        finally:
+            index.close()
+    except:
+        logging.warning("Failed to add RID %d to the results index", rid,
+                        exc_info=True)
+
+
+def close_results(dataset_mgr, f):
+    # Called when the run ends before write_results. Streamed results are
+    # kept as partial results, others are removed as they would not have
+    # been written at all.
+    if dataset_mgr.streaming is not None:
+        dataset_mgr.stop_streaming()
+        f.close()
+    else:
+        dataset_mgr.cancel_hdf5_write()
+        filename = os.path.abspath(f.filename)
+        f.close()
+        os.unlink(filename)
+
+
 def main():
     global ipc
 
     multiline_log_config(level=int(sys.argv[2]))
     ipc = pipe_ipc.ChildComm(sys.argv[1])
+    initial_cwd = os.getcwd()
+    results_dir = os.path.join(initial_cwd, "results")
+    # names in sys.modules before the current experiment was loaded
+    loaded_modules = None
 
     start_time = None
     rid = None
@@ -185,16 +355,18 @@ def main():
     exp = None
     exp_inst = None
     repository_path = None
+    experiment_dir = None
+    results_file = None
 
-    device_mgr = DeviceManager(ParentDeviceDB)
-    device_mgr.virtual_devices["scheduler"] = Scheduler(device_mgr)
-    dataset_mgr = DatasetManager(ParentDatasetDB)
+    device_mgr, dataset_mgr = create_managers()
 
     try:
         while True:
             obj = get_object()
             action = obj["action"]
             if action == "build":
+                logging.getLogger().setLevel(obj["expid"]["log_level"])
+                ParentDeviceDB.invalidate()
                 start_time = time.localtime()
                 rid = obj["rid"]
                 expid = obj["expid"]
@@ -205,7 +377,11 @@ def main():
                 else:
                     experiment_file = expid["file"]
                     repository_path = None
+                experiment_dir = os.path.dirname(
+                    os.path.abspath(experiment_file))
                 setup_diagnostics(experiment_file, repository_path)
+                if loaded_modules is None:
+                    loaded_modules = set(sys.modules.keys())
                 exp = get_exp(experiment_file, expid["class_name"])
                 device_mgr.virtual_devices["scheduler"].set_run_info(
                     rid, obj["pipeline_name"], expid, obj["priority"])
@@ -216,28 +392,74 @@ def main():
                 os.chdir(dirname)
                 argument_mgr = ProcessArgumentManager(expid["arguments"])
                 exp_inst = exp((device_mgr, dataset_mgr, argument_mgr))
+                if dataset_mgr.streaming is not None:
+                    results_file = open_results(rid, exp, start_time, expid,
+                                                libver="latest")
+                    dataset_mgr.start_streaming(results_file["datasets"])
+                    # partial results are kept if the run fails
+                    index_results(results_dir, rid, exp, start_time, expid,
+                                  results_file.filename)
                 put_object({"action": "completed"})
             elif action == "prepare":
                 exp_inst.prepare()
                 put_object({"action": "completed"})
             elif action == "run":
+                if results_file is not None:
+                    # let other processes read the results during the run
+                    results_file.swmr_mode = True
                 exp_inst.run()
                 put_object({"action": "completed"})
             elif action == "analyze":
+                if results_file is None:
+                    # write the datasets produced by run() while analyzing
+                    results_file = open_results(rid, exp, start_time, expid)
+                    dataset_mgr.start_hdf5_write(results_file["datasets"])
                 exp_inst.analyze()
                 put_object({"action": "completed"})
             elif action == "write_results":
-                filename = "{:09}-{}.h5".format(rid, exp.__name__)
-                with h5py.File(filename, "w") as f:
-                    dataset_mgr.write_hdf5(f.create_group("datasets"))
-                    f["artiq_version"] = artiq_version
-                    f["rid"] = rid
-                    f["start_time"] = int(time.mktime(start_time))
-                    f["expid"] = pyon.encode(expid)
+                if results_file is None:
+                    results_file = open_results(rid, exp, start_time, expid)
+                elif dataset_mgr.streaming is not None:
+                    # reopen without SWMR, to create the datasets that
+                    # could not be streamed
+                    dataset_mgr.stop_streaming()
+                    filename = results_file.filename
+                    results_file.close()
+                    results_file = h5py.File(filename, "a")
+                f = results_file
+                results_file = None
+                with f:
+                    dataset_mgr.write_hdf5(f["datasets"])
+                    filename = f.filename
+                index_results(results_dir, rid, exp, start_time, expid,
+                              filename)
                 put_object({"action": "completed"})
             elif action == "examine":
+                logging.getLogger().setLevel(logging.WARNING)
+                experiment_dir = os.path.dirname(os.path.abspath(obj["file"]))
+                ParentDeviceDB.invalidate()
+                if loaded_modules is None:
+                    loaded_modules = set(sys.modules.keys())
                 examine(ExamineDeviceMgr, ParentDatasetDB, obj["file"])
                 put_object({"action": "completed"})
+            elif action == "release":
+                # prepare the process for the next experiment (worker pool)
+                if results_file is not None:
+                    close_results(dataset_mgr, results_file)
+                    results_file = None
+                device_mgr.close_devices()
+                logging.debug("controller connections: %d new (%d after "
+                              "the previous one was lost), %d reused",
+                              client_pool.connects, client_pool.reconnects,
+                              client_pool.reuses)
+                if experiment_dir is not None and loaded_modules is not None:
+                    unload_modules(experiment_dir, loaded_modules)
+                loaded_modules = None
+                os.chdir(initial_cwd)
+                start_time = rid = expid = exp = exp_inst = None
+                repository_path = experiment_dir = None
+                device_mgr, dataset_mgr = create_managers()
+                put_object({"action": "completed"})
             elif action == "terminate":
                 break
     except Exception as exc:
@@ -258,7 +480,10 @@ def main():
                           exc_info=not hasattr(exc, "parent_traceback"))
         put_object({"action": "exception"})
     finally:
+        if results_file is not None:
+            close_results(dataset_mgr, results_file)
         device_mgr.close_devices()
+        client_pool.close()
         ipc.close()
 
 
@@ -51,11 +51,84 @@ class Receiver:
                 notify_cb(obj)
 
 
+class _Recipient:
+    """Messages waiting to be sent to one receiver, and statistics."""
+    def __init__(self, name, peer, transport):
+        self.name = name
+        self.peer = peer
+        self.transport = transport
+        self.event = asyncio.Event()
+        self.lines = []
+        self.pending_bytes = 0
+        # set in lossless mode when the receiver is too slow
+        self.overflow = False
+
+        self.sent_messages = 0
+        self.sent_bytes = 0
+        self.dropped_messages = 0
+        self.dropped_bytes = 0
+
+    def drop(self, line):
+        self.dropped_messages += 1
+        self.dropped_bytes += len(line)
+
+    def take(self):
+        """Returns the messages to send, and empties the queue."""
+        lines = self.lines
+        self.lines = []
+        self.pending_bytes = 0
+        self.event.clear()
+        return lines
+
+    def get_stats(self):
+        return {
+            "name": self.name,
+            "peer": self.peer,
+            "pending_messages": len(self.lines),
+            "pending_bytes": self.pending_bytes,
+            "sent_messages": self.sent_messages,
+            "sent_bytes": self.sent_bytes,
+            "dropped_messages": self.dropped_messages,
+            "dropped_bytes": self.dropped_bytes
+        }
+
+
 class Broadcaster(AsyncioServer):
-    def __init__(self, queue_limit=1024):
+    """A network server that sends objects to the ``Receivers`` connected
+    under a given name.
+
+    Each object is encoded once, and the encoded message is shared by all
+    receivers. The messages that accumulate while a receiver is being
+    written to are sent together, in a single write.
+
+    By default, messages for a receiver that has ``queue_limit`` messages
+    waiting are dropped. In lossless mode, no message is dropped, and
+    receivers that have more than ``max_buffer`` bytes waiting are
+    disconnected instead, which bounds memory usage.
+
+    ``get_stats`` returns the number of messages and bytes sent and dropped
+    for each receiver.
+    """
+    def __init__(self, queue_limit=1024, lossless=False,
+                 max_buffer=64*1024*1024):
         AsyncioServer.__init__(self)
         self._queue_limit = queue_limit
+        self._lossless = lossless
+        self._max_buffer = max_buffer
         self._recipients = dict()
+        self._disconnected = 0
+
+    def get_stats(self):
+        """Returns a dictionary with a list of statistics for each connected
+        receiver (``receivers``), and the number of receivers disconnected
+        because they could not keep up in lossless mode
+        (``disconnected``)."""
+        return {
+            "receivers": [recipient.get_stats()
+                          for recipients in self._recipients.values()
+                          for recipient in recipients],
+            "disconnected": self._disconnected
+        }
 
     async def _handle_connection_cr(self, reader, writer):
         try:
@@ -68,19 +141,28 @@ class Broadcaster(AsyncioServer):
                 return
             name = line.decode()[:-1]
 
-            queue = asyncio.Queue(self._queue_limit)
+            peer = writer.get_extra_info("peername")
+            if peer is not None:
+                peer = tuple(peer[:2])
+            recipient = _Recipient(name, peer, writer.transport)
             if name in self._recipients:
-                self._recipients[name].add(queue)
+                self._recipients[name].add(recipient)
             else:
-                self._recipients[name] = {queue}
+                self._recipients[name] = {recipient}
             try:
                 while True:
-                    line = await queue.get()
-                    writer.write(line)
+                    await recipient.event.wait()
+                    if recipient.overflow:
+                        return
+                    lines = recipient.take()
+                    data = b"".join(lines)
+                    writer.write(data)
+                    recipient.sent_messages += len(lines)
+                    recipient.sent_bytes += len(data)
                     # raise exception on connection error
                     await writer.drain()
             finally:
-                self._recipients[name].remove(queue)
+                self._recipients[name].remove(recipient)
                 if not self._recipients[name]:
                     del self._recipients[name]
         except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
@@ -90,13 +172,41 @@ class Broadcaster(AsyncioServer):
             writer.close()
 
     def broadcast(self, name, obj):
-        if name in self._recipients:
-            line = pyon.encode(obj) + "\n"
-            line = line.encode()
-            for recipient in self._recipients[name]:
-                try:
-                    recipient.put_nowait(line)
-                except asyncio.QueueFull:
-                    # do not log: log messages may be sent back to us
-                    # as broadcasts, and cause infinite recursion.
-                    pass
+        # Do not log in this method: log messages may be sent back to us
+        # as broadcasts, and cause infinite recursion.
+        if name not in self._recipients:
+            return
+        line = pyon.encode_to_bytes(obj, end=b"\n")
+        for recipient in self._recipients[name]:
+            if recipient.overflow:
+                recipient.drop(line)
+                continue
+            if self._lossless:
+                if recipient.pending_bytes + len(line) > self._max_buffer:
+                    # The receiver may be stuck in drain(), so close the
+                    # connection here rather than in its handler.
+                    recipient.overflow = True
+                    for pending in recipient.take():
+                        recipient.drop(pending)
+                    recipient.drop(line)
+                    recipient.event.set()
+                    recipient.transport.abort()
+                    self._disconnected += 1
+                    continue
+            elif len(recipient.lines) >= self._queue_limit:
+                recipient.drop(line)
+                continue
+            recipient.lines.append(line)
+            recipient.pending_bytes += len(line)
+            recipient.event.set()
+
+
+class BroadcasterStats:
+    """Gives access to the statistics of a ``Broadcaster`` only, so that
+    they can be served to RPC clients without letting them broadcast
+    messages or stop the broadcaster."""
+    def __init__(self, broadcaster):
+        self._broadcaster = broadcaster
+
+    def get_stats(self):
+        return self._broadcaster.get_stats()
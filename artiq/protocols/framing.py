@@ -0,0 +1,89 @@
+"""Binary frames carrying PYON-serializable objects, shared by the binary
+transport of ``pc_rpc`` and by ``pipe_ipc``.
+
+A frame is made of a header giving the length of the PYON string and the
+number of out-of-band buffers, the length of each buffer, the PYON string
+and finally the contents of the buffers. The buffers hold the contents of
+Numpy arrays, which are thus transferred without being base64-encoded.
+
+Readers take the maximum size of a frame, and frames announcing more data
+are rejected with ``ValueError`` before anything is allocated for them.
+"""
+
+import struct
+
+from artiq.protocols import pyon
+
+
+__all__ = ["frame_header", "buffer_length", "encode_frame", "write_frame",
+           "read_frame", "read_frame_blocking"]
+
+
+frame_header = struct.Struct(">II")
+buffer_length = struct.Struct(">Q")
+
+
+def encode_frame(obj):
+    """Encodes *obj* and returns the list of the parts of the frame.
+
+    The parts include views on the contents of Numpy arrays, which must not
+    be modified until the parts are written."""
+    s, buffers = pyon.encode_with_buffers(obj)
+    s = s.encode()
+    header = frame_header.pack(len(s), len(buffers))
+    header += b"".join(buffer_length.pack(len(buf)) for buf in buffers)
+    return [header + s] + buffers
+
+
+def write_frame(writer, obj):
+    """Writes a frame encoding *obj* with the ``write`` method of
+    *writer*."""
+    for part in encode_frame(obj):
+        writer.write(part)
+
+
+def _check_frame_size(size, max_size):
+    if size > max_size:
+        raise ValueError("Frame of {} bytes or more exceeds the maximum "
+                         "size of {} bytes".format(size, max_size))
+
+
+def _unpack_frame_header(header, max_size):
+    length, nbuffers = frame_header.unpack(header)
+    _check_frame_size(length + buffer_length.size*nbuffers, max_size)
+    return length, nbuffers
+
+
+def _unpack_buffer_lengths(length, lengths, max_size):
+    buffer_lengths = [n for (n, ) in buffer_length.iter_unpack(lengths)]
+    _check_frame_size(length + len(lengths) + sum(buffer_lengths), max_size)
+    return buffer_lengths
+
+
+async def read_frame(reader, max_size):
+    """Reads a frame with the asynchronous ``readexactly`` method of
+    *reader* (e.g. an ``asyncio.StreamReader``) and returns the decoded
+    object."""
+    length, nbuffers = _unpack_frame_header(
+        await reader.readexactly(frame_header.size), max_size)
+    lengths = _unpack_buffer_lengths(
+        length, await reader.readexactly(buffer_length.size*nbuffers),
+        max_size)
+    s = await reader.readexactly(length)
+    buffers = []
+    for n in lengths:
+        buffers.append(await reader.readexactly(n))
+    return pyon.decode_with_buffers(s.decode(), buffers)
+
+
+def read_frame_blocking(readexactly, max_size):
+    """Reads a frame with *readexactly*, a function that takes a number of
+    bytes and returns that many bytes, and returns the decoded object.
+    Numpy arrays are not copied if it returns writable buffers."""
+    length, nbuffers = _unpack_frame_header(
+        readexactly(frame_header.size), max_size)
+    lengths = _unpack_buffer_lengths(
+        length, readexactly(buffer_length.size*nbuffers), max_size)
+    s = readexactly(length)
+    buffers = [readexactly(n) for n in lengths]
+    return pyon.decode_with_buffers(s.decode(), buffers)
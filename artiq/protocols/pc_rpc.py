@@ -4,6 +4,16 @@ between conventional computers (PCs) running Python. It strives to be
 transparent and uses ``artiq.protocols.pyon`` internally so that e.g. Numpy
 arrays can be easily used.
 
+Connections use a text transport, where each request and reply is a line of
+PYON, unless the client asks for the binary transport and the server supports
+it. The binary transport sends length-prefixed frames, and transfers the
+contents of Numpy arrays as raw buffers next to the PYON string instead of
+base64-encoding them.
+
+Requests may carry an identifier, which the server copies into the reply.
+Clients can then send several requests without waiting for the replies
+(pipelining), and the server may reply to them out of order.
+
 Note that the server operates on copies of objects provided by the client,
 and modifications to mutable types are not written back. For example, if the
 client passes a list as a parameter of an RPC method, and that method
@@ -17,9 +27,12 @@ import threading
 import time
 import logging
 import inspect
+import weakref
+from collections import deque
+from contextlib import contextmanager
 from operator import itemgetter
 
-from artiq.protocols import pyon
+from artiq.protocols import pyon, framing
 from artiq.protocols.asyncio_server import AsyncioServer as _AsyncioServer
 from artiq.protocols.packed_exceptions import *
 
@@ -40,6 +53,69 @@ class IncompatibleServer(Exception):
 
 
 _init_string = b"ARTIQ pc_rpc\n"
+_binary_string = b"ARTIQ pc_rpc binary\n"
+
+
+# Frames announcing more data than this are rejected before anything is
+# allocated for them. The text transport is similarly limited by the line
+# length limit of the stream readers.
+_max_frame_size = 256*1024*1024
+
+
+def _send_frame(sock, obj):
+    for part in framing.encode_frame(obj):
+        sock.sendall(part)
+
+
+def _recv_into(sock, buf):
+    view = memoryview(buf)
+    while view:
+        n = sock.recv_into(view)
+        if not n:
+            raise ConnectionResetError("Connection closed in the middle "
+                                       "of a frame")
+        view = view[n:]
+    return buf
+
+
+def _recv_frame(sock, max_size=_max_frame_size):
+    return framing.read_frame_blocking(
+        lambda n: _recv_into(sock, bytearray(n)), max_size)
+
+
+def _reply_result(obj):
+    if obj["status"] == "ok":
+        return obj["ret"]
+    elif obj["status"] == "failed":
+        raise_packed_exc(obj["exception"])
+    else:
+        raise ValueError
+
+
+class RPCFuture:
+    """Pending result of a call made with ``Client.submit_rpc`` or inside
+    ``Client.batch``."""
+    def __init__(self, wait):
+        self.__wait = wait
+        self.__reply = None
+
+    def done(self):
+        """Returns whether the reply has been received."""
+        return self.__reply is not None
+
+    def result(self):
+        """Returns the value returned by the RPC method, or raises the
+        exception it raised. Blocks until the reply is received."""
+        if self.__reply is None:
+            self.__reply = self.__wait()
+        return _reply_result(self.__reply)
+
+
+def _write_reply(writer, binary, reply):
+    if binary:
+        framing.write_frame(writer, reply)
+    else:
+        writer.write(pyon.encode_to_bytes(reply, end=b"\n"))
 
 
 def _validate_target_name(target_name, target_names):
@@ -92,8 +168,29 @@ class Client:
         ``socket.settimeout()`` in the Python standard library. A timeout
         in the middle of a RPC can break subsequent RPCs (from the same
         client).
+    :param binary: Use the binary transport if the server supports it.
+        Otherwise, or if the server does not support it, the text transport
+        is used.
+
+    Calls can be pipelined with ``submit_rpc`` and ``batch``, which return
+    ``RPCFuture`` objects instead of waiting for each reply.
     """
-    def __init__(self, host, port, target_name=AutoTarget, timeout=None):
+    def __init__(self, host, port, target_name=AutoTarget, timeout=None,
+                 binary=False):
+        self.__binary = False
+        self.__recv_buffer = b""
+        self.__request_ids = False
+        self.__next_id = 0
+        # requests sent and not yet replied to, in order
+        self.__pending = deque()
+        # replies received before they were waited for
+        self.__replies = dict()
+        # requests whose futures were garbage-collected before the reply
+        # was received, which is discarded when it arrives
+        self.__discarded = set()
+        # (request id, encoded request) waiting for the end of a batch
+        self.__batch = None
+        self.__batch_futures = None
         self.__socket = socket.create_connection((host, port), timeout)
 
         try:
@@ -102,6 +199,10 @@ class Client:
             server_identification = self.__recv()
             self.__target_names = server_identification["targets"]
             self.__description = server_identification["description"]
+            self.__use_binary = (binary and
+                                 server_identification.get("binary", False))
+            self.__request_ids = server_identification.get("request_ids",
+                                                           False)
             self.__selected_target = None
             if target_name is not None:
                 self.select_rpc_target(target_name)
@@ -115,6 +216,9 @@ class Client:
         target_name = _validate_target_name(target_name, self.__target_names)
         self.__socket.sendall((target_name + "\n").encode())
         self.__selected_target = target_name
+        if self.__use_binary:
+            self.__socket.sendall(_binary_string)
+            self.__binary = True
 
     def get_selected_target(self):
         """Returns the selected target, or ``None`` if no target has been
@@ -130,6 +234,28 @@ class Client:
         """Returns the address of the local end of the connection."""
         return self.__socket.getsockname()[0]
 
+    def get_rpc_transport(self):
+        """Returns the transport in use, ``"binary"`` or ``"text"``."""
+        return "binary" if self.__binary else "text"
+
+    def check_rpc_connection(self):
+        """Returns whether the connection can still be used for RPCs, i.e.
+        the server has not closed it and no unexpected data (e.g. the reply
+        to an interrupted RPC) is pending. Does not block."""
+        if self.__pending or self.__recv_buffer:
+            return False
+        timeout = self.__socket.gettimeout()
+        self.__socket.setblocking(False)
+        try:
+            self.__socket.recv(1, socket.MSG_PEEK)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        finally:
+            self.__socket.settimeout(timeout)
+        return False
+
     def close_rpc(self):
         """Closes the connection to the RPC server.
 
@@ -138,40 +264,144 @@ class Client:
         self.__socket.close()
 
     def __send(self, obj):
-        line = pyon.encode(obj) + "\n"
-        self.__socket.sendall(line.encode())
+        if self.__binary:
+            _send_frame(self.__socket, obj)
+            return
+        self.__socket.sendall(pyon.encode_to_bytes(obj, end=b"\n"))
 
     def __recv(self):
-        buf = self.__socket.recv(4096).decode()
-        while "\n" not in buf:
+        if self.__binary:
+            return _recv_frame(self.__socket)
+        buf = self.__recv_buffer
+        while b"\n" not in buf:
             more = self.__socket.recv(4096)
             if not more:
                 break
-            buf += more.decode()
-        return pyon.decode(buf)
-
-    def __do_action(self, action):
-        self.__send(action)
+            buf += more
+        line, _, self.__recv_buffer = buf.partition(b"\n")
+        return pyon.decode(line.decode())
 
-        obj = self.__recv()
-        if obj["status"] == "ok":
-            return obj["ret"]
-        elif obj["status"] == "failed":
-            raise_packed_exc(obj["exception"])
+    def __submit(self, obj):
+        request_id = self.__next_id
+        self.__next_id += 1
+        if self.__request_ids:
+            obj["id"] = request_id
+        self.__pending.append(request_id)
+        if self.__batch is not None:
+            if self.__binary:
+                data = b"".join(framing.encode_frame(obj))
+            else:
+                data = pyon.encode_to_bytes(obj, end=b"\n")
+            self.__batch.append((request_id, data))
         else:
-            raise ValueError
+            self.__send(obj)
+        return request_id
+
+    def __wait(self, request_id):
+        if request_id not in self.__pending and \
+                request_id not in self.__replies:
+            raise ValueError("The call was not sent, as its batch was "
+                             "interrupted by an exception")
+        if self.__batch and request_id in self.__pending:
+            # waiting inside a batch for one of its calls
+            self.__flush_batch()
+        while request_id not in self.__replies:
+            obj = self.__recv()
+            if "id" in obj:
+                reply_id = obj.pop("id")
+                self.__pending.remove(reply_id)
+            else:
+                # the server replies in order
+                reply_id = self.__pending.popleft()
+            if reply_id in self.__discarded:
+                self.__discarded.remove(reply_id)
+            else:
+                self.__replies[reply_id] = obj
+        return self.__replies.pop(request_id)
+
+    def __discard(self, request_id):
+        # called when the future of the request is garbage-collected
+        if self.__replies.pop(request_id, None) is None and \
+                request_id in self.__pending:
+            self.__discarded.add(request_id)
+
+    def __flush_batch(self):
+        batch, self.__batch = self.__batch, []
+        self.__socket.sendall(b"".join(data for _, data in batch))
+
+    def __do_action(self, action):
+        return _reply_result(self.__wait(self.__submit(action)))
 
     def __do_rpc(self, name, args, kwargs):
         obj = {"action": "call", "name": name, "args": args, "kwargs": kwargs}
         return self.__do_action(obj)
 
+    def submit_rpc(self, name, *args, **kwargs):
+        """Sends a call to the RPC method *name* without waiting for the
+        reply, and returns a ``RPCFuture`` for its result.
+
+        Calls are executed by the server in the order they are submitted.
+        Replies that arrive while waiting for another one are kept until
+        their future is waited for."""
+        obj = {"action": "call", "name": name, "args": args, "kwargs": kwargs}
+        request_id = self.__submit(obj)
+        future = RPCFuture(lambda: self.__wait(request_id))
+        # do not keep the reply if nobody can wait for it anymore
+        weakref.finalize(future, self.__discard, request_id)
+        if self.__batch_futures is not None:
+            self.__batch_futures.append(future)
+        return future
+
+    @contextmanager
+    def batch(self):
+        """Context manager that groups calls. Inside the ``with`` block, RPC
+        method calls return a ``RPCFuture`` instead of the result, and are
+        sent together in a single write when the block exits. The replies
+        to all the calls are then waited for, and the exception raised by
+        the first failed call, if any, is raised.
+
+        If the block raises an exception, the calls that have not been sent
+        yet (i.e. all of them, unless the result of one of them was waited
+        for inside the block) are dropped, and the replies to the others are
+        not waited for.
+
+        For example: ::
+
+            with c.batch():
+                c.set_frequency(0, 10*MHz)
+                c.set_phase(0, 0.5)
+        """
+        if self.__batch is not None:
+            # nested batch, part of the outer one
+            yield
+            return
+        self.__batch = []
+        self.__batch_futures = futures = []
+        try:
+            yield
+        except:
+            for request_id, _ in self.__batch:
+                self.__pending.remove(request_id)
+            raise
+        else:
+            if self.__batch:
+                self.__flush_batch()
+        finally:
+            self.__batch = self.__batch_futures = None
+        for future in futures:
+            future.result()
+
     def get_rpc_method_list(self):
         obj = {"action": "get_rpc_method_list"}
         return self.__do_action(obj)
 
     def __getattr__(self, name):
-        def proxy(*args, **kwargs):
-            return self.__do_rpc(name, args, kwargs)
+        if self.__batch is not None:
+            def proxy(*args, **kwargs):
+                return self.submit_rpc(name, *args, **kwargs)
+        else:
+            def proxy(*args, **kwargs):
+                return self.__do_rpc(name, args, kwargs)
         return proxy
 
 
@@ -190,8 +420,9 @@ class AsyncioClient:
         self.__writer = None
         self.__target_names = None
         self.__description = None
+        self.__binary = False
 
-    async def connect_rpc(self, host, port, target_name):
+    async def connect_rpc(self, host, port, target_name, binary=False):
         """Connects to the server. This cannot be done in __init__ because
         this method is a coroutine. See ``Client`` for a description of the
         parameters."""
@@ -202,6 +433,8 @@ class AsyncioClient:
             server_identification = await self.__recv()
             self.__target_names = server_identification["targets"]
             self.__description = server_identification["description"]
+            self.__use_binary = (binary and
+                                 server_identification.get("binary", False))
             self.__selected_target = None
             if target_name is not None:
                 self.select_rpc_target(target_name)
@@ -216,6 +449,9 @@ class AsyncioClient:
         target_name = _validate_target_name(target_name, self.__target_names)
         self.__writer.write((target_name + "\n").encode())
         self.__selected_target = target_name
+        if self.__use_binary:
+            self.__writer.write(_binary_string)
+            self.__binary = True
 
     def get_selected_target(self):
         """Returns the selected target, or ``None`` if no target has been
@@ -226,6 +462,10 @@ class AsyncioClient:
         """Returns the address of the local end of the connection."""
         return self.__writer.get_extra_info("socket").getsockname()[0]
 
+    def get_rpc_transport(self):
+        """Returns the transport in use, ``"binary"`` or ``"text"``."""
+        return "binary" if self.__binary else "text"
+
     def get_rpc_id(self):
         """Returns a tuple (target_names, description) containing the
         identification information of the server."""
@@ -241,12 +481,17 @@ class AsyncioClient:
         self.__writer = None
         self.__target_names = None
         self.__description = None
+        self.__binary = False
 
     def __send(self, obj):
-        line = pyon.encode(obj) + "\n"
-        self.__writer.write(line.encode())
+        if self.__binary:
+            framing.write_frame(self.__writer, obj)
+            return
+        self.__writer.write(pyon.encode_to_bytes(obj, end=b"\n"))
 
     async def __recv(self):
+        if self.__binary:
+            return await framing.read_frame(self.__reader, _max_frame_size)
         line = await self.__reader.readline()
         return pyon.decode(line.decode())
 
@@ -358,8 +603,7 @@ class BestEffortClient:
             self.__conretry_terminate = True
 
     def __send(self, obj):
-        line = pyon.encode(obj) + "\n"
-        self.__socket.sendall(line.encode())
+        self.__socket.sendall(pyon.encode_to_bytes(obj, end=b"\n"))
 
     def __recv(self):
         buf = self.__socket.recv(4096).decode()
@@ -458,12 +702,24 @@ class Server(_AsyncioServer):
         requests from clients.
     :param allow_parallel: Allow concurrent asyncio calls to the target's
         methods.
+    :param max_in_flight: Maximum number of requests with an identifier
+        that are processed at the same time for one connection. The server
+        stops reading from a connection that reaches this limit.
+
+    The server supports both the text and the binary transports; each client
+    selects one of them when it connects.
+
+    Requests that carry an identifier are processed in separate tasks, so
+    that the client can pipeline them. They are started in the order they
+    are received; with ``allow_parallel``, the calls to coroutine methods
+    can complete, and be replied to, out of order.
     """
     def __init__(self, targets, description=None, builtin_terminate=False,
-                 allow_parallel=False):
+                 allow_parallel=False, max_in_flight=64):
         _AsyncioServer.__init__(self)
         self.targets = targets
         self.description = description
+        self.max_in_flight = max_in_flight
         self.builtin_terminate = builtin_terminate
         if builtin_terminate:
             self._terminate_request = asyncio.Event()
@@ -535,10 +791,11 @@ class Server(_AsyncioServer):
 
             obj = {
                 "targets": sorted(self.targets.keys()),
-                "description": self.description
+                "description": self.description,
+                "binary": True,
+                "request_ids": True
             }
-            line = pyon.encode(obj) + "\n"
-            writer.write(line.encode())
+            writer.write(pyon.encode_to_bytes(obj, end=b"\n"))
             line = await reader.readline()
             if not line:
                 return
@@ -551,18 +808,68 @@ class Server(_AsyncioServer):
             if callable(target):
                 target = target()
 
-            while True:
-                line = await reader.readline()
-                if not line:
-                    break
-                reply = await self._process_action(target, pyon.decode(line.decode()))
-                writer.write((pyon.encode(reply) + "\n").encode())
+            binary = False
+            pending = set()
+            in_flight = asyncio.Semaphore(self.max_in_flight)
+            # concurrent drain() calls are not supported by older Pythons
+            drain_lock = asyncio.Lock()
+            try:
+                while True:
+                    if binary:
+                        try:
+                            obj = await framing.read_frame(
+                                reader, _max_frame_size)
+                        except asyncio.IncompleteReadError:
+                            break
+                        except ValueError:
+                            logger.warning("closing connection after "
+                                           "invalid frame", exc_info=True)
+                            break
+                    else:
+                        line = await reader.readline()
+                        if not line:
+                            break
+                        if line == _binary_string:
+                            binary = True
+                            continue
+                        obj = pyon.decode(line.decode())
+                    if "id" in obj:
+                        await in_flight.acquire()
+                        task = asyncio.ensure_future(self._process_and_reply(
+                            target, obj, writer, binary, drain_lock))
+                        pending.add(task)
+                        task.add_done_callback(pending.discard)
+                        task.add_done_callback(lambda task: in_flight.release())
+                    else:
+                        reply = await self._process_action(target, obj)
+                        _write_reply(writer, binary, reply)
+                        async with drain_lock:
+                            await writer.drain()
+                # the client may close the connection right after sending
+                # its last requests
+                if pending:
+                    await asyncio.wait(pending)
+            finally:
+                for task in pending:
+                    task.cancel()
         except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
             # May happens on Windows when client disconnects
             pass
         finally:
             writer.close()
 
+    async def _process_and_reply(self, target, obj, writer, binary,
+                                 drain_lock):
+        reply = await self._process_action(target, obj)
+        reply["id"] = obj["id"]
+        _write_reply(writer, binary, reply)
+        try:
+            async with drain_lock:
+                await writer.drain()
+        except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
+            # the connection handler notices it when reading
+            pass
+
     async def wait_terminate(self):
         await self._terminate_request.wait()
 
@@ -1,12 +1,64 @@
+"""Communication between a parent process and a child process it starts,
+through pipes.
+
+Besides raw bytes and lines, the pipes can carry PYON-serializable objects
+as binary frames (``write_frame`` and ``read_frame``), which use the same
+format as the binary transport of ``pc_rpc`` (see ``framing``): the contents
+of Numpy arrays are transferred as raw buffers.
+"""
+
 import os
 import asyncio
 from asyncio.streams import FlowControlMixin
 
+from artiq.protocols import framing
+
 
 __all__ = ["AsyncioParentComm", "AsyncioChildComm", "ChildComm"]
 
 
-class _BaseIO:
+# Larger than the pc_rpc limit, as datasets exchanged with workers can be
+# large, but still guards against allocating memory for a corrupt header.
+_max_frame_size = 2*1024*1024*1024
+
+
+def encode_frame(obj):
+    """Encodes *obj* into a frame that can be written later with
+    ``write``. Unlike ``write_frame``, this copies the contents of Numpy
+    arrays, so the frame is not affected by later changes to *obj*."""
+    return b"".join(framing.encode_frame(obj))
+
+
+class _FrameIO:
+    # For classes implementing write() and an asynchronous readexactly().
+    def write_frame(self, obj):
+        framing.write_frame(self, obj)
+
+    async def read_frame(self):
+        return await framing.read_frame(self, _max_frame_size)
+
+
+class _BlockingFrameIO:
+    # For classes implementing write() and readinto().
+    def _readexactly(self, n):
+        buf = bytearray(n)
+        view = memoryview(buf)
+        while view:
+            k = self.readinto(view)
+            if not k:
+                raise EOFError("Pipe closed in the middle of a frame")
+            view = view[k:]
+        return buf
+
+    def write_frame(self, obj):
+        framing.write_frame(self, obj)
+
+    def read_frame(self):
+        return framing.read_frame_blocking(self._readexactly,
+                                           _max_frame_size)
+
+
+class _BaseIO(_FrameIO):
     def write(self, data):
         self.writer.write(data)
 
@@ -19,6 +71,9 @@ class _BaseIO:
     async def read(self, n):
         return await self.reader.read(n)
 
+    async def readexactly(self, n):
+        return await self.reader.readexactly(n)
+
 
 if os.name != "nt":
     async def _fds_to_asyncio(rfd, wfd, loop):
@@ -74,7 +129,7 @@ if os.name != "nt":
             self.writer.close()
 
 
-    class ChildComm:
+    class ChildComm(_BlockingFrameIO):
         def __init__(self, address):
             rfd, wfd = address.split(",", maxsplit=1)
             self.rf = open(int(rfd), "rb", 0)
@@ -83,11 +138,16 @@ if os.name != "nt":
         def read(self, n):
             return self.rf.read(n)
 
+        def readinto(self, b):
+            return self.rf.readinto(b)
+
         def readline(self):
             return self.rf.readline()
 
         def write(self, data):
-            return self.wf.write(data)
+            view = memoryview(data)
+            while view:
+                view = view[self.wf.write(view):]
 
         def close(self):
             self.rf.close()
@@ -101,7 +161,7 @@ else:  # windows
     _pipe_count = itertools.count()
 
 
-    class AsyncioParentComm:
+    class AsyncioParentComm(_FrameIO):
         """Requires ProactorEventLoop"""
         def __init__(self):
             # We cannot use anonymous pipes on Windows, because we do not know
@@ -181,6 +241,10 @@ else:  # windows
             await self.ready.wait()
             return await self.reader.read(n)
 
+        async def readexactly(self, n):
+            await self.ready.wait()
+            return await self.reader.readexactly(n)
+
 
     class AsyncioChildComm(_BaseIO):
         """Requires ProactorEventLoop"""
@@ -201,18 +265,23 @@ else:  # windows
             self.writer.close()
 
 
-    class ChildComm:
+    class ChildComm(_BlockingFrameIO):
         def __init__(self, address):
             self.f = open(address, "a+b", 0)
 
         def read(self, n):
             return self.f.read(n)
 
+        def readinto(self, b):
+            return self.f.readinto(b)
+
         def readline(self):
             return self.f.readline()
 
         def write(self, data):
-            return self.f.write(data)
+            view = memoryview(data)
+            while view:
+                view = view[self.f.write(view):]
 
         def close(self):
             self.f.close()
@@ -8,7 +8,7 @@ objects. Its main features are:
   floats, complex numbers, strings, tuples, lists, dictionaries.
 * Those data types are accurately reconstructed (unlike JSON where e.g. tuples
   become lists, and dictionary keys are turned into strings).
-* Supports Numpy arrays.
+* Supports Numpy arrays and slices (used as keys of vectorized mods).
 
 The main rationale for this new custom serializer (instead of using JSON) is
 that JSON does not support Numpy and more generally cannot be extended with
@@ -18,6 +18,10 @@ function call syntax to express special data types.
 
 
 import base64
+import binascii
+import re
+import ast
+from json.decoder import scanstring as _json_scanstring
 from fractions import Fraction
 from collections import OrderedDict
 import os
@@ -43,7 +47,9 @@ _encode_map = {
     wrapping_int: "number",
     Fraction: "fraction",
     OrderedDict: "ordereddict",
-    numpy.ndarray: "nparray"
+    slice: "slice",
+    numpy.ndarray: "nparray",
+    numpy.memmap: "nparray"
 }
 
 _numpy_scalar = {
@@ -66,108 +72,244 @@ _str_translation = {
 }
 
 
+_str_escape = re.compile(r"[\"\\\n\r]")
+
+
 class _Encoder:
+    # The encode_* methods append the serialized object to self.out.
+    # Large base64 payloads are kept in self.segments as bytes, so that
+    # encode_to_bytes does not need to copy them.
+
     def __init__(self, pretty):
         self.pretty = pretty
         self.indent_level = 0
+        self.out = []
+        self.segments = []
 
     def indent(self):
         return "    "*self.indent_level
 
     def encode_none(self, x):
-        return "null"
+        self.out.append("null")
 
     def encode_bool(self, x):
         if x:
-            return "true"
+            self.out.append("true")
         else:
-            return "false"
+            self.out.append("false")
 
     def encode_number(self, x):
-        return repr(x)
+        self.out.append(repr(x))
 
     def encode_str(self, x):
         # Do not use repr() for JSON compatibility.
-        return "\"" + x.translate(_str_translation) + "\""
+        if _str_escape.search(x) is not None:
+            x = x.translate(_str_translation)
+        self.out.append("\"" + x + "\"")
 
     def encode_bytes(self, x):
-        return repr(x)
+        self.out.append(repr(x))
+
+    def encode_payload(self, x):
+        # base64-encoded, hence ASCII without quotes or escapes
+        self.out.append("b'")
+        self.segments.append("".join(self.out))
+        self.segments.append(x)
+        self.out.clear()
+        self.out.append("'")
+
+    def encode_items(self, x):
+        encode = self.encode
+        append = self.out.append
+        first = True
+        for item in x:
+            if not first:
+                append(", ")
+            first = False
+            encode(item)
 
     def encode_tuple(self, x):
         if len(x) == 1:
-            return "(" + self.encode(x[0]) + ", )"
+            self.out.append("(")
+            self.encode(x[0])
+            self.out.append(", )")
         else:
-            r = "("
-            r += ", ".join([self.encode(item) for item in x])
-            r += ")"
-            return r
+            self.out.append("(")
+            self.encode_items(x)
+            self.out.append(")")
 
     def encode_list(self, x):
-        r = "["
-        r += ", ".join([self.encode(item) for item in x])
-        r += "]"
-        return r
+        if _numeric_types.issuperset(map(type, x)):
+            self.out.append("[" + ", ".join(map(repr, x)) + "]")
+        else:
+            self.out.append("[")
+            self.encode_items(x)
+            self.out.append("]")
 
     def encode_set(self, x):
-        r = "{"
-        r += ", ".join([self.encode(item) for item in x])
-        r += "}"
-        return r
+        self.out.append("{")
+        self.encode_items(x)
+        self.out.append("}")
 
     def encode_dict(self, x):
-        r = "{"
+        encode = self.encode
+        append = self.out.append
+        append("{")
         if not self.pretty or len(x) < 2:
-            r += ", ".join([self.encode(k) + ": " + self.encode(v)
-                           for k, v in x.items()])
+            first = True
+            for k, v in x.items():
+                if not first:
+                    append(", ")
+                first = False
+                encode(k)
+                append(": ")
+                encode(v)
         else:
             self.indent_level += 1
-            r += "\n"
+            append("\n")
             first = True
             for k, v in x.items():
                 if not first:
-                    r += ",\n"
+                    append(",\n")
                 first = False
-                r += self.indent() + self.encode(k) + ": " + self.encode(v)
-            r += "\n"  # no ','
+                append(self.indent())
+                encode(k)
+                append(": ")
+                encode(v)
+            append("\n")  # no ','
             self.indent_level -= 1
-            r += self.indent()
-        r += "}"
-        return r
+            append(self.indent())
+        append("}")
 
     def encode_fraction(self, x):
-        return "Fraction({}, {})".format(self.encode(x.numerator),
-                                         self.encode(x.denominator))
+        self.out.append("Fraction(")
+        self.encode(x.numerator)
+        self.out.append(", ")
+        self.encode(x.denominator)
+        self.out.append(")")
 
     def encode_ordereddict(self, x):
-        return "OrderedDict(" + self.encode(list(x.items())) + ")"
+        self.out.append("OrderedDict(")
+        self.encode(list(x.items()))
+        self.out.append(")")
+
+    def encode_slice(self, x):
+        self.out.append("slice(")
+        self.encode(x.start)
+        self.out.append(", ")
+        self.encode(x.stop)
+        self.out.append(", ")
+        self.encode(x.step)
+        self.out.append(")")
 
     def encode_nparray(self, x):
-        r = "nparray("
-        r += self.encode(x.shape) + ", "
-        r += self.encode(x.dtype.str) + ", "
-        r += self.encode(base64.b64encode(x.data))
-        r += ")"
-        return r
+        if not x.flags.c_contiguous:
+            x = x.copy(order="C")
+        self.out.append("nparray(")
+        self.encode(x.shape)
+        self.out.append(", ")
+        self.encode(x.dtype.str)
+        self.out.append(", ")
+        self.encode_payload(base64.b64encode(x.data))
+        self.out.append(")")
 
     def encode_npscalar(self, x):
-        r = "npscalar("
-        r += self.encode(x.dtype.str) + ", "
-        r += self.encode(base64.b64encode(x.data))
-        r += ")"
-        return r
+        self.out.append("npscalar(")
+        self.encode(x.dtype.str)
+        self.out.append(", ")
+        self.encode_payload(base64.b64encode(x.data))
+        self.out.append(")")
 
     def encode(self, x):
-        ty = _encode_map.get(type(x), None)
-        if ty is None:
+        try:
+            encoder = self._dispatch[type(x)]
+        except KeyError:
             raise TypeError("`{!r}` ({}) is not PYON serializable"
-                            .format(x, type(x)))
-        return getattr(self, "encode_" + ty)(x)
+                            .format(x, type(x))) from None
+        encoder(self, x)
+
+    def getvalue(self):
+        if not self.segments:
+            return "".join(self.out)
+        return "".join([segment if isinstance(segment, str)
+                        else segment.decode("ascii")
+                        for segment in self.segments]) + "".join(self.out)
+
+    def getvalue_bytes(self, end):
+        if not self.segments:
+            return ("".join(self.out)).encode() + end
+        return b"".join([segment.encode() if isinstance(segment, str)
+                         else segment
+                         for segment in self.segments] +
+                        [("".join(self.out)).encode(), end])
+
+
+_numeric_types = {int, float}
+
+
+def _make_dispatch(encoder_class):
+    # Bound once per class, instead of looking up the method by name for
+    # every object.
+    encoder_class._dispatch = {
+        ty: getattr(encoder_class, "encode_" + name)
+        for ty, name in _encode_map.items()
+    }
+
+
+_make_dispatch(_Encoder)
 
 
 def encode(x, pretty=False):
     """Serializes a Python object and returns the corresponding string in
     Python syntax."""
-    return _Encoder(pretty).encode(x)
+    encoder = _Encoder(pretty)
+    encoder.encode(x)
+    return encoder.getvalue()
+
+
+def encode_to_bytes(x, pretty=False, end=b""):
+    """Serializes a Python object like :func:`encode`, and returns the
+    UTF-8 encoded result followed by ``end`` (e.g. ``b"\\n"`` to make
+    a line).
+
+    This avoids encoding an intermediate string, which matters for large
+    Numpy arrays."""
+    encoder = _Encoder(pretty)
+    encoder.encode(x)
+    return encoder.getvalue_bytes(end)
+
+
+class _BufferEncoder(_Encoder):
+    def __init__(self):
+        _Encoder.__init__(self, False)
+        self.buffers = []
+
+    def encode_nparray(self, x):
+        self.out.append("npbuffer(")
+        self.encode(len(self.buffers))
+        self.out.append(", ")
+        self.encode(x.shape)
+        self.out.append(", ")
+        self.encode(x.dtype.str)
+        self.out.append(")")
+        self.buffers.append(
+            memoryview(numpy.ascontiguousarray(x).reshape(-1).view(numpy.uint8)))
+
+
+_make_dispatch(_BufferEncoder)
+
+
+def encode_with_buffers(x):
+    """Serializes a Python object like :func:`encode`, but leaves the
+    contents of Numpy arrays out of the string.
+
+    Returns a tuple ``(s, buffers)`` where ``buffers`` is a list of
+    bytes-like objects holding the contents of the arrays, without copying
+    them if they are contiguous. Use :func:`decode_with_buffers` to
+    reconstruct the object."""
+    encoder = _BufferEncoder()
+    encoder.encode(x)
+    return encoder.getvalue(), encoder.buffers
 
 
 def _nparray(shape, dtype, data):
@@ -180,25 +322,334 @@ def _npscalar(ty, data):
     return numpy.frombuffer(base64.b64decode(data), dtype=ty)[0]
 
 
-_eval_dict = {
-    "__builtins__": {},
-
-    "null": None,
-    "false": False,
-    "true": True,
-
+_decode_functions = {
     "int": wrapping_int,
     "Fraction": Fraction,
     "OrderedDict": OrderedDict,
+    "slice": slice,
     "nparray": _nparray,
     "npscalar": _npscalar
 }
 
 
+class _DecodeError(ValueError):
+    pass
+
+
+_constants = {
+    "null": None,
+    "false": False,
+    "true": True,
+    "None": None,
+    "False": False,
+    "True": True
+}
+
+_whitespace = re.compile(r"(?:[ \t\n\r]|#[^\n]*)*")
+_prefixed_int = re.compile(r"[+-]?0(?:[xX][0-9a-fA-F_]+|[oO][0-7_]+|[bB][01_]+)")
+_number = re.compile(r"[+-]?(?:(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?[jJ]?"
+                     r"|(?:inf|nan)(?!\w))")
+_name = re.compile(r"[A-Za-z_]\w*")
+_keyword_argument = re.compile(r"([A-Za-z_]\w*)(?:[ \t\n\r])*=(?!=)")
+_python_string = re.compile(r"""b?(?:"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')""",
+                            re.DOTALL)
+# Homogeneous lists of numbers are matched as a whole and converted with
+# map(), which is much faster than scanning their elements one by one.
+_int_list = re.compile(r"\[(?:[ \t\n\r]*[+-]?\d+[ \t\n\r]*,)*"
+                       r"(?:[ \t\n\r]*[+-]?\d+)?[ \t\n\r]*\]")
+_float_list = re.compile(r"\[(?:[ \t\n\r]*(?:[+-]?(?:\d+\.\d*(?:[eE][+-]?\d+)?|\d+[eE][+-]?\d+"
+                         r"|inf|nan))[ \t\n\r]*,)*"
+                         r"(?:[ \t\n\r]*(?:[+-]?(?:\d+\.\d*(?:[eE][+-]?\d+)?|\d+[eE][+-]?\d+"
+                         r"|inf|nan)))?[ \t\n\r]*\]")
+_npscalar_call = re.compile(
+    r"""\([ \t\n\r]*"([^"\\]*)"[ \t\n\r]*,[ \t\n\r]*b(["'])([A-Za-z0-9+/=]*)\2[ \t\n\r]*\)""")
+_nparray_call = re.compile(
+    r"""\([ \t\n\r]*\(([\d, ]*)\)[ \t\n\r]*,[ \t\n\r]*"([^"\\]*)"[ \t\n\r]*,"""
+    r"""[ \t\n\r]*b(["'])([A-Za-z0-9+/=]*)\3[ \t\n\r]*\)""")
+
+# Multiple of 4, so that chunks of base64 decode independently.
+_base64_chunk = 1024*1024
+
+
+def _decode_nparray(shape, dtype, s, start, end):
+    try:
+        dtype = numpy.dtype(dtype)
+    except TypeError:
+        raise _DecodeError
+    if dtype.hasobject:
+        raise _DecodeError("object arrays are not supported")
+    # Check the payload size before allocating, so that a short string
+    # cannot request a huge array.
+    nbytes = dtype.itemsize
+    for n in shape:
+        nbytes *= n
+    if nbytes > (end - start)*3//4:
+        raise _DecodeError
+    a = numpy.empty(shape, dtype)
+    view = a.reshape(-1).view(numpy.uint8)
+    position = 0
+    for chunk_start in range(start, end, _base64_chunk):
+        data = binascii.a2b_base64(s[chunk_start:min(chunk_start + _base64_chunk, end)])
+        view[position:position + len(data)] = numpy.frombuffer(data, numpy.uint8)
+        position += len(data)
+    if position != len(view):
+        raise _DecodeError
+    return a
+
+
+def _make_scanner(functions):
+    match_whitespace = _whitespace.match
+    match_prefixed_int = _prefixed_int.match
+    match_number = _number.match
+    match_name = _name.match
+    match_keyword_argument = _keyword_argument.match
+    match_python_string = _python_string.match
+    match_int_list = _int_list.match
+    match_float_list = _float_list.match
+    match_npscalar_call = _npscalar_call.match
+    match_nparray_call = _nparray_call.match
+
+    def scan_number_list(s, pos):
+        m = match_float_list(s, pos)
+        if m is not None:
+            convert = float
+        else:
+            m = match_int_list(s, pos)
+            if m is None:
+                return None
+            convert = int
+        items = s[pos+1:m.end()-1].split(",")
+        if not items[-1].strip():
+            # trailing comma or empty list
+            del items[-1]
+        return list(map(convert, items)), m.end()
+
+    def scan_python_string(s, pos):
+        m = match_python_string(s, pos)
+        if m is None:
+            raise _DecodeError
+        token = m.group()
+        if "\\" not in token:
+            if token[0] == "b":
+                return token[2:-1].encode("ascii"), m.end()
+            return token[1:-1], m.end()
+        return ast.literal_eval(token), m.end()
+
+    def scan_sequence(s, pos, end_char):
+        # Returns the values, the position after end_char and whether
+        # the sequence had a trailing comma.
+        values = []
+        append = values.append
+        pos = match_whitespace(s, pos).end()
+        if s[pos:pos+1] == end_char:
+            return values, pos + 1, False
+        while True:
+            value, pos = scan(s, pos)
+            append(value)
+            pos = match_whitespace(s, pos).end()
+            c = s[pos:pos+1]
+            if c == ",":
+                pos = match_whitespace(s, pos + 1).end()
+                if s[pos:pos+1] == end_char:
+                    return values, pos + 1, True
+            elif c == end_char:
+                return values, pos + 1, False
+            else:
+                raise _DecodeError
+
+    def scan_braces(s, pos):
+        pos = match_whitespace(s, pos).end()
+        if s[pos:pos+1] == "}":
+            return {}, pos + 1
+        key, pos = scan(s, pos)
+        pos = match_whitespace(s, pos).end()
+        c = s[pos:pos+1]
+        if c == "}":
+            return {key}, pos + 1
+        elif c == ",":
+            values, pos, _ = scan_sequence(s, pos + 1, "}")
+            values.append(key)
+            return set(values), pos
+        elif c != ":":
+            raise _DecodeError
+        d = {}
+        while True:
+            value, pos = scan(s, pos + 1)
+            d[key] = value
+            pos = match_whitespace(s, pos).end()
+            c = s[pos:pos+1]
+            if c == ",":
+                pos = match_whitespace(s, pos + 1).end()
+                if s[pos:pos+1] == "}":
+                    return d, pos + 1
+            elif c == "}":
+                return d, pos + 1
+            else:
+                raise _DecodeError
+            key, pos = scan(s, pos)
+            pos = match_whitespace(s, pos).end()
+            if s[pos:pos+1] != ":":
+                raise _DecodeError
+
+    def scan_call(s, pos, name):
+        try:
+            function = functions[name]
+        except KeyError:
+            raise _DecodeError
+        if function is _npscalar:
+            m = match_npscalar_call(s, pos)
+            if m is not None:
+                return numpy.frombuffer(binascii.a2b_base64(m.group(3)),
+                                        dtype=m.group(1))[0], m.end()
+        elif function is _nparray:
+            m = match_nparray_call(s, pos)
+            if m is not None:
+                shape = tuple(int(n) for n in m.group(1).split(",") if n.strip())
+                return _decode_nparray(shape, m.group(2), s, m.start(4), m.end(4)), m.end()
+        args = []
+        kwargs = {}
+        pos = match_whitespace(s, pos + 1).end()
+        if s[pos:pos+1] != ")":
+            while True:
+                m = match_keyword_argument(s, pos)
+                if m is None:
+                    value, pos = scan(s, pos)
+                    args.append(value)
+                else:
+                    kwargs[m.group(1)], pos = scan(s, match_whitespace(s, m.end()).end())
+                pos = match_whitespace(s, pos).end()
+                c = s[pos:pos+1]
+                if c == ",":
+                    pos = match_whitespace(s, pos + 1).end()
+                    if s[pos:pos+1] == ")":
+                        break
+                elif c == ")":
+                    break
+                else:
+                    raise _DecodeError
+        return function(*args, **kwargs), pos + 1
+
+    def scan_number(s, pos):
+        m = match_prefixed_int(s, pos)
+        if m is not None:
+            return int(m.group(), 0), m.end()
+        m = match_number(s, pos)
+        if m is None:
+            raise _DecodeError
+        token = m.group()
+        if token[-1] in "jJ":
+            value = complex(token)
+        elif "." in token or "e" in token or "E" in token or "n" in token:
+            value = float(token)
+        else:
+            value = int(token)
+        # complex numbers are written as sums, e.g. (1+2j)
+        while True:
+            end = m.end()
+            pos = match_whitespace(s, end).end()
+            if s[pos:pos+1] not in ("+", "-"):
+                return value, end
+            m = match_number(s, match_whitespace(s, pos + 1).end())
+            if m is None:
+                raise _DecodeError
+            token = m.group()
+            if token[0] in "+-" or token[-1] not in "jJ":
+                # no other arithmetic
+                raise _DecodeError
+            operand = complex(token)
+            if s[pos] == "+":
+                value += operand
+            else:
+                value -= operand
+
+    def scan(s, pos):
+        pos = match_whitespace(s, pos).end()
+        c = s[pos:pos+1]
+        if c == "\"":
+            try:
+                return _json_scanstring(s, pos + 1, False)
+            except ValueError:
+                return scan_python_string(s, pos)
+        elif c == "[":
+            r = scan_number_list(s, pos)
+            if r is not None:
+                return r
+            values, pos, _ = scan_sequence(s, pos + 1, "]")
+            return values, pos
+        elif c == "{":
+            return scan_braces(s, pos + 1)
+        elif c == "(":
+            values, pos, trailing_comma = scan_sequence(s, pos + 1, ")")
+            if len(values) == 1 and not trailing_comma:
+                return values[0], pos
+            return tuple(values), pos
+        elif c == "'":
+            return scan_python_string(s, pos)
+        elif c in "0123456789+-.":
+            return scan_number(s, pos)
+        elif c == "b" and s[pos+1:pos+2] in ("\"", "'"):
+            return scan_python_string(s, pos)
+        else:
+            m = match_name(s, pos)
+            if m is None:
+                raise _DecodeError
+            name = m.group()
+            pos = m.end()
+            if name in _constants:
+                return _constants[name], pos
+            if name in ("inf", "nan"):
+                return float(name), pos
+            pos = match_whitespace(s, pos).end()
+            if s[pos:pos+1] != "(":
+                raise _DecodeError
+            return scan_call(s, pos, name)
+
+    def scan_document(s):
+        value, pos = scan(s, 0)
+        if match_whitespace(s, pos).end() != len(s):
+            raise _DecodeError
+        return value
+
+    return scan_document
+
+
+_scan_document = _make_scanner(_decode_functions)
+
+
+def _scan(scan_document, s):
+    try:
+        return scan_document(s)
+    except _DecodeError:
+        raise ValueError("Invalid PYON syntax") from None
+    except (SyntaxError, RecursionError) as e:
+        raise ValueError("Invalid PYON: {}".format(e)) from None
+
+
 def decode(s):
     """Parses a string in the Python syntax, reconstructs the corresponding
-    object, and returns it."""
-    return eval(s, _eval_dict, {})
+    object, and returns it.
+
+    Only the syntax produced by :func:`encode` (a subset of Python literals
+    and calls to the PYON constructors) is accepted, as well as JSON.
+    Anything else, e.g. arithmetic, raises ``ValueError``. The string is
+    never evaluated."""
+    return _scan(_scan_document, s)
+
+
+def decode_with_buffers(s, buffers):
+    """Reconstructs an object serialized with :func:`encode_with_buffers`.
+
+    Numpy arrays are created directly on top of ``buffers`` when those are
+    writable (e.g. ``bytearray``), and are copied otherwise."""
+    def npbuffer(index, shape, dtype):
+        a = numpy.frombuffer(buffers[index], dtype=dtype)
+        if not a.flags.writeable:
+            a = a.copy()
+        return a.reshape(shape)
+
+    functions = dict(_decode_functions)
+    functions["npbuffer"] = npbuffer
+    return _scan(_make_scanner(functions), s)
 
 
 def store_file(filename, x):
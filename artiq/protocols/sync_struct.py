@@ -8,11 +8,19 @@ describing each modification made to the structure (*mods*).
 
 Structures must be PYON serializable and contain only lists, dicts, and
 immutable types. Lists and dicts can be nested arbitrarily.
+
+Numpy arrays are supported as well. To avoid sending one mod per element,
+a range of elements can be modified with a single ``setitem`` mod whose key
+is a slice (or a tuple of slices), and elements can be appended to an array
+(or a list) with a single ``append_array`` mod.
 """
 
 import asyncio
 from operator import getitem
 from functools import partial
+from collections import OrderedDict
+
+import numpy
 
 from artiq.protocols import pyon
 from artiq.protocols.asyncio_server import AsyncioServer
@@ -21,8 +29,33 @@ from artiq.protocols.asyncio_server import AsyncioServer
 _init_string = b"ARTIQ sync_struct\n"
 
 
+def _append_array(struct, path, x):
+    """Appends the elements of *x* to the list or array found at *path*
+    in *struct*, and returns the (possibly new) structure.
+
+    Lists are extended in place. Numpy arrays cannot grow, so a new array
+    replaces the old one in its innermost mutable container, and the tuples
+    between that container and the array are rebuilt."""
+    if not path:
+        if isinstance(struct, list):
+            struct.extend(x)
+            return struct
+        return numpy.concatenate((struct, x))
+    key = path[0]
+    item = struct[key]
+    new_item = _append_array(item, path[1:], x)
+    if new_item is not item:
+        if isinstance(struct, tuple):
+            struct = list(struct)
+            struct[key] = new_item
+            return tuple(struct)
+        struct[key] = new_item
+    return struct
+
+
 def process_mod(target, mod):
     """Apply a *mod* to the target, mutating it."""
+    root = target
     for key in mod["path"]:
         target = getitem(target, key)
     action = mod["action"]
@@ -36,6 +69,22 @@ def process_mod(target, mod):
         target.__setitem__(mod["key"], mod["value"])
     elif action == "delitem":
         target.__delitem__(mod["key"])
+    elif action == "update":
+        if isinstance(target, (dict, Notifier)):
+            target.update(mod["items"])
+        else:
+            # e.g. models, which only support setting one item at a time
+            for key, value in mod["items"].items():
+                target[key] = value
+    elif action == "append_array":
+        if hasattr(target, "append_array"):
+            # e.g. Notifier, which must publish the mod
+            target.append_array(mod["x"])
+        elif _append_array(root, mod["path"], mod["x"]) is not root:
+            # the array, or a tuple containing it, is the root, which
+            # cannot be replaced here
+            raise TypeError("cannot append to an array that is not "
+                            "in a mutable container")
     else:
         raise ValueError
 
@@ -168,6 +217,32 @@ class Notifier:
                                "i": i})
         return r
 
+    def update(self, items):
+        """Update a dictionary with the contents of the dictionary *items*,
+        using a single mod."""
+        self._backing_struct.update(items)
+        if self.root.publish is not None:
+            self.root.publish({"action": "update",
+                               "path": self._path,
+                               "items": items})
+
+    def append_array(self, x):
+        """Append the elements of *x* to a one-dimensional Numpy array or
+        to a list, using a single mod.
+
+        Numpy arrays are reallocated, and the new array replaces the
+        old one in the structure (rebuilding any enclosing tuples)."""
+        backing_struct = _append_array(self.root._backing_struct,
+                                       self._path, x)
+        self.root.read = self.root._backing_struct = backing_struct
+        for key in self._path:
+            backing_struct = backing_struct[key]
+        self.read = self._backing_struct = backing_struct
+        if self.root.publish is not None:
+            self.root.publish({"action": "append_array",
+                               "path": self._path,
+                               "x": x})
+
     def __setitem__(self, key, value):
         self._backing_struct.__setitem__(key, value)
         if self.root.publish is not None:
@@ -188,17 +263,96 @@ class Notifier:
         return Notifier(item, self.root, self._path + [key])
 
 
+def _coalescing_location(mod):
+    # Location written by a setitem mod, or None if the mod cannot be
+    # coalesced with later mods.
+    if mod["action"] != "setitem":
+        return None
+    location = tuple(mod["path"]) + (mod["key"], )
+    try:
+        hash(location)
+    except TypeError:
+        # e.g. slices
+        return None
+    return location
+
+
+class _Recipient:
+    """Mods waiting to be sent to one subscriber.
+
+    A ``setitem`` mod replaces a pending ``setitem`` mod on the same
+    location, unless a mod on a location that contains it (e.g. a list
+    insertion) was published in between.
+
+    When more than ``max_queue`` mods are pending, they are dropped and the
+    subscriber is sent a fresh ``init`` snapshot instead.
+    """
+    def __init__(self, max_queue):
+        self.max_queue = max_queue
+        self.event = asyncio.Event()
+        self.reinit = False
+        self._clear()
+
+    def _clear(self):
+        # sequence number -> line, in publication order
+        self._lines = OrderedDict()
+        self._next = 0
+        # location -> sequence number of the pending setitem mod
+        self._setitems = dict()
+
+    def put(self, location, line):
+        if self.reinit:
+            # the snapshot will include this mod
+            return
+        if location is None:
+            self._setitems.clear()
+        else:
+            for i in range(1, len(location)):
+                self._setitems.pop(location[:i], None)
+            try:
+                del self._lines[self._setitems[location]]
+            except KeyError:
+                pass
+            self._setitems[location] = self._next
+        self._lines[self._next] = line
+        self._next += 1
+        if self.max_queue is not None and len(self._lines) > self.max_queue:
+            self._clear()
+            self.reinit = True
+        self.event.set()
+
+    def take(self):
+        """Returns the lines to send, and empties the queue."""
+        lines = list(self._lines.values())
+        self._clear()
+        self.event.clear()
+        return lines
+
+
 class Publisher(AsyncioServer):
     """A network server that publish changes to structures encapsulated in
     ``Notifiers``.
 
+    Mods are queued separately for each subscriber, and consecutive
+    ``setitem`` mods on the same location are merged while they wait in the
+    queue.
+
     :param notifiers: A dictionary containing the notifiers to associate with
         the ``Publisher``. The keys of the dictionary are the names of the
         notifiers to be used with ``Subscriber``.
+    :param max_rate: Maximum number of writes per second to each subscriber.
+        Mods published in between are sent together (and coalesced). ``None``
+        means no limit.
+    :param max_queue: Maximum number of mods waiting to be sent to a
+        subscriber. A subscriber that falls further behind is sent a new
+        ``init`` snapshot of the structure instead of the pending mods.
+        ``None`` means no limit.
     """
-    def __init__(self, notifiers):
+    def __init__(self, notifiers, max_rate=None, max_queue=None):
         AsyncioServer.__init__(self)
         self.notifiers = notifiers
+        self.max_rate = max_rate
+        self.max_queue = max_queue
         self._recipients = {k: set() for k in notifiers.keys()}
         self._notifier_names = {id(v): k for k, v in notifiers.items()}
 
@@ -222,19 +376,30 @@ class Publisher(AsyncioServer):
                 return
 
             obj = {"action": "init", "struct": notifier.read}
-            line = pyon.encode(obj) + "\n"
-            writer.write(line.encode())
+            writer.write(pyon.encode_to_bytes(obj, end=b"\n"))
 
-            queue = asyncio.Queue()
-            self._recipients[notifier_name].add(queue)
+            recipient = _Recipient(self.max_queue)
+            self._recipients[notifier_name].add(recipient)
             try:
+                loop = asyncio.get_event_loop()
                 while True:
-                    line = await queue.get()
-                    writer.write(line)
+                    await recipient.event.wait()
+                    write_time = loop.time()
+                    if recipient.reinit:
+                        recipient.reinit = False
+                        recipient.event.clear()
+                        obj = {"action": "init", "struct": notifier.read}
+                        writer.write(pyon.encode_to_bytes(obj, end=b"\n"))
+                    else:
+                        writer.writelines(recipient.take())
                     # raise exception on connection error
                     await writer.drain()
+                    if self.max_rate is not None:
+                        delay = write_time + 1/self.max_rate - loop.time()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
             finally:
-                self._recipients[notifier_name].remove(queue)
+                self._recipients[notifier_name].remove(recipient)
         except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
             # subscribers disconnecting are a normal occurence
             pass
@@ -242,8 +407,8 @@ class Publisher(AsyncioServer):
             writer.close()
 
     def publish(self, notifier, mod):
-        line = pyon.encode(mod) + "\n"
-        line = line.encode()
+        line = pyon.encode_to_bytes(mod, end=b"\n")
+        location = _coalescing_location(mod)
         notifier_name = self._notifier_names[id(notifier)]
         for recipient in self._recipients[notifier_name]:
-            recipient.put_nowait(line)
+            recipient.put(location, line)
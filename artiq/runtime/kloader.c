@@ -57,13 +57,26 @@ static int load_or_start_kernel(const void *library, int run_kernel)
     return 1;
 }
 
-int kloader_load_library(const void *library)
+// Pristine copy of the last loaded library. Running a kernel modifies
+// the data sections in place, so it must be relocated again from this copy
+// before the same library can be run another time without re-uploading it.
+static char library_copy[KLOADER_LIBRARY_COPY_SIZE] __attribute__((aligned(4)));
+static size_t library_copy_size;
+
+int kloader_load_library(const void *library, size_t size)
 {
     if(!kernel_cpu_reset_read()) {
         core_log("BUG: attempted to load kernel library while kernel CPU is running\n");
         return 0;
     }
 
+    if(size <= KLOADER_LIBRARY_COPY_SIZE) {
+        memcpy(library_copy, library, size);
+        library_copy_size = size;
+    } else {
+        library_copy_size = 0;
+    }
+
     return load_or_start_kernel(library, 0);
 }
 
@@ -88,6 +101,16 @@ void kloader_start_kernel()
     load_or_start_kernel(NULL, 1);
 }
 
+int kloader_restart_kernel()
+{
+    if(library_copy_size == 0) {
+        core_log("Kernel library was not retained and cannot be run again\n");
+        return 0;
+    }
+
+    return load_or_start_kernel(library_copy, 1);
+}
+
 static int kloader_start_flash_kernel(char *key)
 {
 #if (defined CSR_SPIFLASH_BASE && defined CONFIG_SPIFLASH_PAGE_SIZE)
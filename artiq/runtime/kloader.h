@@ -8,9 +8,13 @@
 #define KERNELCPU_LAST_ADDRESS    (0x4fffffff - 1024*1024)
 #define KSUPPORT_HEADER_SIZE      0x80
 
+// Largest kernel library retained by kloader_load_library
+// for kloader_restart_kernel.
+#define KLOADER_LIBRARY_COPY_SIZE (2560*1024)
+
 extern long long int now;
 
-int kloader_load_library(const void *code);
+int kloader_load_library(const void *code, size_t size);
 void kloader_filter_backtrace(struct artiq_backtrace_item *backtrace,
                               size_t *backtrace_size);
 
@@ -18,6 +22,7 @@ void kloader_start_bridge(void);
 int kloader_start_startup_kernel(void);
 int kloader_start_idle_kernel(void);
 void kloader_start_kernel(void);
+int kloader_restart_kernel(void);
 void kloader_stop(void);
 
 int kloader_validate_kpointer(void *p);
@@ -288,6 +288,8 @@ static int out_packet_string(const char *string)
 // =============================== API handling ===============================
 
 static int user_kernel_state;
+// Set once the loaded kernel has been started, and cleared by LOAD_LIBRARY.
+static int user_kernel_stale;
 
 enum {
     USER_KERNEL_NONE = 0,
@@ -343,6 +345,7 @@ void session_start(void)
     kloader_stop();
     now = -1;
     user_kernel_state = USER_KERNEL_NONE;
+    user_kernel_stale = 0;
 }
 
 void session_end(void)
@@ -492,6 +495,7 @@ static int process_input(void)
 
         case REMOTEMSG_TYPE_LOAD_LIBRARY: {
             const void *kernel = &buffer_in.data[buffer_in_read_cursor];
+            size_t kernel_size = buffer_in_write_cursor - buffer_in_read_cursor;
             buffer_in_read_cursor = buffer_in_write_cursor;
 
             if(user_kernel_state >= USER_KERNEL_RUNNING) {
@@ -500,9 +504,10 @@ static int process_input(void)
                 break;
             }
 
-            if(kloader_load_library(kernel)) {
+            if(kloader_load_library(kernel, kernel_size)) {
                 out_packet_empty(REMOTEMSG_TYPE_LOAD_COMPLETED);
                 user_kernel_state = USER_KERNEL_LOADED;
+                user_kernel_stale = 0;
             } else {
                 out_packet_empty(REMOTEMSG_TYPE_LOAD_FAILED);
             }
@@ -517,9 +522,19 @@ static int process_input(void)
             }
 
             watchdog_init();
-            kloader_start_kernel();
+            if(user_kernel_stale) {
+                // The host is running the same library again
+                // without uploading it.
+                if(!kloader_restart_kernel()) {
+                    out_packet_empty(REMOTEMSG_TYPE_KERNEL_STARTUP_FAILED);
+                    break;
+                }
+            } else {
+                kloader_start_kernel();
+            }
 
             user_kernel_state = USER_KERNEL_RUNNING;
+            user_kernel_stale = 1;
             break;
 
         case REMOTEMSG_TYPE_RPC_REPLY: {
@@ -0,0 +1,90 @@
+"""
+Compares the text and binary transports of ``artiq.protocols.pc_rpc``.
+
+Run with ``python -m artiq.test.benchmark_pc_rpc``. Prints the latency of
+small calls and the throughput of echoing large Numpy arrays for each
+transport.
+"""
+
+import asyncio
+import threading
+import time
+
+import numpy as np
+
+from artiq.protocols import pc_rpc
+
+
+class Echo:
+    def echo(self, x):
+        return x
+
+
+def run_server(started):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = pc_rpc.Server({"echo": Echo()}, builtin_terminate=True)
+    loop.run_until_complete(server.start("::1", 0))
+    started.put_nowait(server.server.sockets[0].getsockname()[1])
+    try:
+        loop.run_until_complete(server.wait_terminate())
+    finally:
+        loop.run_until_complete(server.stop())
+        loop.close()
+
+
+def small_calls(remote, n=5000):
+    start = time.perf_counter()
+    for i in range(n):
+        remote.echo(i)
+    return (time.perf_counter() - start)/n
+
+
+def large_calls(remote, size, n=3):
+    a = np.random.uniform(size=size//8)
+    start = time.perf_counter()
+    for i in range(n):
+        remote.echo(a)
+    return size*2*n/(time.perf_counter() - start)
+
+
+def main():
+    import queue
+    started = queue.Queue()
+    thread = threading.Thread(target=run_server, args=(started, ))
+    thread.start()
+    port = started.get()
+
+    try:
+        for transport in "text", "binary":
+            remote = pc_rpc.Client("::1", port, binary=transport == "binary")
+            try:
+                print("{}: {:.1f}us per small call".format(
+                    transport, small_calls(remote)*1e6))
+                for size in 1, 10, 100:
+                    try:
+                        throughput = large_calls(remote, size*1024*1024)
+                    except Exception as e:
+                        # the text transport cannot carry lines longer than
+                        # the StreamReader limit of the server
+                        print("{}: {} MB array: failed ({})".format(
+                            transport, size, type(e).__name__))
+                        remote.close_rpc()
+                        remote = pc_rpc.Client("::1", port,
+                                               binary=transport == "binary")
+                    else:
+                        print("{}: {} MB array: {:.1f} MB/s".format(
+                            transport, size, throughput/1024/1024))
+            finally:
+                remote.close_rpc()
+    finally:
+        remote = pc_rpc.Client("::1", port)
+        try:
+            remote.terminate()
+        finally:
+            remote.close_rpc()
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
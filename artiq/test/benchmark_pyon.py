@@ -0,0 +1,59 @@
+"""
+Compares the PYON decoder with the ``eval``-based implementation it replaces.
+
+Run with ``python -m artiq.test.benchmark_pyon [FILE ...]``, where the files
+are e.g. ``dataset_db.pyon`` files of a master. Without arguments, a
+synthetic dataset database is used.
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from artiq.protocols import pyon
+
+
+def synthetic_dataset_db():
+    datasets = {}
+    for i in range(2000):
+        datasets["scalar_{}".format(i)] = i*0.1
+        datasets["name_{}".format(i)] = "value {}".format(i)
+    for i in range(50):
+        datasets["list_{}".format(i)] = list(np.random.uniform(size=10000))
+        datasets["ints_{}".format(i)] = list(range(10000))
+    for i in range(10):
+        datasets["array_{}".format(i)] = np.random.uniform(size=(1000, 1000))
+    return pyon.encode(datasets, True)
+
+
+def benchmark(f, name, s):
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        f(s)
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed > 2 and runs >= 3:
+            break
+    print("{}: {:.1f}ms/run, {:.1f} MB/s".format(
+        name, elapsed/runs*1000, len(s)/(elapsed/runs)/1024/1024))
+
+
+def main():
+    if len(sys.argv) > 1:
+        documents = []
+        for filename in sys.argv[1:]:
+            with open(filename) as f:
+                documents.append((filename, f.read()))
+    else:
+        documents = [("synthetic dataset_db", synthetic_dataset_db())]
+
+    for name, s in documents:
+        print("{} ({:.1f} MB)".format(name, len(s)/1024/1024))
+        benchmark(lambda s: eval(s, pyon._eval_dict, {}), "  eval", s)
+        benchmark(pyon.decode, "  decode", s)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Measures the scheduler overhead with many queued runs.
+
+Run with ``python -m artiq.test.benchmark_scheduler [N]``. Submits N (by
+default 10000) runs with random priorities and due dates to one pipeline,
+then dispatches them through the prepare, run and analyze stages without
+executing any experiment, and prints the average submission and dispatch
+latencies.
+"""
+
+import sys
+import time
+import random
+import asyncio
+import logging
+
+from artiq.master.scheduler import Scheduler, RunStatus
+
+
+class _RIDCounter:
+    def __init__(self):
+        self._next_rid = 0
+
+    def get(self):
+        rid = self._next_rid
+        self._next_rid += 1
+        return rid
+
+
+def _expid():
+    return {
+        "log_level": logging.WARNING,
+        "file": "benchmark.py",
+        "class_name": "Benchmark",
+        "arguments": dict()
+    }
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    scheduler = Scheduler(_RIDCounter(), dict(), None)
+    scheduler.start()
+    try:
+        now = time.time()
+        start = time.perf_counter()
+        for i in range(n):
+            if random.random() < 0.1:
+                due_date = now + random.uniform(-10, 10)
+            else:
+                due_date = None
+            scheduler.submit("main", _expid(), random.randint(0, 10),
+                             due_date, False)
+        elapsed = time.perf_counter() - start
+        print("submission: {:.1f}us per run".format(elapsed/n*1e6))
+
+        # The stage tasks have not run yet: drive them by hand.
+        pipeline = scheduler._pipelines["main"]
+        stages = (pipeline._prepare, pipeline._run, pipeline._analyze)
+        dispatched = 0
+        start = time.perf_counter()
+        while True:
+            run = stages[2]._get_run()
+            if run is not None:
+                run.status = RunStatus.deleting
+            else:
+                run = stages[1]._get_run()
+                if run is not None:
+                    run.status = RunStatus.run_done
+                else:
+                    run = stages[0]._get_run()
+                    if run is None or isinstance(run, float):
+                        # only runs due in the future remain
+                        break
+                    run.status = RunStatus.prepare_done
+            dispatched += 1
+        elapsed = time.perf_counter() - start
+        print("dispatch: {:.1f}us per stage transition ({} transitions)"
+              .format(elapsed/dispatched*1e6, dispatched))
+    finally:
+        loop.run_until_complete(scheduler.stop())
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from artiq.compiler.symbolizer import Symbolizer, SymbolizerError
+
+
+source = """
+extern void ext(int);
+static inline int inner(int x) { ext(x); return x * 2; }
+static inline int middle(int x) { int y = inner(x + 1); ext(y); return y; }
+int outer(int x) { int a = middle(x); ext(a); return a + inner(a); }
+"""
+
+
+@unittest.skipUnless(shutil.which("cc") and shutil.which("addr2line")
+                     and shutil.which("objdump"),
+                     "no host toolchain")
+class SymbolizerCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        with open(os.path.join(self.tmpdir, "test.c"), "w") as f:
+            f.write(source)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def build(self, dwarf_version):
+        library = os.path.join(self.tmpdir, "test.so")
+        subprocess.check_call(["cc", "-O2", "-gdwarf-{}".format(dwarf_version),
+                               "-shared", "-fPIC", "-o", library, "test.c",
+                               "-Wl,--unresolved-symbols=ignore-all"],
+                              cwd=self.tmpdir)
+        return library
+
+    def return_addresses(self, library):
+        disassembly = subprocess.check_output(["objdump", "-d", library],
+                                              universal_newlines=True).split("\n")
+        return [int(disassembly[i + 1].split(":")[0], 16)
+                for i, line in enumerate(disassembly)
+                if "call" in line and "<ext" in line]
+
+    def addr2line(self, library, addresses):
+        output = subprocess.check_output(
+            ["addr2line", "--addresses", "--functions", "--inlines", "-e", library] +
+            [hex(address - 1) for address in addresses],
+            universal_newlines=True).rstrip().split("\n")
+        lines = iter(output)
+        backtrace = []
+        for address_or_function in lines:
+            if address_or_function[:2] == "0x":
+                address = int(address_or_function, 16) + 1
+                function = next(lines)
+            else:
+                function = address_or_function
+            filename, line = next(lines).rsplit(":", 1)
+            backtrace.append((filename, int(line.split()[0]), function, address))
+        return backtrace
+
+    def test_matches_addr2line(self):
+        for dwarf_version in 2, 3, 4:
+            library = self.build(dwarf_version)
+            addresses = self.return_addresses(library)
+            self.assertTrue(addresses)
+            with open(library, "rb") as f:
+                backtrace = Symbolizer(f.read()).symbolize(addresses)
+            self.assertEqual(
+                [(filename, line, function, address)
+                 for filename, line, column, function, address in backtrace],
+                self.addr2line(library, addresses))
+            self.assertIn("middle", [function for *_, function, _ in backtrace])
+
+    def test_not_elf(self):
+        symbolizer = Symbolizer(b"not an ELF file")
+        with self.assertRaises(SymbolizerError):
+            symbolizer.symbolize([0x1000])
+        self.assertIsNotNone(symbolizer.library)
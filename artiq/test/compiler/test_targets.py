@@ -0,0 +1,64 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from artiq.compiler.targets import RunTool, Target
+
+
+class _FakeTarget(Target):
+    # Stands in for the LLVM stages, so that the way compile_modules
+    # distributes them can be tested; must be picklable.
+    triple = "test"
+
+    def generate_llvm_ir(self, module):
+        with self._timed("LLVM IR generation"):
+            return module
+
+    def optimize_llvm_ir(self, llmod):
+        with self._timed("LLVM optimization"):
+            return llmod.upper()
+
+    def assemble(self, llmodule):
+        with self._timed("assembly"):
+            return llmodule.encode()
+
+
+class TargetCase(unittest.TestCase):
+    def test_run_tool_stdin(self):
+        with RunTool([sys.executable, "-c",
+                      "import sys; sys.stdout.write(sys.stdin.read()[::-1])"],
+                     stdin=b"abc") as results:
+            self.assertEqual(results["__stdout__"], "cba")
+
+    def test_compile_modules(self):
+        modules = ["a", "b", "c"]
+        target = _FakeTarget()
+        self.assertEqual(target.compile_modules(modules), [b"A", b"B", b"C"])
+        self.assertEqual(list(target.timings),
+                         ["LLVM IR generation", "LLVM optimization",
+                          "assembly"])
+
+    def test_compile_modules_parallel(self):
+        modules = ["a", "b", "c"]
+        target = _FakeTarget()
+        self.assertEqual(target.compile_modules(modules, jobs=2),
+                         [b"A", b"B", b"C"])
+        self.assertEqual(sorted(target.timings),
+                         ["LLVM IR generation",
+                          "LLVM optimization (in worker)",
+                          "assembly (in worker)",
+                          "parallel compilation"])
+
+    @unittest.skipUnless(shutil.which("c++filt"), "no c++filt")
+    def test_demangle(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.symlink(shutil.which("c++filt"),
+                       os.path.join(tmpdir, "test-c++filt"))
+            path = tmpdir + os.pathsep + os.environ.get("PATH", "")
+            with mock.patch.dict(os.environ, {"PATH": path}):
+                self.assertEqual(
+                    _FakeTarget().demangle(["_Z12test_targetsi", "main"]),
+                    ["test_targets(int)", "main"])
@@ -0,0 +1,51 @@
+import unittest
+
+from artiq.coredevice.comm_sim import Comm
+
+
+class _EmbeddingMap:
+    def retrieve_object(self, obj_key):
+        raise KeyError(obj_key)
+
+
+class LibraryReuseCase(unittest.TestCase):
+    def setUp(self):
+        self.comm = Comm()
+        self.comm.check_ident()
+
+    def _run(self, library):
+        self.comm.load(library)
+        self.comm.run()
+        self.comm.serve(_EmbeddingMap(), lambda addresses: [],
+                        lambda names: names)
+
+    def test_reuse(self):
+        for i in range(3):
+            self._run(b"kernel A")
+        self.assertEqual(self.comm.session.loads, 1)
+        self.assertEqual(self.comm.session.runs, [b"kernel A"]*3)
+        self.assertEqual(self.comm.library_uploads, 1)
+        self.assertEqual(self.comm.library_reuses, 2)
+
+    def test_changed_library(self):
+        self._run(b"kernel A")
+        self._run(b"kernel B")
+        self._run(b"kernel B")
+        self.assertEqual(self.comm.session.loads, 2)
+        self.assertEqual(self.comm.session.runs,
+                         [b"kernel A", b"kernel B", b"kernel B"])
+
+    def test_close(self):
+        self._run(b"kernel A")
+        self.comm.close()
+        self._run(b"kernel A")
+        self.assertEqual(self.comm.session.loads, 2)
+
+    def test_version_mismatch(self):
+        comm = Comm(ident="0.0")
+        with self.assertLogs("artiq.coredevice.comm_generic", "WARNING"):
+            comm.check_ident()
+        self.comm = comm
+        self._run(b"kernel A")
+        self._run(b"kernel A")
+        self.assertEqual(comm.session.loads, 2)
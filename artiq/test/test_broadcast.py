@@ -0,0 +1,98 @@
+import unittest
+import asyncio
+
+from artiq.protocols import broadcast
+
+
+test_address = "::1"
+test_port = 7777
+
+
+class BroadcastCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    async def _connect(self, received, **kwargs):
+        broadcaster = broadcast.Broadcaster(**kwargs)
+        await broadcaster.start(test_address, test_port)
+        receiver = broadcast.Receiver("test", received.append)
+        await receiver.connect(test_address, test_port)
+        # wait for the broadcaster to register the receiver
+        while not broadcaster.get_stats()["receivers"]:
+            await asyncio.sleep(0.01)
+        return broadcaster, receiver
+
+    async def _do_test_broadcast(self):
+        received = []
+        broadcaster, receiver = await self._connect(received, queue_limit=5)
+        try:
+            broadcaster.broadcast("other", 0)
+            # sent in a single write, the last ones are dropped
+            for i in range(10):
+                broadcaster.broadcast("test", i)
+            while len(received) < 5:
+                await asyncio.sleep(0.01)
+            self.assertEqual(received, list(range(5)))
+            stats, = broadcaster.get_stats()["receivers"]
+            self.assertEqual(
+                broadcast.BroadcasterStats(broadcaster).get_stats(),
+                broadcaster.get_stats())
+            self.assertEqual(stats["name"], "test")
+            self.assertEqual(stats["sent_messages"], 5)
+            self.assertEqual(stats["sent_bytes"], 10)
+            self.assertEqual(stats["dropped_messages"], 5)
+            self.assertEqual(stats["dropped_bytes"], 10)
+        finally:
+            await receiver.close()
+            await broadcaster.stop()
+
+    def test_broadcast(self):
+        self.loop.run_until_complete(self._do_test_broadcast())
+
+    async def _do_test_lossless(self):
+        received = []
+        broadcaster, receiver = await self._connect(received, lossless=True,
+                                                    max_buffer=20)
+        try:
+            for i in range(10):
+                broadcaster.broadcast("test", i)
+            while len(received) < 10:
+                await asyncio.sleep(0.01)
+            self.assertEqual(received, list(range(10)))
+
+            broadcaster.broadcast("test", "x"*100)
+            while broadcaster.get_stats()["receivers"]:
+                await asyncio.sleep(0.01)
+            self.assertEqual(broadcaster.get_stats()["disconnected"], 1)
+        finally:
+            await receiver.close()
+            await broadcaster.stop()
+
+    def test_lossless(self):
+        self.loop.run_until_complete(self._do_test_lossless())
+
+    async def _do_test_lossless_stalled(self):
+        received = []
+        broadcaster, receiver = await self._connect(received, lossless=True,
+                                                    max_buffer=4*1024*1024)
+        try:
+            # the receiver stops reading, so writes to it eventually block
+            receiver.receive_task.cancel()
+            line = "x"*1024*1024
+            for i in range(100):
+                if not broadcaster.get_stats()["receivers"]:
+                    break
+                broadcaster.broadcast("test", line)
+                await asyncio.sleep(0.01)
+            self.assertEqual(broadcaster.get_stats(),
+                             {"receivers": [], "disconnected": 1})
+        finally:
+            await receiver.close()
+            await broadcaster.stop()
+
+    def test_lossless_stalled(self):
+        self.loop.run_until_complete(self._do_test_lossless_stalled())
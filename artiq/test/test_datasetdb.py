@@ -0,0 +1,131 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from artiq.master.databases import DatasetDB
+from artiq.protocols import pyon
+
+
+class DatasetDBCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.persist_file = os.path.join(self.tmpdir.name, "dataset_db.pyon")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def reopen(self, db):
+        # simulates a crash: the snapshot is not rewritten
+        db._close_journal()
+        return DatasetDB(self.persist_file)
+
+    def test_journal_replay(self):
+        db = DatasetDB(self.persist_file)
+        db.set("a", 1, persist=True)
+        db.set("volatile", 2)
+        db.set("arr", np.zeros(3), persist=True)
+        db.update({"action": "setitem", "path": ["arr", 1],
+                   "key": slice(0, 2), "value": np.ones(2)})
+        db.update({"action": "append_array", "path": ["arr", 1],
+                   "x": np.arange(2)})
+        db.set("b", [], persist=True)
+        db.update({"action": "append", "path": ["b", 1], "x": 3})
+        db.set("c", 4, persist=True)
+        db.delete("c")
+
+        db = self.reopen(db)
+        self.assertEqual(set(db.data.read.keys()), {"a", "arr", "b"})
+        self.assertEqual(db.get("a"), 1)
+        self.assertEqual(db.get("b"), [3])
+        np.testing.assert_array_equal(db.get("arr"), [1, 1, 0, 0, 1])
+
+        # replayed journal is kept and appended to
+        db.set("a", 5, persist=False)
+        db = self.reopen(db)
+        self.assertNotIn("a", db.data.read)
+        self.assertEqual(db.get("b"), [3])
+
+    def test_truncated_entry(self):
+        db = DatasetDB(self.persist_file)
+        db.set("a", 1, persist=True)
+        db._close_journal()
+        with open(db.journal_file, "ab") as f:
+            f.write(b"{\"action\": \"setitem\"")
+
+        db = DatasetDB(self.persist_file)
+        self.assertEqual(db.get("a"), 1)
+        db.set("b", 2, persist=True)
+        db = self.reopen(db)
+        self.assertEqual(db.get("a"), 1)
+        self.assertEqual(db.get("b"), 2)
+
+    def test_compaction(self):
+        db = DatasetDB(self.persist_file)
+        db.set("a", [], persist=True)
+        for i in range(100):
+            db.update({"action": "append", "path": ["a", 1], "x": i})
+        db.sync()
+        self.assertEqual(pyon.load_file(self.persist_file),
+                         {"a": list(range(100))})
+        with open(db.journal_file, "rb") as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+        db.update({"action": "append", "path": ["a", 1], "x": 100})
+        db = self.reopen(db)
+        self.assertEqual(db.get("a"), list(range(101)))
+
+    def test_stale_journal(self):
+        db = DatasetDB(self.persist_file)
+        db.set("a", [], persist=True)
+        db.update({"action": "append", "path": ["a", 1], "x": 1})
+        db._close_journal()
+        with open(db.journal_file, "rb") as f:
+            journal = f.read()
+
+        # interrupted after writing the snapshot, before the new journal
+        db = DatasetDB(self.persist_file)
+        db.save()
+        db._close_journal()
+        with open(db.journal_file, "wb") as f:
+            f.write(journal)
+
+        db = DatasetDB(self.persist_file)
+        self.assertEqual(db.get("a"), [1])
+
+    @unittest.skipIf(os.name == "nt", "not supported on Windows")
+    def test_mmap(self):
+        db = DatasetDB(self.persist_file, mmap_threshold=800)
+        db.set("big", np.zeros(100), persist=True)
+        db.set("small", np.zeros(10), persist=True)
+        db.set("volatile", np.zeros(100))
+        self.assertIsInstance(db.get("big"), np.memmap)
+        self.assertNotIsInstance(db.get("small"), np.memmap)
+        self.assertNotIsInstance(db.get("volatile"), np.memmap)
+        pyon.encode(db.get("big"))
+
+        db.update({"action": "setitem", "path": ["big", 1],
+                   "key": 3, "value": 1.0})
+        db.update({"action": "append_array", "path": ["big", 1],
+                   "x": np.ones(2)})
+        self.assertIsInstance(db.get("big"), np.memmap)
+        # grows past the threshold
+        db.update({"action": "append_array", "path": ["small", 1],
+                   "x": np.ones(90)})
+        self.assertIsInstance(db.get("small"), np.memmap)
+        db.sync()
+        self.assertNotIn("big", pyon.load_file(self.persist_file))
+
+        db = self.reopen(db)
+        self.assertIsInstance(db.get("big"), np.memmap)
+        self.assertEqual(len(db.get("big")), 102)
+        self.assertEqual(db.get("big")[3], 1.0)
+        self.assertEqual(db.get("small")[-1], 1.0)
+
+        db.set("big", 42, persist=True)
+        db.delete("small")
+        db = self.reopen(db)
+        self.assertEqual(db.get("big"), 42)
+        self.assertNotIn("small", db.data.read)
+        self.assertEqual(os.listdir(db.array_dir), [])
@@ -0,0 +1,104 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+try:
+    import pygit2
+except ImportError:
+    pygit2 = None
+
+from artiq.master import experiments
+from artiq.master.experiments import GitBackend
+
+
+def _commit(repo, files, parents):
+    builder = repo.TreeBuilder()
+    subtrees = dict()
+    for path, data in files.items():
+        if "/" in path:
+            directory, name = path.split("/", 1)
+            subtrees.setdefault(directory, dict())[name] = data
+        else:
+            builder.insert(path, repo.create_blob(data),
+                           pygit2.GIT_FILEMODE_BLOB)
+    for directory, subfiles in subtrees.items():
+        subbuilder = repo.TreeBuilder()
+        for name, data in subfiles.items():
+            subbuilder.insert(name, repo.create_blob(data),
+                              pygit2.GIT_FILEMODE_BLOB)
+        builder.insert(directory, subbuilder.write(),
+                       pygit2.GIT_FILEMODE_TREE)
+    signature = pygit2.Signature("test", "test@example.com")
+    return str(repo.create_commit("HEAD", signature, signature, "test",
+                                  builder.write(), parents))
+
+
+def _read_tree(root):
+    r = dict()
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            with open(path, "rb") as f:
+                r[os.path.relpath(path, root).replace(os.sep, "/")] = \
+                    f.read()
+    return r
+
+
+@unittest.skipIf(pygit2 is None, "pygit2 is not installed")
+class GitBackendCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.repo = pygit2.init_repository(self.tmpdir.name, bare=True)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _check_update(self, files_from, files_to):
+        rev_from = _commit(self.repo, files_from, [])
+        rev_to = _commit(self.repo, files_to, [rev_from])
+        backend = GitBackend(self.tmpdir.name, max_checkouts=1)
+        try:
+            backend.request_rev(rev_from)
+            backend.release_rev(rev_from)
+            path, message = backend.request_rev(rev_to)
+            self.assertEqual(backend.stats["incremental_checkouts"], 1)
+            self.assertEqual(_read_tree(path), files_to)
+            backend.release_rev(rev_to)
+        finally:
+            backend.close()
+
+    def test_update(self):
+        self._check_update({"a.py": b"a", "b/c.py": b"c", "d.py": b"d"},
+                           {"a.py": b"a2", "b/e.py": b"e", "f.py": b"f"})
+
+    def test_directory_to_file(self):
+        self._check_update({"a/b": b"b", "c": b"c"},
+                           {"a": b"a", "c": b"c"})
+
+    def test_file_to_directory(self):
+        self._check_update({"a": b"a", "c": b"c"},
+                           {"a/b": b"b", "c": b"c"})
+
+
+class ScanCase(unittest.TestCase):
+    def test_cancelled_examine(self):
+        async def examine_file(root, filename, worker_handlers, worker_pool):
+            if filename == "cancelled.py":
+                raise asyncio.CancelledError
+            return {"Exp": {"name": "Exp", "arginfo": dict()}}
+
+        loop = asyncio.new_event_loop()
+        try:
+            with tempfile.TemporaryDirectory() as root:
+                for filename in "cancelled.py", "exp.py":
+                    open(os.path.join(root, filename), "w").close()
+                with mock.patch.object(experiments, "_examine_file",
+                                       examine_file):
+                    r = loop.run_until_complete(experiments._scan_experiments(
+                        root, None, None, dict(), 2))
+        finally:
+            loop.close()
+        self.assertEqual(r, {"Exp": {"file": "exp.py", "class_name": "Exp",
+                                     "arginfo": dict()}})
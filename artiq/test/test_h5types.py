@@ -3,6 +3,8 @@ import unittest
 import h5py
 import numpy as np
 
+from artiq.master.worker_db import DatasetManager
+
 
 class TypesCase(unittest.TestCase):
     def test_types(self):
@@ -25,3 +27,68 @@ class TypesCase(unittest.TestCase):
         with h5py.File("h5types.h5", "w", "core", backing_store=False) as f:
             for k, v in d.items():
                 f[k] = v
+
+
+class _DatasetDB:
+    def update(self, mod):
+        pass
+
+
+class DatasetWriteCase(unittest.TestCase):
+    def test_background_write(self):
+        mgr = DatasetManager(_DatasetDB())
+        mgr.set("image", np.arange(100000, dtype=np.int32))
+        mgr.set("mutated", np.zeros(100000))
+        mgr.set("small", np.arange(10))
+        mgr.set("scalar", 42)
+        mgr.set("list", [1, 2])
+
+        mgr.enable_compression()
+        with h5py.File("h5types.h5", "w", "core", backing_store=False) as f:
+            mgr.start_hdf5_write(f)
+            mgr.mutate("mutated", 3, 1.0)
+            mgr.mutate("list", 0, 3)
+            mgr.set("scalar", 43)
+            mgr.set("new", "abcdef")
+            mgr.write_hdf5(f)
+
+            self.assertEqual(f["image"].compression, "gzip")
+            self.assertTrue(f["image"].shuffle)
+            self.assertIsNone(f["small"].compression)
+            np.testing.assert_array_equal(f["image"][()],
+                                          np.arange(100000))
+            self.assertEqual(f["mutated"][3], 1.0)
+            self.assertEqual(list(f["list"][()]), [3, 2])
+            self.assertEqual(f["scalar"][()], 43)
+            self.assertEqual(f["new"][()], b"abcdef")
+
+    def test_uncompressed(self):
+        mgr = DatasetManager(_DatasetDB())
+        mgr.set("image", np.arange(100000, dtype=np.int32))
+        with h5py.File("h5types.h5", "w", "core", backing_store=False) as f:
+            mgr.write_hdf5(f)
+            self.assertIsNone(f["image"].compression)
+
+    def test_streaming(self):
+        mgr = DatasetManager(_DatasetDB())
+        mgr.enable_streaming(0)
+        mgr.set("before", np.arange(10))
+        mgr.set("scalar", 42)
+
+        with h5py.File("h5types.h5", "w", "core", backing_store=False,
+                       libver="latest") as f:
+            mgr.start_streaming(f)
+            self.assertNotIn("before", mgr.local)
+            mgr.set("points", np.zeros(0), broadcast=True)
+            for i in range(3):
+                mgr.extend("points", [i])
+            mgr.mutate("before", 0, 5)
+            self.assertEqual(list(mgr.get("points")), [0, 1, 2])
+            self.assertEqual(list(mgr.broadcast.read["points"][1]), [0, 1, 2])
+            self.assertEqual(mgr.get("before")[0], 5)
+
+            mgr.stop_streaming()
+            mgr.write_hdf5(f)
+            self.assertEqual(list(f["points"][()]), [0, 1, 2])
+            self.assertEqual(f["before"][0], 5)
+            self.assertEqual(f["scalar"][()], 42)
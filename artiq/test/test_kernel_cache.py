@@ -0,0 +1,121 @@
+import os
+import tempfile
+import unittest
+from collections import OrderedDict
+
+from artiq.compiler import asttyped, builtins, types
+from artiq.compiler.embedding import EmbeddingMap, TypedtreeDigester
+from artiq.compiler.kernel_cache import KernelCache
+
+
+class _Digester:
+    # tracks the host objects quoted by the kernel, like TypedtreeDigester
+    def __init__(self, objects):
+        self.objects = list(objects)
+
+    def object_index(self, obj_ref):
+        for index, obj in enumerate(self.objects):
+            if obj is obj_ref:
+                return index
+        return None
+
+
+class _Key:
+    # stands for the KernelCacheKey of a stitched kernel
+    def __init__(self, digest, stitched_objects, objects=()):
+        self.digest = digest
+        self.stitched_objects = stitched_objects
+        self.digester = _Digester(objects)
+
+
+class KernelCacheCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "cache")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_put_get(self):
+        cache = KernelCache(self.path)
+        stitched, generated = object(), object()
+        embedding_map = EmbeddingMap()
+        embedding_map.store_object(stitched)
+        key = _Key("a", 1, [stitched, generated])
+        self.assertIsNone(cache.get(key, embedding_map))
+
+        # code generation adds an object to the embedding map
+        embedding_map.store_object(generated)
+        cache.put(key, embedding_map, b"library", b"stripped")
+
+        # the same kernel, stitched again in another session
+        embedding_map = EmbeddingMap()
+        embedding_map.store_object(stitched)
+        self.assertEqual(KernelCache(self.path).get(key, embedding_map),
+                         (b"library", b"stripped"))
+        self.assertIs(embedding_map.retrieve_object(2), generated)
+        self.assertEqual(embedding_map.object_current_key, 2)
+        self.assertEqual(cache.get_stats(),
+                         {"hits": 0, "misses": 1, "evictions": 0})
+
+    def test_untracked_object(self):
+        cache = KernelCache(self.path)
+        embedding_map = EmbeddingMap()
+        embedding_map.store_object(object())
+        key = _Key("a", 0)
+        cache.put(key, embedding_map, b"library", b"stripped")
+        self.assertIsNone(cache.get(key, EmbeddingMap()))
+
+    def test_stitched_objects_mismatch(self):
+        cache = KernelCache(self.path)
+        cache.put(_Key("a", 1), EmbeddingMap(), b"library", b"stripped")
+        self.assertIsNone(cache.get(_Key("a", 2), EmbeddingMap()))
+        self.assertEqual(cache.get(_Key("a", 1), EmbeddingMap()),
+                         (b"library", b"stripped"))
+        self.assertEqual(cache.get_stats(),
+                         {"hits": 1, "misses": 1, "evictions": 0})
+
+    def test_eviction(self):
+        library = bytes(500)
+        # room for two entries
+        cache = KernelCache(self.path, max_size=2500)
+        for i, digest in enumerate("ab"):
+            cache.put(_Key(digest, 0), EmbeddingMap(), library, library)
+            # make the access times distinct and ordered
+            os.utime(os.path.join(self.path, digest), (i, i))
+        # "a" becomes the most recently used entry
+        self.assertIsNotNone(cache.get(_Key("a", 0), EmbeddingMap()))
+        cache.put(_Key("c", 0), EmbeddingMap(), library, library)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(sorted(os.listdir(self.path)), ["a", "c"])
+        self.assertIsNone(cache.get(_Key("b", 0), EmbeddingMap()))
+
+
+class _Invariant:
+    kernel_invariants = set()
+
+    def __init__(self):
+        self.x = 1
+
+
+class TypedtreeDigesterCase(unittest.TestCase):
+    def digest(self, value):
+        # build the types the way Stitcher._quote does
+        instance_type = types.TInstance("test._Invariant", OrderedDict())
+        instance_type.attributes["__objectid__"] = builtins.TInt32()
+        instance_type.attributes["x"] = builtins.TInt32()
+        constructor_type = types.TConstructor(instance_type)
+        constructor_type.attributes["__objectid__"] = builtins.TInt32()
+        instance_type.constructor = constructor_type
+        instance_type.constant_attributes = value.kernel_invariants
+
+        digester = TypedtreeDigester(EmbeddingMap())
+        digester.visit(asttyped.QuoteT(value=value, type=instance_type, loc=None))
+        return digester.hexdigest()
+
+    def test_kernel_invariants(self):
+        value = _Invariant()
+        digest = self.digest(value)
+        self.assertEqual(self.digest(value), digest)
+        value.kernel_invariants = {"x"}
+        self.assertNotEqual(self.digest(value), digest)
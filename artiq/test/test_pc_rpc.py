@@ -1,12 +1,13 @@
 import unittest
 import sys
+import socket
 import subprocess
 import asyncio
 import time
 
 import numpy as np
 
-from artiq.protocols import pc_rpc, fire_and_forget
+from artiq.protocols import pc_rpc, pyon, framing, fire_and_forget
 
 
 test_address = "::1"
@@ -14,6 +15,8 @@ test_port = 7777
 test_object = [5, 2.1, None, True, False,
                {"a": 5, 2: np.linspace(0, 10, 1)},
                (4, 5), (10,), "ab\nx\"'"]
+# larger than the line length limit of the text transport
+test_array = np.arange(2*1024*1024, dtype=np.int32).reshape(1024, -1)[:, ::2]
 
 
 class RPCCase(unittest.TestCase):
@@ -30,23 +33,56 @@ class RPCCase(unittest.TestCase):
                     proc.kill()
                     raise
 
-    def _blocking_echo(self, target):
+    def _blocking_echo(self, target, binary=False):
         for attempt in range(100):
             time.sleep(.2)
             try:
                 remote = pc_rpc.Client(test_address, test_port,
-                                       target)
+                                       target, binary=binary)
             except ConnectionRefusedError:
                 pass
             else:
                 break
         try:
+            self.assertEqual(remote.get_rpc_transport(),
+                             "binary" if binary else "text")
             test_object_back = remote.echo(test_object)
             self.assertEqual(test_object, test_object_back)
             test_object_back = remote.async_echo(test_object)
             self.assertEqual(test_object, test_object_back)
+            if binary:
+                test_array_back = remote.echo(test_array)
+                self.assertTrue(np.array_equal(test_array, test_array_back))
+                self.assertEqual(test_array.dtype, test_array_back.dtype)
             with self.assertRaises(AttributeError):
                 remote.non_existing_method()
+
+            futures = [remote.submit_rpc("echo", i) for i in range(10)]
+            self.assertEqual([f.result() for f in reversed(futures)],
+                             list(reversed(range(10))))
+            with remote.batch():
+                f1 = remote.async_echo(test_object)
+                f2 = remote.echo(2)
+                self.assertFalse(f2.done())
+            self.assertEqual(f1.result(), test_object)
+            self.assertEqual(f2.result(), 2)
+            with self.assertRaises(AttributeError):
+                with remote.batch():
+                    remote.echo(1)
+                    remote.non_existing_method()
+            # an exception in the block drops the calls
+            with self.assertRaises(ZeroDivisionError):
+                with remote.batch():
+                    f1 = remote.echo(1)
+                    1/0
+            with self.assertRaises(ValueError):
+                f1.result()
+            # replies that can no longer be waited for are not kept
+            remote.submit_rpc("echo", 1)
+            self.assertEqual(remote.echo(2), 2)
+            self.assertEqual(remote._Client__replies, dict())
+
+            self.assertTrue(remote.check_rpc_connection())
             remote.terminate()
         finally:
             remote.close_rpc()
@@ -57,32 +93,41 @@ class RPCCase(unittest.TestCase):
     def test_blocking_echo_autotarget(self):
         self._run_server_and_test(self._blocking_echo, pc_rpc.AutoTarget)
 
-    async def _asyncio_echo(self, target):
+    def test_blocking_echo_binary(self):
+        self._run_server_and_test(self._blocking_echo, "test", True)
+
+    async def _asyncio_echo(self, target, binary=False):
         remote = pc_rpc.AsyncioClient()
         for attempt in range(100):
             await asyncio.sleep(.2)
             try:
-                await remote.connect_rpc(test_address, test_port, target)
+                await remote.connect_rpc(test_address, test_port, target,
+                                         binary)
             except ConnectionRefusedError:
                 pass
             else:
                 break
         try:
+            self.assertEqual(remote.get_rpc_transport(),
+                             "binary" if binary else "text")
             test_object_back = await remote.echo(test_object)
             self.assertEqual(test_object, test_object_back)
             test_object_back = await remote.async_echo(test_object)
             self.assertEqual(test_object, test_object_back)
+            if binary:
+                test_array_back = await remote.echo(test_array)
+                self.assertTrue(np.array_equal(test_array, test_array_back))
             with self.assertRaises(AttributeError):
                 await remote.non_existing_method()
             await remote.terminate()
         finally:
             remote.close_rpc()
 
-    def _loop_asyncio_echo(self, target):
+    def _loop_asyncio_echo(self, target, binary=False):
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         try:
-            loop.run_until_complete(self._asyncio_echo(target))
+            loop.run_until_complete(self._asyncio_echo(target, binary))
         finally:
             loop.close()
 
@@ -92,6 +137,96 @@ class RPCCase(unittest.TestCase):
     def test_asyncio_echo_autotarget(self):
         self._run_server_and_test(self._loop_asyncio_echo, pc_rpc.AutoTarget)
 
+    def test_asyncio_echo_binary(self):
+        self._run_server_and_test(self._loop_asyncio_echo, "test", True)
+
+
+class FrameCase(unittest.TestCase):
+    def _frames(self):
+        header = framing.frame_header
+        length = framing.buffer_length
+        yield header.pack(pc_rpc._max_frame_size + 1, 0)
+        yield header.pack(4, 1) + length.pack(pc_rpc._max_frame_size)
+
+    def test_size_limit_blocking(self):
+        for frame in self._frames():
+            a, b = socket.socketpair()
+            try:
+                a.sendall(frame)
+                with self.assertRaises(ValueError):
+                    pc_rpc._recv_frame(b)
+            finally:
+                a.close()
+                b.close()
+
+    def test_size_limit_asyncio(self):
+        async def read(frame):
+            reader = asyncio.StreamReader()
+            reader.feed_data(frame)
+            return await framing.read_frame(reader, pc_rpc._max_frame_size)
+
+        loop = asyncio.new_event_loop()
+        try:
+            for frame in self._frames():
+                with self.assertRaises(ValueError):
+                    loop.run_until_complete(read(frame))
+            frame = b"".join(framing.encode_frame(test_object))
+            self.assertEqual(loop.run_until_complete(read(frame)),
+                             test_object)
+        finally:
+            loop.close()
+
+
+class _Waiter:
+    def __init__(self):
+        self.started = 0
+        self.event = asyncio.Event()
+
+    async def wait(self, x):
+        self.started += 1
+        await self.event.wait()
+        return x
+
+
+class InFlightCase(unittest.TestCase):
+    async def _do_test_max_in_flight(self):
+        waiter = _Waiter()
+        server = pc_rpc.Server({"test": waiter}, allow_parallel=True,
+                               max_in_flight=2)
+        await server.start(test_address, test_port)
+        try:
+            reader, writer = await asyncio.open_connection(test_address,
+                                                           test_port)
+            try:
+                writer.write(pc_rpc._init_string)
+                await reader.readline()
+                writer.write(b"test\n")
+                for i in range(5):
+                    request = {"action": "call", "name": "wait",
+                               "args": [i], "kwargs": {}, "id": i}
+                    writer.write(pyon.encode_to_bytes(request, end=b"\n"))
+                await asyncio.sleep(0.2)
+                self.assertEqual(waiter.started, 2)
+
+                waiter.event.set()
+                replies = []
+                for i in range(5):
+                    replies.append(pyon.decode((await reader.readline()).decode()))
+                self.assertEqual(sorted(reply["ret"] for reply in replies),
+                                 list(range(5)))
+            finally:
+                writer.close()
+        finally:
+            await server.stop()
+
+    def test_max_in_flight(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._do_test_max_in_flight())
+        finally:
+            loop.close()
+
 
 class FireAndForgetCase(unittest.TestCase):
     def _set_ok(self):
@@ -3,6 +3,8 @@ import sys
 import asyncio
 import os
 
+import numpy as np
+
 from artiq.protocols import pipe_ipc
 
 
@@ -37,6 +39,23 @@ class IPCCase(unittest.TestCase):
     def test_asyncio(self):
         self.loop.run_until_complete(self._coro_test(True))
 
+    async def _coro_test_frames(self):
+        ipc = pipe_ipc.AsyncioParentComm()
+        await ipc.create_subprocess(sys.executable,
+                                    sys.modules[__name__].__file__,
+                                    "frames", ipc.get_address())
+        for i in range(10):
+            ipc.write_frame({"x": i, "a": np.arange(i*1000)})
+            await ipc.drain()
+            obj = await ipc.read_frame()
+            self.assertEqual(obj["x"], i+1)
+            np.testing.assert_array_equal(obj["a"], np.arange(i*1000) + 1)
+        ipc.write_frame(None)
+        await ipc.process.wait()
+
+    def test_frames(self):
+        self.loop.run_until_complete(self._coro_test_frames())
+
 
 def run_child_blocking():
     child_comm = pipe_ipc.ChildComm(sys.argv[2])
@@ -48,6 +67,16 @@ def run_child_blocking():
     child_comm.close()
 
 
+def run_child_frames():
+    child_comm = pipe_ipc.ChildComm(sys.argv[2])
+    while True:
+        obj = child_comm.read_frame()
+        if obj is None:
+            break
+        child_comm.write_frame({"x": obj["x"] + 1, "a": obj["a"] + 1})
+    child_comm.close()
+
+
 async def coro_child():
     child_comm =  pipe_ipc.AsyncioChildComm(sys.argv[2])
     await child_comm.connect()
@@ -73,6 +102,8 @@ def run_child_asyncio():
 def run_child():
     if sys.argv[1] == "True":
         run_child_asyncio()
+    elif sys.argv[1] == "frames":
+        run_child_frames()
     else:
         run_child_blocking()
 
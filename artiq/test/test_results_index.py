@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+
+from artiq.master.worker_db import (RIDCounter, ResultsIndex,
+                                    ResultsIndexReader,
+                                    results_index_filename)
+
+
+class ResultsIndexCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.results_dir = os.path.join(self.tmpdir.name, "results")
+        self.cache_filename = os.path.join(self.tmpdir.name, "last_rid.pyon")
+        os.mkdir(self.results_dir)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_lookup(self):
+        index = ResultsIndex(results_index_filename(self.results_dir))
+        self.assertIsNone(index.last_rid())
+        index.add(12, "Foo", 1000, None, "2016-01-01/00/000000012-Foo.h5")
+        index.add(3, "Bar", 900, "abcd", "2015-12-31/23/000000003-Bar.h5")
+        self.assertEqual(index.last_rid(), 12)
+        self.assertEqual(index.get(3)["repo_rev"], "abcd")
+        self.assertEqual(index.get(12)["path"],
+                         "2016-01-01/00/000000012-Foo.h5")
+        self.assertIsNone(index.get(4))
+        reader = ResultsIndexReader(index)
+        self.assertEqual(reader.get(3), index.get(3))
+        self.assertEqual(reader.last_rid(), 12)
+        self.assertFalse(hasattr(reader, "add"))
+        self.assertFalse(hasattr(reader, "close"))
+        index.close()
+
+    def test_rid_recovery(self):
+        # the index takes precedence over the (empty) results directory
+        index = ResultsIndex(results_index_filename(self.results_dir))
+        index.add(41, "Foo", 1000, None, "2016-01-01/00/000000041-Foo.h5")
+        index.close()
+        rid_counter = RIDCounter(self.cache_filename, self.results_dir)
+        self.assertEqual(rid_counter.get(), 42)
+
+    def test_rid_recovery_empty_index(self):
+        ResultsIndex(results_index_filename(self.results_dir)).close()
+        hour_dir = os.path.join(self.results_dir, "2016-01-01", "00")
+        os.makedirs(hour_dir)
+        open(os.path.join(hour_dir, "000000007-Foo.h5"), "w").close()
+        rid_counter = RIDCounter(self.cache_filename, self.results_dir)
+        self.assertEqual(rid_counter.get(), 8)
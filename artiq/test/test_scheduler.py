@@ -3,10 +3,11 @@ import logging
 import asyncio
 import sys
 import os
+import tempfile
 from time import time, sleep
 
 from artiq.experiment import *
-from artiq.master.scheduler import Scheduler
+from artiq.master.scheduler import Scheduler, RunStatus
 
 
 class EmptyExperiment(EnvExperiment):
@@ -31,12 +32,27 @@ class BackgroundExperiment(EnvExperiment):
                              broadcast=True, save=False)
 
 
-def _get_expid(name):
+class WaitExperiment(EnvExperiment):
+    def build(self):
+        self.setattr_argument("file", StringValue())
+
+    def run(self):
+        # wait for the test to create <file>
+        deadline = time() + 30
+        while not os.path.exists(self.file):
+            if time() > deadline:
+                raise IOError("timeout waiting for " + self.file)
+            sleep(0.01)
+
+
+def _get_expid(name, arguments=None):
+    if arguments is None:
+        arguments = dict()
     return {
         "log_level": logging.WARNING,
         "file": sys.modules[__name__].__file__,
         "class_name": name,
-        "arguments": dict()
+        "arguments": arguments
     }
 
 
@@ -72,6 +88,11 @@ class _RIDCounter:
         self._next_rid += 1
         return rid
 
+    def get_block(self, n):
+        rid = self._next_rid
+        self._next_rid += n
+        return rid
+
 
 class SchedulerCase(unittest.TestCase):
     def setUp(self):
@@ -80,6 +101,10 @@ class SchedulerCase(unittest.TestCase):
         else:
             self.loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.loop)
+        # workers write results into the current directory
+        self.cwd = os.getcwd()
+        self.results_tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.results_tmpdir.name)
 
     def test_steps(self):
         loop = self.loop
@@ -117,6 +142,109 @@ class SchedulerCase(unittest.TestCase):
         scheduler.notifier.publish = None
         loop.run_until_complete(scheduler.stop())
 
+    def test_submit_delete_many(self):
+        loop = self.loop
+        scheduler = Scheduler(_RIDCounter(0), dict(), None)
+        expid = _get_expid("EmptyExperiment")
+        late = time() + 100000
+
+        mods = []
+        deleted = set()
+        done = asyncio.Event()
+        def notify(mod):
+            mods.append(mod)
+            if mod["action"] == "delitem":
+                deleted.add(mod["key"])
+                if deleted == {0, 1, 2}:
+                    done.set()
+        scheduler.notifier.publish = notify
+
+        scheduler.start()
+        rids = scheduler.submit_many([
+            ("main", expid, 0, None, False),
+            ("main", expid, 0, late, False),
+            ("other", expid, 0, late, False)
+        ])
+        self.assertEqual(rids, [0, 1, 2])
+        self.assertEqual(mods[0], {
+            "action": "update", "path": [],
+            "items": {
+                0: {"pipeline": "main", "status": "pending", "priority": 0,
+                    "expid": expid, "due_date": None, "flush": False,
+                    "repo_msg": None},
+                1: {"pipeline": "main", "status": "pending", "priority": 0,
+                    "expid": expid, "due_date": late, "flush": False,
+                    "repo_msg": None},
+                2: {"pipeline": "other", "status": "pending", "priority": 0,
+                    "expid": expid, "due_date": late, "flush": False,
+                    "repo_msg": None}
+            }})
+        scheduler.delete_many([1, 2])
+        loop.run_until_complete(done.wait())
+        scheduler.notifier.publish = None
+        loop.run_until_complete(scheduler.stop())
+
+    def test_submit_many_error(self):
+        scheduler = Scheduler(_RIDCounter(0), dict(), None)
+        expid = _get_expid("EmptyExperiment")
+        # there is no experiment database to get the revision from
+        expid_repo = dict(expid, repo_rev=None)
+
+        mods = []
+        scheduler.notifier.publish = mods.append
+        scheduler.start()
+        with self.assertRaises(AttributeError):
+            scheduler.submit_many([
+                ("main", expid, 0, None, False),
+                ("main", expid_repo, 0, None, False)
+            ])
+        self.assertEqual(mods, [])
+        self.assertEqual(scheduler.notifier.read, dict())
+        pool = scheduler._pipelines["main"].pool
+        self.assertEqual(pool.runs, dict())
+        self.assertEqual(len(pool.queues[RunStatus.pending]), 0)
+        self.assertEqual(pool.status_counts[RunStatus.pending], 0)
+        scheduler.notifier.publish = None
+        self.loop.run_until_complete(scheduler.stop())
+
+    def test_concurrency(self):
+        loop = self.loop
+        scheduler = Scheduler(_RIDCounter(0), dict(), None,
+                              pipeline_concurrency={"host": 2})
+        tmpdir = tempfile.TemporaryDirectory()
+        release = os.path.join(tmpdir.name, "release")
+        # the runs wait until two of them are running at the same time
+        expid = _get_expid("WaitExperiment", {"file": release})
+
+        running = set()
+        max_running = 0
+        deleted = set()
+        done = asyncio.Event()
+        def notify(mod):
+            nonlocal max_running
+            if mod["path"] and mod["key"] == "status":
+                if mod["value"] == "running":
+                    running.add(mod["path"][0])
+                    max_running = max(max_running, len(running))
+                    if len(running) == 2:
+                        open(release, "w").close()
+                else:
+                    running.discard(mod["path"][0])
+            if mod["action"] == "delitem":
+                deleted.add(mod["key"])
+                if len(deleted) == 3:
+                    done.set()
+        scheduler.notifier.publish = notify
+
+        scheduler.start()
+        for i in range(3):
+            scheduler.submit("host", expid, 0, None, False)
+        loop.run_until_complete(asyncio.wait_for(done.wait(), 30))
+        self.assertEqual(max_running, 2)
+        scheduler.notifier.publish = None
+        loop.run_until_complete(scheduler.stop())
+        tmpdir.cleanup()
+
     def test_pause(self):
         loop = self.loop
 
@@ -173,6 +301,51 @@ class SchedulerCase(unittest.TestCase):
 
         loop.run_until_complete(scheduler.stop())
 
+    def test_timed_preparation(self):
+        loop = self.loop
+        scheduler = Scheduler(_RIDCounter(0), dict(), None)
+        tmpdir = tempfile.TemporaryDirectory()
+        release = os.path.join(tmpdir.name, "release")
+        expid_wait = _get_expid("WaitExperiment", {"file": release})
+        expid = _get_expid("EmptyExperiment")
+
+        wait_running = asyncio.Event()
+        low_prepared = asyncio.Event()
+        high_preparing = asyncio.Event()
+        deleted = set()
+        done = asyncio.Event()
+        def notify(mod):
+            if mod == {"path": [0], "value": "running",
+                       "key": "status", "action": "setitem"}:
+                wait_running.set()
+            if mod == {"path": [1], "value": "prepare_done",
+                       "key": "status", "action": "setitem"}:
+                low_prepared.set()
+            if mod == {"path": [2], "value": "preparing",
+                       "key": "status", "action": "setitem"}:
+                high_preparing.set()
+            if mod["action"] == "delitem":
+                deleted.add(mod["key"])
+                if len(deleted) == 3:
+                    done.set()
+        scheduler.notifier.publish = notify
+
+        scheduler.start()
+        scheduler.submit("main", expid_wait, 0, None, False)
+        loop.run_until_complete(wait_running.wait())
+        scheduler.submit("main", expid, 0, None, False)
+        loop.run_until_complete(low_prepared.wait())
+        # A timed run that outranks the prepared run must get prepared
+        # as soon as it is due, while the run stage is still busy.
+        scheduler.submit("main", expid, 1, time() + 0.5, False)
+        loop.run_until_complete(
+            asyncio.wait_for(high_preparing.wait(), 10))
+        open(release, "w").close()
+        loop.run_until_complete(done.wait())
+        scheduler.notifier.publish = None
+        loop.run_until_complete(scheduler.stop())
+        tmpdir.cleanup()
+
     def test_flush(self):
         loop = self.loop
         scheduler = Scheduler(_RIDCounter(0), dict(), None)
@@ -209,3 +382,5 @@ class SchedulerCase(unittest.TestCase):
 
     def tearDown(self):
         self.loop.close()
+        os.chdir(self.cwd)
+        self.results_tmpdir.cleanup()
@@ -16,6 +16,7 @@ _pyon_test_object = {
     "x": np.float16(9.0), "y": np.float32(9.0), "z": np.float64(9.0),
     1j: 1-9j,
     "q": np.complex128(1j),
+    "slices": (slice(1, None, 2), slice(None, -1, None)),
 }
 
 
@@ -36,6 +37,59 @@ class PYON(unittest.TestCase):
                 with self.subTest(enc=enc, k=k, v=orig[k]):
                     np.testing.assert_equal(result[k], orig[k])
 
+    def test_decode_syntax(self):
+        for s, expected in [
+                ("# comment\n{\"a\": 1,  # comment\n \"b\": (1, )}", {"a": 1, "b": (1, )}),
+                ("[1, 2, 3, ]", [1, 2, 3]),
+                ("[1.5, -2e-07, 3]", [1.5, -2e-07, 3]),
+                ("(1-2j)", 1-2j),
+                ("{1, 2}", {1, 2}),
+                ("'single' ", "single"),
+                ("\"\\x41\\t\"", "A\t"),
+                ("b'\\x00\"'", b"\x00\""),
+                ("[None, True, null, false]", [None, True, None, False]),
+                ("0x10", 16),
+                ("[0o17, -0b101]", [15, -5])]:
+            with self.subTest(s=s):
+                decoded = pyon.decode(s)
+                self.assertEqual(decoded, expected)
+                self.assertEqual(type(decoded), type(expected))
+
+    def test_decode_invalid(self):
+        for s in ["1 + 1", "__import__('os')", "foo", "[1, 2", "{1: 2, 3}",
+                  "(" * 100000 + ")" * 100000]:
+            with self.subTest(s=s[:20]):
+                with self.assertRaises(ValueError):
+                    pyon.decode(s)
+        for s in ["nparray((1000000, 1000000), \"<f8\", b\"AAAAAAAAAAA=\")",
+                  "nparray((1, ), \"O\", b\"AAAAAAAAAAA=\")"]:
+            with self.subTest(s=s):
+                with self.assertRaises(ValueError):
+                    pyon.decode(s)
+        with self.assertRaises(ValueError):
+            pyon.decode_with_buffers("npbuffer(0, (1, ), \"i4\") + 1",
+                                     [bytearray(4)])
+
+    def test_encode_to_bytes(self):
+        orig = {"a": np.arange(10), "b": [1, 2.5, np.int32(3)], "é": "ü\n",
+                "c": np.arange(12).reshape(3, 4)[:, ::2]}
+        for pretty in False, True:
+            with self.subTest(pretty=pretty):
+                self.assertEqual(pyon.encode_to_bytes(orig, pretty, end=b"\n"),
+                                 (pyon.encode(orig, pretty) + "\n").encode())
+        result = pyon.decode(pyon.encode_to_bytes(orig).decode())
+        np.testing.assert_equal(result["c"], orig["c"])
+
+    def test_encdec_special_floats(self):
+        orig = [float("inf"), -float("inf")]
+        self.assertEqual(pyon.decode(pyon.encode(orig)), orig)
+
+    def test_encdec_large_array(self):
+        orig = np.random.uniform(size=(300, 2000))
+        result = pyon.decode(pyon.encode(orig))
+        self.assertEqual(result.dtype, orig.dtype)
+        np.testing.assert_equal(result, orig)
+
 
 _json_test_object = {
     "a": "b",
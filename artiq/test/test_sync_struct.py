@@ -2,7 +2,7 @@ import unittest
 import asyncio
 import numpy as np
 
-from artiq.protocols import sync_struct
+from artiq.protocols import sync_struct, pyon
 
 test_address = "::1"
 test_port = 7777
@@ -26,6 +26,8 @@ def write_test_data(test_dict):
     test_dict.pop(101)
     test_dict[102] = 1
     del test_dict[102]
+    test_dict.update({"update": 1, 103: [2]})
+    test_dict[103].append(3)
     test_dict["array"] = np.zeros(1)
     test_dict["array"][0] = 10
     test_dict["finished"] = True
@@ -45,11 +47,11 @@ class SyncStructCase(unittest.TestCase):
         self.loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.loop)
 
-    async def _do_test_recv(self):
+    async def _do_test_recv(self, **kwargs):
         self.receiving_done = asyncio.Event()
 
         test_dict = sync_struct.Notifier(dict())
-        publisher = sync_struct.Publisher({"test": test_dict})
+        publisher = sync_struct.Publisher({"test": test_dict}, **kwargs)
         await publisher.start(test_address, test_port)
 
         subscriber = sync_struct.Subscriber("test", self.init_test_dict,
@@ -67,5 +69,97 @@ class SyncStructCase(unittest.TestCase):
     def test_recv(self):
         self.loop.run_until_complete(self._do_test_recv())
 
+    def test_recv_rate_limited(self):
+        self.loop.run_until_complete(self._do_test_recv(max_rate=10))
+
+    def test_recv_reinit(self):
+        self.loop.run_until_complete(self._do_test_recv(max_queue=2))
+
     def tearDown(self):
         self.loop.close()
+
+
+class RecipientCase(unittest.TestCase):
+    def put(self, recipient, mod):
+        recipient.put(sync_struct._coalescing_location(mod),
+                      pyon.encode(mod))
+
+    def test_coalesce(self):
+        recipient = sync_struct._Recipient(None)
+        for i in range(3):
+            self.put(recipient, {"action": "setitem", "path": ["a", 1],
+                                 "key": 2, "value": i})
+            self.put(recipient, {"action": "setitem", "path": [],
+                                 "key": "b", "value": i})
+        lines = recipient.take()
+        self.assertEqual([pyon.decode(line)["value"] for line in lines],
+                         [2, 2])
+        self.assertEqual(recipient.take(), [])
+
+    def test_no_coalesce(self):
+        recipient = sync_struct._Recipient(None)
+        mods = [
+            {"action": "setitem", "path": ["l"], "key": 0, "value": 1},
+            {"action": "insert", "path": ["l"], "i": 0, "x": 0},
+            {"action": "setitem", "path": ["l"], "key": 0, "value": 2},
+            {"action": "setitem", "path": [], "key": "l", "value": []},
+            {"action": "setitem", "path": ["l"], "key": slice(0, 1),
+             "value": [1]},
+            {"action": "setitem", "path": [], "key": "l", "value": []}
+        ]
+        for mod in mods:
+            self.put(recipient, mod)
+        self.assertEqual([pyon.decode(line) for line in recipient.take()],
+                         mods)
+
+    def test_coalesce_bounded(self):
+        recipient = sync_struct._Recipient(2)
+        for i in range(1000):
+            self.put(recipient, {"action": "setitem", "path": [],
+                                 "key": "a", "value": i})
+        self.assertFalse(recipient.reinit)
+        self.assertEqual(len(recipient._lines), 1)
+        self.assertEqual([pyon.decode(line)["value"]
+                          for line in recipient.take()], [999])
+
+    def test_reinit(self):
+        recipient = sync_struct._Recipient(3)
+        for i in range(4):
+            self.put(recipient, {"action": "append", "path": [], "x": i})
+        self.assertTrue(recipient.reinit)
+        self.assertEqual(recipient.take(), [])
+
+
+class VectorizedModCase(unittest.TestCase):
+    def test_process_mods(self):
+        mods = []
+        notifier = sync_struct.Notifier({
+            "array": (False, np.zeros(4)),
+            "list": (True, [1])
+        })
+        notifier.publish = mods.append
+        notifier["array"][1][1:3] = np.array([1.0, 2.0])
+        notifier["array"][1].append_array(np.array([3.0, 4.0]))
+        notifier["list"][1].append_array([2, 3])
+        self.assertEqual(len(mods), 3)
+
+        replica = {"array": (False, np.zeros(4)), "list": (True, [1])}
+        for mod in mods:
+            sync_struct.process_mod(replica, pyon.decode(pyon.encode(mod)))
+
+        for struct in notifier.read, replica:
+            self.assertEqual(struct["array"][0], False)
+            np.testing.assert_equal(struct["array"][1],
+                                    [0.0, 1.0, 2.0, 0.0, 3.0, 4.0])
+            self.assertEqual(struct["list"], (True, [1, 2, 3]))
+
+    def test_append_array_root(self):
+        root = [1]
+        sync_struct.process_mod(
+            root, {"action": "append_array", "path": [], "x": [2, 3]})
+        self.assertEqual(root, [1, 2, 3])
+        for root, path in ((np.zeros(2), []), ((False, np.zeros(2)), [1])):
+            with self.assertRaises(TypeError):
+                sync_struct.process_mod(
+                    root, {"action": "append_array", "path": path,
+                           "x": np.ones(2)})
@@ -3,6 +3,7 @@ import logging
 import asyncio
 import sys
 import os
+import tempfile
 from time import sleep
 
 from artiq.experiment import *
@@ -53,6 +54,19 @@ class WatchdogTimeoutInBuild(EnvExperiment):
         pass
 
 
+class DeviceDBLookups(EnvExperiment):
+    def build(self):
+        assert self.get_device_db() == {"alias": "target", "target": {}}
+        assert self.get_device_db() == {"alias": "target", "target": {}}
+        # lookups must not modify the snapshot
+        ddb = self._HasEnvironment__device_mgr.ddb
+        ddb.get("target")["class"] = "Modified"
+        assert ddb.get("target") == {}
+
+    def run(self):
+        pass
+
+
 async def _call_worker(worker, expid):
     try:
         await worker.build(0, "main", None, expid, 0)
@@ -63,7 +77,7 @@ async def _call_worker(worker, expid):
         await worker.close()
 
 
-def _run_experiment(class_name):
+def _run_experiment(class_name, worker_pool=None, handlers=None):
     expid = {
         "log_level": logging.WARNING,
         "file": sys.modules[__name__].__file__,
@@ -71,8 +85,11 @@ def _run_experiment(class_name):
         "arguments": dict()
     }
     loop = asyncio.get_event_loop()
-    worker = Worker({})
+    if handlers is None:
+        handlers = dict()
+    worker = Worker(handlers, worker_pool=worker_pool)
     loop.run_until_complete(_call_worker(worker, expid))
+    return worker
 
 
 class WorkerCase(unittest.TestCase):
@@ -82,6 +99,10 @@ class WorkerCase(unittest.TestCase):
         else:
             self.loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.loop)
+        # workers write results into the current directory
+        self.cwd = os.getcwd()
+        self.results_tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.results_tmpdir.name)
 
     def test_simple_run(self):
         _run_experiment("SimpleExperiment")
@@ -105,5 +126,67 @@ class WorkerCase(unittest.TestCase):
         with self.assertRaises(WorkerWatchdogTimeout):
             _run_experiment("WatchdogTimeoutInBuild")
 
+    def test_pool(self):
+        pool = WorkerPool(1, max_runs=2)
+        pool.start()
+        try:
+            processes = [_run_experiment("SimpleExperiment", pool).process
+                         for i in range(3)]
+            with self.assertRaises(WorkerInternalException):
+                _run_experiment("ExceptionTermination", pool)
+            _run_experiment("SimpleExperiment", pool)
+        finally:
+            self.loop.run_until_complete(pool.close())
+        self.assertIs(processes[0], processes[1])
+        self.assertIsNot(processes[1], processes[2])
+
+    def test_device_db_snapshot(self):
+        requests = []
+
+        def get_device_db_snapshot(generation):
+            requests.append(generation)
+            if generation == 1:
+                return None
+            return 1, {"alias": "target", "target": {}}
+
+        handlers = {"get_device_db_snapshot": get_device_db_snapshot}
+        pool = WorkerPool(1, max_runs=2)
+        pool.start()
+        try:
+            for i in range(2):
+                _run_experiment("DeviceDBLookups", pool, handlers)
+        finally:
+            self.loop.run_until_complete(pool.close())
+        # one check per run, and the process is reused
+        self.assertEqual(requests, [None, 1])
+
+    def test_unload_modules(self):
+        from artiq.master.worker_impl import unload_modules
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            site_packages = os.path.join(tmpdir, "venv", "site-packages")
+            os.makedirs(site_packages)
+            for directory, name in ((tmpdir, "unload_preloaded"),
+                                    (tmpdir, "unload_helper"),
+                                    (site_packages, "unload_installed")):
+                with open(os.path.join(directory, name + ".py"), "w"):
+                    pass
+            sys.path[:0] = [tmpdir, site_packages]
+            try:
+                import unload_preloaded
+                loaded_before = set(sys.modules.keys())
+                import unload_helper, unload_installed
+                unload_modules(tmpdir, loaded_before)
+                self.assertIn("unload_preloaded", sys.modules)
+                self.assertNotIn("unload_helper", sys.modules)
+                self.assertIn("unload_installed", sys.modules)
+            finally:
+                del sys.path[:2]
+                for name in ("unload_preloaded", "unload_helper",
+                             "unload_installed"):
+                    sys.modules.pop(name, None)
+
     def tearDown(self):
         self.loop.close()
+        os.chdir(self.cwd)
+        self.results_tmpdir.cleanup()
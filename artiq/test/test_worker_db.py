@@ -0,0 +1,70 @@
+import unittest
+import asyncio
+import threading
+
+from artiq.protocols import pc_rpc
+from artiq.master.worker_db import ClientPool
+
+
+test_address = "::1"
+test_port = 7777
+
+
+class Echo:
+    def echo(self, x):
+        return x
+
+
+class ClientPoolCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self._stop_server()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def _start_server(self):
+        async def start():
+            server = pc_rpc.Server({"test": Echo()})
+            await server.start(test_address, test_port)
+            return server
+        self.server = self._run(start())
+
+    def _stop_server(self):
+        # closes the connections of the clients
+        self._run(self.server.stop())
+        self.server = None
+
+    def test_reuse_reconnect(self):
+        pool = ClientPool()
+        key = test_address, test_port, "test"
+        self._start_server()
+        try:
+            client = pool.get(*key)
+            self.assertEqual(client.echo(1), 1)
+            pool.put(key, client)
+            self.assertIs(pool.get(*key), client)
+            self.assertEqual(client.echo(2), 2)
+            pool.put(key, client)
+            self.assertEqual((pool.connects, pool.reuses, pool.reconnects),
+                             (1, 1, 0))
+
+            self._stop_server()
+            self._start_server()
+            new_client = pool.get(*key)
+            self.assertIsNot(new_client, client)
+            self.assertEqual(new_client.echo(3), 3)
+            self.assertEqual((pool.connects, pool.reuses, pool.reconnects),
+                             (2, 1, 1))
+            pool.put(key, new_client)
+        finally:
+            pool.close()